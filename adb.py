@@ -0,0 +1,662 @@
+import os
+import socket
+import subprocess
+import threading
+import time
+from contextlib import closing
+from typing import Callable, Iterator, NamedTuple, Optional
+
+import instrumentation
+
+# printed by the device shell after every command so results can be split apart
+RESULT_MARKER = "__android_debloater_done__"
+ADB_SERVER_HOST = "127.0.0.1"
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+CONNECT_TIMEOUT = 5
+# seconds a device connection may stay silent before a read fails, such as on a hung
+# USB hub; `dumpsys` gets longer since it can compute for a while before printing
+READ_TIMEOUT = 60
+DUMPSYS_READ_TIMEOUT = 300
+# older devices accept at most 4096 bytes for a service request
+MAX_SERVICE_LENGTH = 4000
+# the primary user of a device, the only one on most phones; work profiles and
+# secondary users get ids such as 10 or 11
+DEFAULT_USER = 0
+
+
+class AdbError(Exception):
+    """Raised when the adb server cannot be reached or rejects a request."""
+
+
+class Device(NamedTuple):
+    """A device as reported by `adb devices -l`."""
+
+    serial: str
+    state: str
+    model: str
+
+
+class User(NamedTuple):
+    """An Android user or work profile as reported by `pm list users`."""
+
+    user_id: int
+    name: str
+
+
+class PackageResult(NamedTuple):
+    """Outcome of a single package command run on the device."""
+
+    package: str
+    success: bool
+    message: str
+    user: int = DEFAULT_USER
+
+
+def read_exactly(connection: socket.socket, size: int) -> bytes:
+    """Reads exactly `size` bytes from a socket.
+
+    Raises:
+        ConnectionError: If the connection is closed before all bytes arrive.
+    """
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("The adb server closed the connection.")
+        data += chunk
+    return data
+
+
+class AdbClient:
+    """Client for the TCP protocol of the adb server.
+
+    Requests are sent directly to the adb server socket instead of spawning the adb
+    executable. Every device request opens its own connection: the handshake with the
+    local server takes a fraction of a millisecond, far less than the device round trip.
+    """
+
+    def __init__(self, host: str = ADB_SERVER_HOST, port: int = ADB_SERVER_PORT) -> None:
+        """Initializes a client for the adb server listening on host:port."""
+        self.host = host
+        self.port = port
+        self.active = set()  # connections of the shell commands being read
+        self.lock = threading.Lock()
+        self.server_started = False  # whether the server was started since the last connection
+
+    def connect(self) -> socket.socket:
+        """Opens a connection to the adb server, starting the server if it is not running.
+
+        The server is started at most once per outage: if it cannot be reached right after
+        being started, the error is raised, and it is started again only if it was
+        reachable in between, such as after `adb kill-server`.
+
+        Raises:
+            AdbError: If the adb server cannot be reached or started.
+        """
+        try:
+            connection = socket.create_connection(
+                (self.host, self.port), timeout=CONNECT_TIMEOUT
+            )
+        except ConnectionRefusedError as error:
+            if self.server_started:
+                raise AdbError(f"Cannot connect to the adb server: {error}") from error
+            self.start_server()
+            return self.connect()
+        self.server_started = False
+        connection.settimeout(READ_TIMEOUT)
+        return connection
+
+    def start_server(self) -> None:
+        """Starts the adb server with the adb executable.
+
+        Raises:
+            AdbError: If the adb executable is missing or fails to start the server.
+        """
+        self.server_started = True
+        start = time.perf_counter()
+        try:
+            subprocess.run(
+                ["adb", "-P", str(self.port), "start-server"],
+                check=True,
+                capture_output=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as error:
+            instrumentation.record_adb(
+                "adb start-server", None, start, status=instrumentation.error_status(error)
+            )
+            raise AdbError(f"Cannot start the adb server: {error}") from error
+        instrumentation.record_adb("adb start-server", None, start)
+
+    @staticmethod
+    def send_request(connection: socket.socket, request: str) -> None:
+        """Sends a length-prefixed request and waits for the OKAY status.
+
+        Raises:
+            AdbError: If the adb server answers with FAIL.
+            ConnectionError: If the connection is closed.
+        """
+        data = request.encode()
+        connection.sendall(b"%04x" % len(data) + data)
+        status = read_exactly(connection, 4)
+        if status == b"FAIL":
+            length = int(read_exactly(connection, 4), 16)
+            raise AdbError(read_exactly(connection, length).decode(errors="replace"))
+        if status != b"OKAY":
+            raise AdbError(f"Unexpected adb server response: {status!r}")
+
+    def host_request(self, request: str) -> str:
+        """Sends a host service request, such as `host:devices-l`, and returns its payload.
+
+        Raises:
+            AdbError: If the adb server cannot be reached or rejects the request.
+        """
+        start = time.perf_counter()
+        try:
+            with closing(self.connect()) as connection:
+                self.send_request(connection, request)
+                length = int(read_exactly(connection, 4), 16)
+                data = read_exactly(connection, length)
+        except BaseException as error:
+            instrumentation.record_adb(
+                request, None, start, status=instrumentation.error_status(error)
+            )
+            raise
+        instrumentation.record_adb(request, None, start, len(data))
+        return data.decode(errors="replace")
+
+    def open_transport(self, serial: Optional[str]) -> socket.socket:
+        """Opens a new connection switched to the transport of a device.
+
+        Raises:
+            AdbError: If the device is not available.
+        """
+        connection = self.connect()
+        try:
+            self.send_request(
+                connection, f"host:transport:{serial}" if serial else "host:transport-any"
+            )
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def device_request(self, serial: Optional[str], request: str) -> socket.socket:
+        """Sends a device service request, such as `shell:ls`, and returns its connection.
+
+        Raises:
+            AdbError: If the device is not available or rejects the request.
+        """
+        connection = self.open_transport(serial)
+        try:
+            self.send_request(connection, request)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def shell(self, serial: Optional[str], command: str) -> Iterator[str]:
+        """Runs a shell command on a device and yields its output lines as they arrive.
+
+        Windows and Unix line endings are both handled, and the line endings are removed.
+        Closing the generator early closes the connection, which stops the command, and so
+        does abort from another thread. The call is recorded by the instrumentation module
+        once the output has been read.
+
+        Args:
+            serial (Optional[str]): Serial of the target device, or None for the only connected device.
+            command (str): The shell command.
+
+        Yields:
+            str: The decoded output lines.
+
+        Raises:
+            AdbError: If the device is not available.
+            TimeoutError: If the device sends nothing for READ_TIMEOUT seconds, or
+                DUMPSYS_READ_TIMEOUT seconds for `dumpsys`.
+        """
+        start = time.perf_counter()
+        bytes_read = 0
+        try:
+            connection = self.device_request(serial, f"shell:{command}")
+            connection.settimeout(DUMPSYS_READ_TIMEOUT if "dumpsys" in command else READ_TIMEOUT)
+            with self.lock:
+                self.active.add(connection)
+            try:
+                with closing(connection), connection.makefile("rb") as stream:
+                    for line in stream:
+                        bytes_read += len(line)
+                        yield line.rstrip(b"\r\n").decode("utf-8", errors="replace")
+            finally:
+                with self.lock:
+                    self.active.discard(connection)
+        except BaseException as error:
+            instrumentation.record_adb(
+                f"shell:{command}",
+                serial,
+                start,
+                bytes_read,
+                instrumentation.error_status(error),
+            )
+            raise
+        instrumentation.record_adb(f"shell:{command}", serial, start, bytes_read)
+
+    def abort(self) -> None:
+        """Stops every shell command being read, so the threads waiting for their output return at once.
+
+        The threads see the sessions end early, like after a dropped connection.
+        """
+        with self.lock:
+            active = list(self.active)
+        for connection in active:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+client = AdbClient()
+
+
+class DeviceTracker:
+    """Follows the device list of the adb server as it changes.
+
+    The `host:track-devices-l` service keeps its connection open and sends the whole
+    device list again whenever a device is attached, detached or changes state, so
+    changes arrive as soon as the server sees them, without polling.
+    """
+
+    def __init__(self, adb_client: AdbClient) -> None:
+        """Initializes a tracker for the devices of an adb server."""
+        self.client = adb_client
+        self.connection = None
+        self.closed = False
+
+    def __iter__(self) -> Iterator[list]:
+        """Yields the current device list, then the new list after every change.
+
+        Yields:
+            list: A Device for every device known to the adb server, in any state.
+
+        Raises:
+            AdbError: If the adb server cannot be reached.
+            ConnectionError: If the adb server closes the connection, for example when it is killed.
+        """
+        connection = self.connection = self.client.connect()
+        if self.closed:
+            connection.close()
+            return
+        with closing(connection):
+            try:
+                self.client.send_request(connection, "host:track-devices-l")
+            except AdbError:
+                # servers older than adb 1.0.40 only support the short format
+                connection.close()
+                connection = self.connection = self.client.connect()
+                self.client.send_request(connection, "host:track-devices")
+            connection.settimeout(None)
+            while True:
+                try:
+                    length = int(read_exactly(connection, 4), 16)
+                    text = read_exactly(connection, length).decode(errors="replace")
+                except OSError:
+                    if self.closed:
+                        return
+                    raise
+                yield parse_devices(text)
+
+    def close(self) -> None:
+        """Stops tracking; a thread iterating over the tracker stops without an error."""
+        self.closed = True
+        if self.connection is not None:
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def parse_devices(text: str) -> list:
+    """Parses a device list in the format of `adb devices -l`.
+
+    Returns:
+        list: A Device for every line, in any state. The model is empty if the list has none.
+    """
+    devices = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        properties = dict(i.split(":", 1) for i in fields[2:] if ":" in i)
+        model = properties.get("model", "").replace("_", " ")
+        devices.append(Device(fields[0], fields[1], model))
+    return devices
+
+
+def list_devices() -> list:
+    """Lists the devices known to the adb server.
+
+    Returns:
+        list: A Device for every line of `adb devices -l`, in any state.
+
+    Raises:
+        AdbError: If the adb server cannot be reached.
+    """
+    return parse_devices(client.host_request("host:devices-l"))
+
+
+def track_devices() -> DeviceTracker:
+    """Returns a DeviceTracker following the devices of the adb server."""
+    return DeviceTracker(client)
+
+
+def shell_lines(serial: Optional[str], *command: str) -> list:
+    """Runs a shell command on a device and returns its non-empty output lines.
+
+    Raises:
+        AdbError: If the device is not available.
+    """
+    return [i.strip() for i in client.shell(serial, " ".join(command)) if i.strip()]
+
+
+def parse_users(lines: list) -> list:
+    """Parses the output of `pm list users`, such as `UserInfo{10:Work profile:1030} running`.
+
+    Returns:
+        list: A User for every listed user, in the listed order.
+    """
+    users = []
+    for line in lines:
+        fields = line.partition("UserInfo{")[2].rpartition("}")[0].split(":")
+        if len(fields) >= 2 and fields[0].isdigit():
+            users.append(User(int(fields[0]), ":".join(fields[1:-1]) or fields[1]))
+    return users
+
+
+def list_users(serial: Optional[str]) -> list:
+    """Returns the users of a device, including work profiles.
+
+    Devices without multi-user support list no users; they are given the primary user.
+
+    Raises:
+        AdbError: If the device is not available.
+    """
+    return parse_users(shell_lines(serial, "pm", "list", "users")) or [
+        User(DEFAULT_USER, "Owner")
+    ]
+
+
+def stream_package_states(serial: Optional[str], users: list) -> Iterator[tuple]:
+    """Yields the installed and removed packages of several users of a device as the device lists them.
+
+    For every user, `pm list packages` (installed packages) and `pm list packages -u`
+    (all packages, including uninstalled ones) are run in a single shell invocation,
+    each followed by RESULT_MARKER. The output is parsed line by line as it arrives, so
+    nothing but the installed packages of the current user is kept. Output cut off by a
+    dropped connection, and error output such as that of a missing user or of a package
+    manager that is not running yet, is detected instead of being taken for a device
+    with fewer packages.
+
+    Args:
+        serial (Optional[str]): Serial of the target device.
+        users (list): The user ids, such as those of list_users.
+
+    Yields:
+        tuple: The user id, whether the package is installed for that user and the package name,
+        in the order of the device. The installed packages of a user come before its removed ones.
+
+    Raises:
+        AdbError: If the device is not available, a listing fails or is empty, or the session ends early.
+    """
+    script = "; ".join(
+        f"pm list packages --user {user}; echo {RESULT_MARKER}; "
+        f"pm list packages -u --user {user}; echo {RESULT_MARKER}"
+        for user in users
+    )
+    markers = 0
+    installed = set()  # the installed packages of the current user
+    listed = 0  # the packages of the current listing
+    for line in client.shell(serial, script):
+        line = line.strip()
+        if line == RESULT_MARKER:
+            markers += 1
+            if not listed and markers <= 2 * len(users):
+                # every user has installed system packages, even a work profile
+                raise AdbError(
+                    f"The package manager listed no packages for user {users[(markers - 1) // 2]}."
+                )
+            listed = 0
+            if markers % 2 == 0:
+                installed = set()
+        elif line and markers < 2 * len(users):
+            user = users[markers // 2]
+            if not line.startswith("package:"):
+                raise AdbError(f"Cannot list the packages of user {user}: {line}")
+            package = line.split(":", 1)[-1]
+            listed += 1
+            if markers % 2 == 0:
+                installed.add(package)
+                yield user, True, package
+            elif package not in installed:
+                yield user, False, package
+    if markers < 2 * len(users):
+        raise AdbError("The shell session ended early.")
+
+
+def collect_package_states(packages: Iterator[tuple], users: list) -> dict:
+    """Collects the packages yielded by stream_package_states.
+
+    Returns:
+        dict: Maps every user id to the sorted installed package names and the sorted
+        removed package names of that user.
+    """
+    states = {user: ([], []) for user in users}
+    for user, installed, package in packages:
+        states[user][0 if installed else 1].append(package)
+    for installed, removed in states.values():
+        installed.sort()
+        removed.sort()
+    return states
+
+
+def get_package_states(serial: Optional[str], users: list) -> dict:
+    """Returns the installed and removed packages of several users of a device in one shell round trip.
+
+    Args:
+        serial (Optional[str]): Serial of the target device.
+        users (list): The user ids, such as those of list_users.
+
+    Returns:
+        dict: Maps every user id to the sorted installed package names and the sorted
+        removed package names of that user.
+
+    Raises:
+        AdbError: If the device is not available, a listing fails or the session ends early.
+    """
+    return collect_package_states(stream_package_states(serial, users), users)
+
+
+def get_package_state(serial: Optional[str], user: int = DEFAULT_USER) -> tuple:
+    """Returns the installed and removed packages of one user of a device, see stream_package_states.
+
+    Returns:
+        tuple: The sorted installed package names and the sorted removed package names.
+
+    Raises:
+        AdbError: If the device is not available, the listing fails or the session ends early.
+    """
+    return get_package_states(serial, [user])[user]
+
+
+def get_device_model(serial: Optional[str]) -> str:
+    """Returns the `ro.product.model` property of a device."""
+    return "".join(shell_lines(serial, "getprop", "ro.product.model"))
+
+
+def reboot(serial: Optional[str]) -> None:
+    """Reboots a device."""
+    start = time.perf_counter()
+    try:
+        client.device_request(serial, "reboot:").close()
+    except BaseException as error:
+        instrumentation.record_adb(
+            "reboot:", serial, start, status=instrumentation.error_status(error)
+        )
+        raise
+    instrumentation.record_adb("reboot:", serial, start)
+
+
+def uninstall_command(package_name: str, user: int = DEFAULT_USER) -> str:
+    """Returns the shell command that uninstalls a package for a user, the primary one by default."""
+    return f"pm uninstall -k --user {user} {package_name}"
+
+
+def reinstall_command(package_name: str, user: int = DEFAULT_USER) -> str:
+    """Returns the shell command that restores a previously uninstalled package for a user."""
+    return f"pm install-existing --user {user} {package_name}"
+
+
+def join_commands(commands: list) -> list:
+    """Joins shell commands into as few scripts of at most MAX_SERVICE_LENGTH bytes as possible.
+
+    Args:
+        commands (list): The shell commands, in order.
+
+    Returns:
+        list: The scripts, each a `; `-separated run of consecutive commands.
+    """
+    scripts = []
+    for command in commands:
+        if scripts and len(scripts[-1]) + len(command) + 2 <= MAX_SERVICE_LENGTH:
+            scripts[-1] += "; " + command
+        else:
+            scripts.append(command)
+    return scripts
+
+
+def run_commands(commands: list, serial: Optional[str] = None) -> Iterator[tuple]:
+    """Runs package commands over as few shell sessions as possible.
+
+    The commands are joined into scripted shell requests of at most MAX_SERVICE_LENGTH
+    bytes, so a typical batch is sent as one or a few requests. Each command is followed
+    by an `echo` of RESULT_MARKER and the exit status, so results can be parsed and
+    yielded one by one as the device finishes them, instead of spawning a process per
+    package and sleeping between them. Closing the generator early closes the shell session.
+
+    Args:
+        commands (list): The shell commands, such as those of uninstall_command.
+        serial (Optional[str]): Serial of the target device, or None for the only connected device.
+
+    Yields:
+        tuple: Whether each command succeeded and its `Success` or `Failure` message, in order.
+
+    Raises:
+        AdbError: If the device is not available or the session ends before all results are read.
+    """
+    lines = [f"{command} 2>&1; echo {RESULT_MARKER} $?" for command in commands]
+    for script in join_commands(lines):
+        expected = script.count(RESULT_MARKER)
+        done = 0
+        output_lines = []
+        with closing(client.shell(serial, script)) as lines:
+            for line in lines:
+                line = line.strip()
+                if line.startswith(RESULT_MARKER) and done < expected:
+                    status = line[len(RESULT_MARKER) :].strip()
+                    message = next(
+                        (i for i in output_lines if i.startswith(("Success", "Failure"))),
+                        output_lines[-1] if output_lines else "",
+                    )
+                    yield status == "0" and not message.startswith("Failure"), message
+                    done += 1
+                    output_lines = []
+                elif line:
+                    output_lines.append(line)
+        if done < expected:
+            output = "\n".join(output_lines)
+            raise AdbError(
+                f"The shell session ended early: {output}" if output
+                else "The shell session ended early."
+            )
+
+
+def run_package_batch(
+    package_names: list, command: Callable[[str], str], serial: Optional[str] = None
+) -> Iterator[PackageResult]:
+    """Runs a command for every package over as few shell sessions as possible, see run_commands.
+
+    Args:
+        package_names (list): Names of the packages to run the command for.
+        command (Callable[[str], str]): Builds the shell command for a package name.
+        serial (Optional[str]): Serial of the target device, or None for the only connected device.
+
+    Yields:
+        PackageResult: The result of each package command, in order.
+
+    Raises:
+        AdbError: If the device is not available or the session ends before all results are read.
+    """
+    with closing(run_commands([command(i) for i in package_names], serial)) as results:
+        for package, (success, message) in zip(package_names, results):
+            yield PackageResult(package, success, message)
+
+
+def run_fleet_batch(
+    serials: list,
+    batch: Callable[[str], Iterator[PackageResult]],
+    max_workers: int = 8,
+    progress: Optional[Callable[[str, PackageResult], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> dict:
+    """Runs a package batch on several devices at once using a bounded worker pool.
+
+    Every device gets its own shell sessions, so the total time is close to
+    that of the slowest device rather than the sum of all of them.
+
+    Args:
+        serials (list): Serials of the target devices.
+        batch (Callable[[str], Iterator[PackageResult]]): Starts the batch of a device serial,
+            such as `lambda serial: run_package_batch(package_names, command, serial)`.
+        max_workers (int): The maximum number of devices worked on at the same time.
+        progress (Optional[Callable[[str, PackageResult], None]]): Called from the
+            worker threads with the serial and result of every finished package.
+        cancel_event (Optional[threading.Event]): Stops every device batch when set.
+
+    Returns:
+        dict: Maps every serial to its list of PackageResult, or to the exception
+        that aborted the batch on that device.
+    """
+
+    def run(serial: str) -> list:
+        results = []
+        if cancel_event and cancel_event.is_set():
+            return results
+        with closing(batch(serial)) as device_batch:
+            for result in device_batch:
+                results.append(result)
+                if progress:
+                    progress(serial, result)
+                if cancel_event and cancel_event.is_set():
+                    break
+        return results
+
+    return map_devices(serials, run, max_workers)
+
+
+def map_devices(serials: list, function: Callable[[str], object], max_workers: int = 8) -> dict:
+    """Calls a function for several devices at once using a bounded worker pool.
+
+    Args:
+        serials (list): Serials of the devices.
+        function (Callable[[str], object]): Called with every serial on a worker thread.
+        max_workers (int): The maximum number of devices worked on at the same time.
+
+    Returns:
+        dict: Maps every serial to the return value of the function, or to the exception it raised.
+    """
+    from concurrent.futures import ThreadPoolExecutor  # imports logging, slow at startup
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(serials)))) as pool:
+        futures = {serial: pool.submit(function, serial) for serial in serials}
+    return {
+        serial: future.exception() or future.result()
+        for serial, future in futures.items()
+    }
@@ -1,46 +1,260 @@
+import json
 import os
-import subprocess
-
-from PyQt5 import QtTest
-from PyQt5.QtCore import Qt, QUrl
-from PyQt5.QtGui import QDesktopServices
+import sys
+import threading
+import time
+
+# taken before the Qt imports, so that --measure-startup includes them
+START_TIME = time.perf_counter()
+
+from contextlib import closing
+
+from PyQt5.QtCore import (
+    QEvent,
+    QObject,
+    QRunnable,
+    Qt,
+    QThreadPool,
+    QTimer,
+    pyqtSignal,
+)
 from PyQt5.QtWidgets import (
+    QAction,
+    QActionGroup,
     QApplication,
+    QDialog,
+    QDialogButtonBox,
     QFileDialog,
     QHeaderView,
     QLabel,
+    QListWidget,
+    QListWidgetItem,
     QMainWindow,
     QMessageBox,
+    QPushButton,
+    QTableView,
     QTableWidget,
     QTableWidgetItem,
+    QVBoxLayout,
 )
-from PyQt5.uic import loadUi
+
+import adb
+import config
+import instrumentation
+import journal
+import metadata
+import plan
+import scheduler
+import search
+from package_model import PackageFilterProxyModel, PackageTableModel
+
+# maximum number of devices worked on at the same time in fleet mode
+FLEET_WORKERS = 8
+# maximum number of unmatched config entries listed after an import
+MAX_UNMATCHED_SHOWN = 20
+# seconds to wait before following the devices again after losing the adb server
+WATCHER_RETRY_DELAY = 2
+# milliseconds a device connection notice stays in the status bar
+DEVICE_NOTICE_TIMEOUT = 5000
+UI_FILE = "android_debloater.ui"
+# generated from UI_FILE by build_ui.py
+UI_MODULE = "android_debloater_ui.py"
+# seconds --measure-startup waits for the packages before giving up
+STARTUP_MEASUREMENT_TIMEOUT = 30
+# packages streamed into the tables are sent to the GUI thread in batches of this many,
+# doubled after every batch, or after this many seconds, whichever comes first
+STREAM_BATCH_SIZE = 200
+STREAM_BATCH_INTERVAL = 0.05
+
+
+class WorkerSignals(QObject):
+    """Signals emitted by a Worker, delivered to the GUI thread."""
+
+    progress = pyqtSignal(object)
+    result = pyqtSignal(object)
+    error = pyqtSignal(object)
+    finished = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Runs a function on a background thread and reports back through signals.
+
+    The function is called with the worker itself as its first argument,
+    so it can report progress and check whether it has been cancelled.
+    """
+
+    def __init__(self, function, *args) -> None:
+        """Initializes the worker with the function to run and its arguments."""
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.signals = WorkerSignals()
+        self.cancel_event = threading.Event()
+
+    def run(self) -> None:
+        """Runs the function and emits its result or the exception it raised."""
+        try:
+            result = self.function(self, *self.args)
+        except Exception as error:
+            self.signals.error.emit(error)
+        else:
+            self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+    def report(self, value) -> None:
+        """Emits a progress value from the running function."""
+        self.signals.progress.emit(value)
+
+    def cancel(self) -> None:
+        """Asks the running function to stop as soon as possible."""
+        self.cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        """Returns whether the worker has been asked to stop."""
+        return self.cancel_event.is_set()
+
+
+class DeviceWatcher(QObject):
+    """Follows the devices of the adb server on a background thread.
+
+    The new device list is emitted every time a device is attached, detached or
+    changes state. If the adb server goes away, the error is emitted and the
+    watcher reconnects after WATCHER_RETRY_DELAY seconds.
+    """
+
+    devices_changed = pyqtSignal(object)
+    error = pyqtSignal(object)
+
+    def __init__(self, parent=None) -> None:
+        """Initializes a stopped watcher."""
+        super().__init__(parent)
+        self.stop_event = threading.Event()
+        self.tracker = None
+
+    def start(self) -> None:
+        """Starts following the devices."""
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self) -> None:
+        """Emits every device list sent by the adb server until stopped."""
+        while not self.stop_event.is_set():
+            self.tracker = adb.track_devices()
+            if self.stop_event.is_set():
+                return
+            try:
+                for devices in self.tracker:
+                    self.devices_changed.emit(devices)
+            except (adb.AdbError, OSError) as error:
+                if not self.stop_event.is_set():
+                    self.error.emit(error)
+            self.stop_event.wait(WATCHER_RETRY_DELAY)
+
+    def stop(self) -> None:
+        """Stops following the devices."""
+        self.stop_event.set()
+        if self.tracker is not None:
+            self.tracker.close()
+
+
+def load_ui(window: QMainWindow, directory: str, ui_file: str = UI_FILE):
+    """Creates the widgets of the main window.
+
+    The module compiled by build_ui.py is used when it is at least as recent as the .ui
+    file; otherwise the .ui file is parsed at runtime with loadUi, which is much slower
+    because it imports the uic compiler and reads the XML on every launch.
+
+    Args:
+        window (QMainWindow): The window to set up.
+        directory (str): The directory of the .ui file and of the compiled module.
+        ui_file (str): The name of the .ui file.
+
+    Returns:
+        The object holding the widgets as attributes.
+    """
+    ui_path = os.path.join(directory, ui_file)
+    try:
+        if os.path.getmtime(os.path.join(directory, UI_MODULE)) >= os.path.getmtime(ui_path):
+            from android_debloater_ui import Ui_MainWindow
+
+            ui = Ui_MainWindow()
+            ui.setupUi(window)
+            return ui
+    except (OSError, ImportError):
+        pass
+    from PyQt5.uic import loadUi
+
+    return loadUi(ui_path, window)
+
+
+class StartupTimer(QObject):
+    """Measures how long the application takes to paint its window, to show its first package rows and to fill its tables.
+
+    The times are counted from START_TIME and printed as one line of JSON, then the
+    application quits. They are also recorded as spans by the instrumentation module.
+    """
+
+    def __init__(self, window: "App") -> None:
+        """Starts watching for the first paint and the first packages of a window."""
+        super().__init__(window)
+        self.times = {"window_ms": (time.perf_counter() - START_TIME) * 1000}
+        QApplication.instance().installEventFilter(self)
+        window.packages_streamed.connect(self.packages_streamed)
+        window.packages_shown.connect(self.packages_shown)
+        QTimer.singleShot(STARTUP_MEASUREMENT_TIMEOUT * 1000, self.report)
+
+    def eventFilter(self, watched: QObject, event: QEvent) -> bool:
+        """Records the first paint event of any widget."""
+        if event.type() == QEvent.Paint and "first_paint_ms" not in self.times:
+            self.record("first_paint_ms")
+            QApplication.instance().removeEventFilter(self)
+        return False
+
+    def packages_streamed(self) -> None:
+        """Records when the first package rows are shown."""
+        if "first_rows_ms" not in self.times:
+            self.record("first_rows_ms")
+
+    def packages_shown(self) -> None:
+        """Records when the tables are populated for the first time and reports the times."""
+        if "populated_table_ms" not in self.times:
+            self.record("populated_table_ms")
+            self.report()
+
+    def record(self, name: str) -> None:
+        """Records the time elapsed since START_TIME under a name."""
+        self.times[name] = (time.perf_counter() - START_TIME) * 1000
+        instrumentation.recorder.record(f"startup_{name[:-3]}", instrumentation.SPAN, START_TIME)
+
+    def report(self) -> None:
+        """Prints the recorded times, with null for the steps not reached yet, and quits."""
+        times = {
+            i: self.times.get(i)
+            for i in ("window_ms", "first_paint_ms", "first_rows_ms", "populated_table_ms")
+        }
+        print(json.dumps(times), flush=True)
+        QApplication.instance().quit()
 
 
 class App(QMainWindow):
+    # emitted after the tables have been filled with the packages of a device
+    packages_shown = pyqtSignal()
+    # emitted when the first packages of a refresh are streamed into the tables
+    packages_streamed = pyqtSignal()
+
     def __init__(self, *args, **kwargs) -> None:
         """Initializes the Android Debloater class."""
         super().__init__(*args, **kwargs)
         self.script_location = os.path.dirname(__file__)  # ui file directory
-        self.ui_file = "android_debloater.ui"
-        self.ui = loadUi(os.path.join(self.script_location, self.ui_file), self)
+        self.ui_file = UI_FILE
+        self.ui = load_ui(self, self.script_location, self.ui_file)
 
-        self.ui.setWindowTitle("Android Debloater")
+        self.setWindowTitle("Android Debloater")
 
-        self.ui.table_1.setColumnCount(2)
-        self.ui.table_1.setHorizontalHeaderLabels(("", "Package Name"))
-        self.ui.table_1.horizontalHeader().setSectionResizeMode(
-            0, QHeaderView.ResizeToContents
-        )
-        self.ui.table_1.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
-        self.ui.table_1.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
-        self.ui.table_2.setColumnCount(2)
-        self.ui.table_2.setHorizontalHeaderLabels(("", "Package Name"))
-        self.ui.table_2.horizontalHeader().setSectionResizeMode(
-            0, QHeaderView.ResizeToContents
-        )
-        self.ui.table_2.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
-        self.ui.table_2.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.installed_model = PackageTableModel(self)
+        self.removed_model = PackageTableModel(self)
+        self.setup_table(self.ui.table_1, self.installed_model)
+        self.setup_table(self.ui.table_2, self.removed_model)
 
         self.ui.btn_uninstall.clicked.connect(self.uninstall)
         self.ui.btn_reinstall.clicked.connect(self.reinstall)
@@ -49,13 +263,66 @@ class App(QMainWindow):
         self.ui.action_export.triggered.connect(self.export)
         self.ui.action_exit.triggered.connect(QApplication.quit)
         self.ui.action_refresh.triggered.connect(self.refresh)
+        self.ui.action_statistics.triggered.connect(self.show_statistics)
+        self.ui.action_filter.triggered.connect(self.ui.filter_edit.setFocus)
+        self.ui.filter_edit.textChanged.connect(self.filter_packages)
+        self.ui.action_check_filtered.triggered.connect(self.check_filtered_packages)
         self.ui.action_reboot.triggered.connect(self.reboot)
+        self.ui.action_rollback.triggered.connect(self.rollback_last_batch)
+        self.ui.action_cancel.triggered.connect(self.cancel_jobs)
+        self.ui.action_apply_selection_all.triggered.connect(
+            self.apply_selection_to_all_devices
+        )
+        self.ui.action_apply_config_all.triggered.connect(
+            self.apply_config_to_all_devices
+        )
         self.ui.action_help.triggered.connect(self.show_help)
         self.ui.action_about.triggered.connect(self.show_about_dialog)
 
         self.statusbar_label = QLabel("")
         self.ui.statusbar.addWidget(self.statusbar_label)
 
+        self.serial = None  # serial of the device shown in the tables
+        self.users = []  # adb.User objects of the device shown in the tables
+        self.selected_users = {adb.DEFAULT_USER}  # ids of the users shown and changed
+        self.package_states = {}  # user id -> installed and removed packages of the device
+        self.details = {}  # package name -> metadata.PackageInfo of the device
+        self.device_model = ""
+        self.refresh_duration = 0.0
+        self.streaming = False  # whether the tables hold packages streamed by the running refresh
+        self.devices = None  # serial -> adb.Device, as last reported by the device watcher
+        self.refresh_pending = False
+        self.device_watcher = DeviceWatcher(self)
+        self.device_watcher.devices_changed.connect(self.on_devices_changed)
+        self.device_watcher.error.connect(self.on_device_watcher_error)
+        self.device_action_group = QActionGroup(self)
+        self.device_action_group.triggered.connect(self.select_device)
+        self.ui.menuSelectUsers.triggered.connect(self.toggle_user)
+
+        self.thread_pool = QThreadPool()
+        self.running_jobs = set()
+        self.update_busy_state()
+
+    def setup_table(self, table: QTableView, model: PackageTableModel) -> None:
+        """Connects a table view to a package model through a filter proxy model.
+
+        Args:
+            table (QTableView): The table view showing the packages.
+            model (PackageTableModel): The model holding the packages.
+
+        Returns:
+            None
+        """
+        proxy_model = PackageFilterProxyModel(self)
+        proxy_model.setSourceModel(model)
+        table.setModel(proxy_model)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        for column in range(2, model.columnCount()):
+            table.horizontalHeader().setSectionResizeMode(column, QHeaderView.Interactive)
+        table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        table.setColumnHidden(PackageTableModel.USERS_COLUMN, True)
+
     def closeEvent(self, event) -> None:
         """Closes the application's main window when the close event is triggered.
 
@@ -66,14 +333,15 @@ class App(QMainWindow):
         Raises: None
 
         Description: This method is called when the user tries to close the main window of the application. It prompts a confirmation dialog asking whether the user wants to quit.
-        If the UI is not enabled, it means that a process is still running and the close event is ignored.
+        If a background job is still running, the close event is ignored.
         Instead, an information dialog is shown to inform the user that they should wait until the current process is finished before closing the application.
         """
-        if self.ui.isEnabled():
+        if not self.running_jobs:
             respose1 = QMessageBox.question(
                 self, "Quit Confirmation", "Are you sure you want to quit?"
             )
             if respose1 == QMessageBox.Yes:
+                self.device_watcher.stop()
                 QApplication.quit()
         else:
             event.ignore()
@@ -84,22 +352,93 @@ class App(QMainWindow):
             )
 
     def show(self) -> None:
-        """Displays the current state of the object and performs a refresh after a 1-second delay.
+        """Displays the window and starts following the connected devices.
+
+        The first device list reported by the device watcher triggers the first refresh.
 
         Args: self: The object to be displayed and refreshed.
 
         Returns: None
         """
         super().show()
-        QtTest.QTest.qWait(1000)
-        self.refresh()
+        self.update_statusbar("Detecting connected devices...")
+        self.device_watcher.start()
+
+    def on_devices_changed(self, devices: list) -> None:
+        """Updates the UI after a device was attached, detached or changed state.
+
+        The device menu is always rebuilt, but the packages are only reloaded when the
+        device shown in the tables changed, or when no device was shown and one came online.
+        If a job is running, the reload waits until it has finished.
+
+        Args:
+            devices (list): The adb.Device objects now known to the adb server.
+
+        Returns:
+            None
+        """
+        first_list = self.devices is None
+        previous, self.devices = self.devices or {}, {i.serial: i for i in devices}
+        changed = [
+            serial
+            for serial in {**previous, **self.devices}
+            if getattr(previous.get(serial), "state", None)
+            != getattr(self.devices.get(serial), "state", None)
+        ]
+        if not changed and not first_list:
+            return
+        self.update_device_menu(devices)
+        if changed:
+            self.ui.statusbar.showMessage(
+                "   ".join(self.describe_device_change(i) for i in changed),
+                DEVICE_NOTICE_TIMEOUT,
+            )
+        online = [i.serial for i in devices if i.state == "device"]
+        if self.serial in changed or self.serial not in online:
+            if online:
+                self.request_refresh()
+            elif self.serial is not None or first_list:
+                self.show_disconnected()
+
+    def describe_device_change(self, serial: str) -> str:
+        """Returns the status bar notice of a device that was attached, detached or changed state."""
+        device = self.devices.get(serial)
+        if device is None:
+            return f"{serial} disconnected."
+        if device.state == "device":
+            return f"{device.model or serial} connected."
+        if device.state == "unauthorized":
+            return f"Allow USB debugging on {device.model or serial}."
+        return f"{device.model or serial} is {device.state}."
+
+    def on_device_watcher_error(self, error: Exception) -> None:
+        """Reports that the adb server cannot be reached; the watcher keeps retrying."""
+        self.devices = None
+        self.update_statusbar(f"Waiting for the adb server: {error}")
+
+    def request_refresh(self) -> None:
+        """Refreshes now, or as soon as the running jobs have finished."""
+        if self.running_jobs:
+            self.refresh_pending = True
+        else:
+            self.refresh()
+
+    def show_disconnected(self) -> None:
+        """Empties the tables after the last online device went away."""
+        self.serial = None
+        self.users = []
+        self.package_states = {}
+        self.update_user_menu()
+        self.fill_table([], self.installed_model)
+        self.fill_table([], self.removed_model)
+        self.update_statusbar("No connected devices.")
 
     def refresh(self) -> None:
         """Updates the UI and refreshes the connected devices.
 
         This method is responsible for refreshing the UI and updating the connected devices information.
-        It disables the UI, performs some operations to retrieve data, and then updates the UI with the new information.
-        If there are no connected devices, it displays an error message.
+        The device state is retrieved by a background job, and the UI is updated with the new information once it arrives.
+        If there are no connected devices, this is reported in the status bar.
 
         Parameters:
             None
@@ -107,154 +446,579 @@ class App(QMainWindow):
         Returns:
             None
         """
+        self.update_statusbar("Detecting connected devices...")
+        self.streaming = False
+        self.start_job(
+            self.load_device_state,
+            self.serial,
+            [i.user_id for i in self.users],
+            sorted(self.selected_users),
+            on_result=self.show_device_state,
+            on_progress=self.show_streamed_packages,
+            on_error=self.show_refresh_error,
+        )
+
+    def start_job(
+        self, function, *args, on_result=None, on_progress=None, on_error=None
+    ) -> Worker:
+        """Runs a function on the thread pool and connects its signals.
+
+        While any job is running, the actions that change the device are disabled,
+        but the window and the tables stay interactive.
+
+        Args:
+            function (Callable): The function to run. It receives the worker as its first argument.
+            *args: The remaining arguments of the function.
+            on_result (Callable): Called on the GUI thread with the return value of the function.
+            on_progress (Callable): Called on the GUI thread with every reported progress value.
+            on_error (Callable): Called on the GUI thread with the exception raised by the function.
+
+        Returns:
+            Worker: The started worker.
+        """
+        worker = Worker(function, *args)
+        if on_result:
+            worker.signals.result.connect(on_result)
+        if on_progress:
+            worker.signals.progress.connect(on_progress)
+        if on_error:
+            worker.signals.error.connect(on_error)
+        worker.signals.finished.connect(lambda: self.finish_job(worker))
+        self.running_jobs.add(worker)
+        self.update_busy_state()
+        self.thread_pool.start(worker)
+        return worker
+
+    def finish_job(self, worker: Worker) -> None:
+        """Forgets a finished worker and re-enables the UI when no jobs are left."""
+        self.running_jobs.discard(worker)
+        self.update_busy_state()
+        if self.refresh_pending and not self.running_jobs:
+            self.refresh_pending = False
+            self.refresh()
+
+    def cancel_jobs(self) -> None:
+        """Asks every running job to stop, cutting off the shell commands they are waiting for."""
+        for worker in self.running_jobs:
+            worker.cancel()
+        adb.client.abort()
+        self.update_statusbar("Cancelling...")
+
+    def update_busy_state(self) -> None:
+        """Enables or disables the actions that change the device depending on whether jobs are running."""
+        busy = bool(self.running_jobs)
+        for widget in (
+            self.ui.btn_uninstall,
+            self.ui.btn_reinstall,
+            self.ui.action_import,
+            self.ui.action_refresh,
+            self.ui.action_reboot,
+            self.ui.action_rollback,
+            self.ui.action_apply_selection_all,
+            self.ui.action_apply_config_all,
+            self.ui.menuSelectDevice,
+            self.ui.menuSelectUsers,
+        ):
+            widget.setEnabled(not busy)
+        self.ui.action_cancel.setEnabled(busy)
+
+    def load_device_state(
+        self, job: Worker, serial: str, known_users: list, selected_users: list
+    ) -> dict:
+        """Retrieves the connected devices and the packages of the selected one.
+
+        This method runs on a background thread and does not touch the UI.
+        If the given device is no longer online, the first online device is used instead.
+        The package states of all the users known from the last refresh are read in a
+        single shell round trip while the users, the device model and the package details
+        are queried in parallel; only users that appeared since then take a second round
+        trip. The packages of the selected users are reported to the job in batches as
+        the device lists them, so the tables fill while the device is still answering.
+        The state of the primary user is saved to the snapshot history.
+
+        Args:
+            job (Worker): The worker running this method.
+            serial (str): Serial of the currently selected device.
+            known_users (list): The user ids found on the device by the last refresh.
+            selected_users (list): The ids of the users whose packages are shown; the
+                primary user is shown if none of them is on the device.
+
+        Returns:
+            dict: The devices, the selected serial, its model, its users with their package
+            states, the selected users, the packages installed and removed for any of them
+            with their search indexes, their details, its interrupted journal.Batch if any
+            and the time the refresh took in seconds.
+        """
+        from concurrent.futures import ThreadPoolExecutor  # imports logging, slow at startup
+
+        import snapshots  # imports sqlite3, slow at startup
+
+        start_time = time.perf_counter()
+        with instrumentation.span("refresh", serial):
+            devices = adb.list_devices()
+            online_serials = [i.serial for i in devices if i.state == "device"]
+            if serial not in online_serials:
+                serial = online_serials[0] if online_serials else None
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                model = pool.submit(self.get_device_model, serial)
+                details = pool.submit(metadata.get_package_info, serial)
+                users = pool.submit(adb.list_users, serial)
+                known_users = known_users or [adb.DEFAULT_USER]
+                try:
+                    states = adb.collect_package_states(
+                        self.report_packages(
+                            job,
+                            adb.stream_package_states(serial, known_users),
+                            set(selected_users),
+                        ),
+                        known_users,
+                    )
+                except adb.AdbError:
+                    if set(known_users).issubset(i.user_id for i in users.result()):
+                        raise
+                    states = {}  # a user was removed since the last refresh
+                users = users.result()
+                new_users = [i.user_id for i in users if i.user_id not in states]
+                if new_users:
+                    states.update(adb.get_package_states(serial, new_users))
+                states = {i.user_id: states[i.user_id] for i in users}
+                model = model.result()
+                try:
+                    details = details.result()
+                except (adb.AdbError, OSError, ValueError):
+                    details = {}  # the packages are still shown, without their details
+            selected_users = [i for i in selected_users if i in states] or [
+                adb.DEFAULT_USER if adb.DEFAULT_USER in states else users[0].user_id
+            ]
+            installed, removed = plan.combine_states(states, selected_users)
+            installed_index = search.PackageIndex(list(installed))
+            removed_index = search.PackageIndex(list(removed))
+            if serial and adb.DEFAULT_USER in states:
+                with instrumentation.span("snapshot", serial):
+                    snapshots.try_save_snapshot(serial, model, *states[adb.DEFAULT_USER])
+        return {
+            "devices": devices,
+            "serial": serial,
+            "users": users,
+            "states": states,
+            "selected_users": selected_users,
+            "installed": installed,
+            "removed": removed,
+            "installed_index": installed_index,
+            "removed_index": removed_index,
+            "details": details,
+            "model": model,
+            "interrupted": journal.interrupted_batch(serial) if serial else None,
+            "duration": time.perf_counter() - start_time,
+        }
+
+    @staticmethod
+    def report_packages(job: Worker, packages, users: set):
+        """Passes on the packages yielded by adb.stream_package_states, reporting those of some users to a job.
+
+        The packages are reported as lists of (user id, installed, package name) tuples.
+        The first list holds up to STREAM_BATCH_SIZE packages and every next one up to twice
+        as many, so the first rows show at once and the GUI thread merges a few batches per
+        refresh, in time linear in the number of packages, instead of one per package.
+
+        Args:
+            job (Worker): The worker to report the batches to.
+            packages (Iterator[tuple]): The packages yielded by adb.stream_package_states.
+            users (set): The ids of the users whose packages are reported.
+
+        Yields:
+            tuple: Every package, unchanged.
+        """
+        batch = []
+        batch_size = STREAM_BATCH_SIZE
+        sent = time.perf_counter()
+        for package in packages:
+            yield package
+            if package[0] in users:
+                batch.append(package)
+                if (
+                    len(batch) >= batch_size
+                    or time.perf_counter() - sent >= STREAM_BATCH_INTERVAL
+                ):
+                    job.report(batch)
+                    batch = []
+                    batch_size *= 2
+                    sent = time.perf_counter()
+        if batch:
+            job.report(batch)
+
+    def show_streamed_packages(self, batch: list) -> None:
+        """Inserts a batch of packages streamed by the refresh job into the tables.
+
+        The tables are emptied when the first batch of a refresh arrives, and every batch
+        is merged into the sorted rows, so the rows appear while the device is still
+        listing its packages. The complete state replaces them once the refresh is done.
+
+        Args:
+            batch (list): The (user id, installed, package name) tuples reported by report_packages.
+
+        Returns:
+            None
+        """
+        if not self.streaming:
+            self.streaming = True
+            self.fill_table([], self.installed_model)
+            self.fill_table([], self.removed_model)
+            self.packages_streamed.emit()
+        for user in sorted({i[0] for i in batch}):
+            for installed, model in ((True, self.installed_model), (False, self.removed_model)):
+                names = [i[2] for i in batch if i[0] == user and i[1] == installed]
+                if names:
+                    model.insert_packages(names, user)
+        self.update_statusbar(
+            f"Loading packages...   |   Installed Packages: {self.installed_model.rowCount()}"
+            f"    |   Removed Packages: {self.removed_model.rowCount()}"
+        )
+
+    def show_device_state(self, state: dict) -> None:
+        """Fills the device menu, the tables and the status bar with a loaded device state.
+
+        Args:
+            state (dict): The device state returned by load_device_state.
+
+        Returns:
+            None
+        """
+        self.serial = state["serial"]
+        self.users = state["users"]
+        self.package_states = state["states"]
+        self.selected_users = set(state["selected_users"])
+        self.details = state["details"]
+        self.device_model = state["model"]
+        self.refresh_duration = state["duration"]
+        self.update_device_menu(state["devices"])
+        self.update_user_menu()
+        self.show_packages(
+            state["installed"],
+            state["removed"],
+            state["installed_index"],
+            state["removed_index"],
+        )
+        self.packages_shown.emit()
+        if state["interrupted"]:
+            self.offer_resume(state["interrupted"])
+
+    def offer_resume(self, batch: journal.Batch) -> None:
+        """Asks whether to finish a batch that was interrupted on the selected device.
+
+        Only the packages whose result never reached the journal are planned again. If the
+        user declines, the batch is marked as abandoned and is not offered again.
+
+        Args:
+            batch (journal.Batch): The interrupted batch.
+
+        Returns:
+            None
+        """
+        operations = journal.resume_plan(batch, self.package_states)
+        if not operations:
+            status = journal.COMPLETED  # the device already has the state the batch aimed for
+        else:
+            started = time.strftime("%Y-%m-%d %H:%M", time.localtime(batch.time))
+            response = QMessageBox.question(
+                self,
+                "Resume Interrupted Batch",
+                f"A batch ({batch.label}) started on {started} was interrupted after "
+                f"{len(batch.results)} of {len(batch.operations)} packages.\n\n"
+                f"Do you want to resume it? {len(operations)} packages are left.",
+            )
+            if response == QMessageBox.Yes:
+                # the resume batch marks the interrupted one as resumed once it has started
+                self.start_package_batch(
+                    operations,
+                    "Resumed",
+                    "Resume Completed",
+                    "The interrupted batch has been completed!",
+                    "resume",
+                    batch,
+                )
+                return
+            status = journal.ABANDONED
         try:
-            self.ui.setEnabled(False)
-            self.update_statusbar("Detecting connected devices...")
-            QtTest.QTest.qWait(1000)
-            self.fill_table(self.get_installed_packages_list(), self.ui.table_1)
-            self.fill_table(self.get_removed_packages_list(), self.ui.table_2)
-            self.update_statusbar_with_device_info()
-        except:
-            self.update_statusbar("No connected devices.")
-            QMessageBox.information(self, "Error", "No Connected Devices.")
-        finally:
-            self.ui.setEnabled(True)
+            journal.end_batch(self.serial, batch, status)
+        except OSError as error:
+            QMessageBox.warning(self, "Journal Error", f"Cannot update the journal: {error}")
+
+    def show_refresh_error(self, error: Exception) -> None:
+        """Reports a refresh that failed, showing the packages of the last refresh again if some were streamed in."""
+        if self.streaming:
+            self.streaming = False
+            self.show_packages(*plan.combine_states(self.package_states, self.selected_users))
+        if isinstance(error, (adb.AdbError, OSError)) and self.serial:
+            self.update_statusbar(f"Cannot refresh the device: {error or type(error).__name__}")
+        else:
+            self.show_no_devices_error(error)
 
-    def update_statusbar(self, message: str) -> None:
-        """Updates the status bar label with the given message.
+    def show_no_devices_error(self, error: Exception) -> None:
+        """Reports in the status bar that the device could not be reached."""
+        self.update_statusbar("No connected devices.")
 
-        Args: message (str): The message to display in the status bar.
+    def show_batch_error(self, error: Exception) -> None:
+        """Reports a package batch that stopped on an error and reloads the packages.
 
-        Returns: None
+        Transient errors have already been retried by the scheduler when this is called.
+        The confirmed packages are in the journal, so the batch is offered for resuming
+        once the device is back.
         """
-        self.statusbar_label.setText(f"   {message} ")
+        if scheduler.is_transient(error):
+            text = (
+                f"The device stopped responding: {error}\n\n"
+                "The batch can be resumed after the device is reconnected."
+            )
+        elif isinstance(error, OSError):
+            text = f"Cannot write the journal: {error}"
+        else:
+            text = f"The batch stopped: {error}"
+        QMessageBox.warning(self, "Batch Failed", text)
+        self.refresh()
+
+    def update_device_menu(self, devices: list) -> None:
+        """Rebuilds the 'Select Device' menu and checks the selected device.
 
-    def get_installed_packages_list(self) -> list:
-        """Retrieves the list of installed packages on a device connected via ADB.
+        Args:
+            devices (list): The devices reported by adb.
 
         Returns:
-            list: A sorted list of installed package names.
+            None
+        """
+        self.ui.menuSelectDevice.clear()
+        for device in devices:
+            label = f"{device.model or 'Unknown'} ({device.serial})"
+            if device.state != "device":
+                label += f" - {device.state}"
+            action = QAction(label, self.ui.menuSelectDevice)
+            action.setData(device.serial)
+            action.setCheckable(True)
+            action.setChecked(device.serial == self.serial)
+            action.setEnabled(device.state == "device")
+            self.device_action_group.addAction(action)
+            self.ui.menuSelectDevice.addAction(action)
+
+    def select_device(self, action: QAction) -> None:
+        """Shows the packages of the device chosen in the 'Select Device' menu.
 
-        Raises:
-            subprocess.CalledProcessError: If the adb shell command fails to execute.
+        Args:
+            action (QAction): The triggered device action, holding the device serial.
+
+        Returns:
+            None
         """
-        output = str(
-            subprocess.check_output("adb shell pm list packages", shell=True)
-        ).split("\\r\\")
-        installed_packages_list = [i.split(":")[-1] for i in output if ":" in i]
-        return sorted(installed_packages_list)
+        if action.data() != self.serial:
+            self.serial = action.data()
+            self.users = []
+            self.selected_users = {adb.DEFAULT_USER}
+            self.refresh()
+
+    def update_user_menu(self) -> None:
+        """Rebuilds the 'Select Users' menu with the users of the device and checks the selected ones."""
+        self.ui.menuSelectUsers.clear()
+        for user in self.users:
+            action = QAction(f"{user.name} ({user.user_id})", self.ui.menuSelectUsers)
+            action.setData(user.user_id)
+            action.setCheckable(True)
+            action.setChecked(user.user_id in self.selected_users)
+            self.ui.menuSelectUsers.addAction(action)
+        for table in (self.ui.table_1, self.ui.table_2):
+            table.setColumnHidden(PackageTableModel.USERS_COLUMN, len(self.users) < 2)
+
+    def toggle_user(self, action: QAction) -> None:
+        """Shows or hides the packages of the user checked or unchecked in the 'Select Users' menu.
+
+        The packages of every user were read by the last refresh, so the tables are
+        filled again without asking the device. At least one user stays selected.
 
-    def get_removed_packages_list(self) -> list:
-        """Returns a list of removed packages from the Android device.
+        Args:
+            action (QAction): The triggered user action, holding the user id.
 
-        Uses the ADB command `adb shell pm list packages -u` to retrieve a list of all packages with update flags from the device.
-        Compares the extracted package names with the list of installed packages obtained from the get_installed_packages_list method.
-        Returns the sorted list of removed packages by finding the difference between all packages and installed packages.
+        Returns:
+            None
+        """
+        if action.isChecked():
+            self.selected_users.add(action.data())
+        elif len(self.selected_users) > 1:
+            self.selected_users.discard(action.data())
+        else:
+            action.setChecked(True)
+            return
+        self.show_packages(*plan.combine_states(self.package_states, self.selected_users))
+
+    def show_packages(
+        self,
+        installed: dict,
+        removed: dict,
+        installed_index: search.PackageIndex = None,
+        removed_index: search.PackageIndex = None,
+    ) -> None:
+        """Fills the tables with the packages of the selected users and updates the status bar.
+
+        Args:
+            installed (dict): Maps the packages installed for any selected user to those users.
+            removed (dict): Maps the packages removed for any selected user to those users.
+            installed_index (search.PackageIndex): The index of the installed packages, if already built.
+            removed_index (search.PackageIndex): The index of the removed packages, if already built.
+
+        Returns:
+            None
+        """
+        self.fill_table(list(installed), self.installed_model, self.details, installed_index, installed)
+        self.fill_table(list(removed), self.removed_model, self.details, removed_index, removed)
+        self.update_statusbar_with_device_info(self.device_model, self.refresh_duration)
+
+    def update_statusbar(self, message: str) -> None:
+        """Updates the status bar label with the given message.
 
-        Returns: list: A sorted list of package names that have been removed from the device.
+        Args: message (str): The message to display in the status bar.
+
+        Returns: None
         """
-        output = str(
-            subprocess.check_output("adb shell pm list packages -u", shell=True)
-        ).split("\\r\\")
-        all_packages_set = {i.split(":")[-1] for i in output if ":" in i}
-        installed_packages_set = set(self.get_installed_packages_list())
-        return sorted(list(all_packages_set - installed_packages_set))
+        self.statusbar_label.setText(f"   {message} ")
 
-    def fill_table(self, data: list, table: QTableWidget) -> None:
-        """Fills a table widget with data.
+    def fill_table(
+        self,
+        data: list,
+        model: PackageTableModel,
+        details: dict = None,
+        search_index: search.PackageIndex = None,
+        users: dict = None,
+    ) -> None:
+        """Fills a package model with data.
+
+        The filter typed in the filter box is applied to the new packages. If the model
+        already holds these packages, for example because they were streamed in, its rows
+        and check states are kept.
 
         Args:
             data (list): A list of strings representing the data to be displayed in the table.
-            table (QTableWidget): The table widget to be filled with data.
+            model (PackageTableModel): The package model to be filled with data.
+            details (dict): Maps package names to their metadata.PackageInfo.
+            search_index (search.PackageIndex): The index of `data`, built by the refresh job.
+            users (dict): Maps package names to the ids of the users they are shown for.
 
         Returns:
             None
         """
-        row_count = len(data)
-        table.setRowCount(row_count)
-        for row in range(row_count):
-            # first column contains checkboxes
-            checkbox_item = QTableWidgetItem()
-            checkbox_item.setFlags(
-                Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsEnabled
-            )
-            checkbox_item.setCheckState(Qt.CheckState.Unchecked)
-            table.setItem(row, 0, checkbox_item)
-            # second column contains package names
-            package_name_item = QTableWidgetItem(data[row])
-            table.setItem(row, 1, package_name_item)
+        with instrumentation.span("fill_table", self.serial):
+            model.update_packages(data, details, search_index, users)
 
-    def update_statusbar_with_device_info(self) -> None:
+    def update_statusbar_with_device_info(
+        self, device_model: str, refresh_duration: float
+    ) -> None:
         """Updates the status bar with device information.
 
-        This method retrieves the device model,
-        installed packages count, and removed packages count,
+        This method combines the device model with the
+        installed packages count, removed packages count and refresh time,
         and then calls the update_statusbar method to update the status bar with this information.
 
         Args:
-            None
+            device_model (str): The model of the selected device.
+            refresh_duration (float): The time the last refresh took in seconds.
 
         Returns:
             None
         """
-        device_model = self.get_device_model()
-        installed_count = self.ui.table_1.rowCount()
-        removed_count = self.ui.table_2.rowCount()
+        installed_count = self.installed_model.rowCount()
+        removed_count = self.removed_model.rowCount()
+        users_text = ""
+        if len(self.users) > 1:
+            user_ids = ", ".join(str(i) for i in sorted(self.selected_users))
+            users_text = f"   |   Users: {user_ids} of {len(self.users)}"
         self.update_statusbar(
-            f"Connected Device: {device_model}   |   Installed Packages: {installed_count}    |   Removed Packages: {removed_count}"
+            f"Connected Device: {device_model} ({self.serial}){users_text}   |   Installed Packages: {installed_count}    |   Removed Packages: {removed_count}    |   Refreshed in {refresh_duration:.2f} s"
         )
 
-    def get_device_model(self) -> str:
-        """Returns the model of the connected device.
+    def get_device_model(self, serial: str) -> str:
+        """Returns the model of a device.
 
         This method uses the `adb shell getprop ro.product.model` command to retrieve the device model.
-        The output is then decoded and stripped of any leading or trailing white spaces.
-        The resulting device model is returned.
+
+        Args:
+            serial (str): Serial of the device.
 
         Returns:
-            str: The model of the connected device.
+            str: The model of the device.
         """
-        device_model = (
-            subprocess.check_output("adb shell getprop ro.product.model")
-            .decode()
-            .strip()
-        )
-        return device_model
+        return adb.get_device_model(serial)
 
     def import_config(self) -> None:
         """Imports a configuration file and updates the table accordingly.
 
         This method prompts the user to select a configuration file in the '*.cfg' format.
-        If a file is selected, it reads the file line by line, searches for matches in the
-        'table_1' widget, and selects the corresponding checkboxes. After importing the
-        configuration, a message box is displayed to inform the user about the import status.
+        If a file is selected, it is loaded with its includes, the user picks the sections to apply,
+        and the package names and patterns of those sections are matched against the installed packages
+        model to select the corresponding checkboxes. After importing the configuration,
+        a message box is displayed to inform the user about the import status and the unmatched entries.
 
         Returns:
             None
         """
-        row_count = self.ui.table_1.rowCount()
+        row_count = self.installed_model.rowCount()
         if row_count:
             file_path, _ = QFileDialog.getOpenFileName(
                 self, "Select a file config file:", "", "Config file (*.cfg)"
             )
             if file_path:
-                counter = 0
-                with open(file_path, "r") as file:
-                    for line in file:
-                        for row in range(self.ui.table_1.rowCount()):
-                            package_item = self.ui.table_1.item(row, 1)
-                            checkbox_item = self.ui.table_1.item(row, 0)
-                            if package_item.text() == line.strip():
-                                checkbox_item.setCheckState(2)
-                                counter += 1
-                QMessageBox.information(
-                    self,
-                    "Import Successful",
-                    f"Config imported successfully!\n{counter} Packages selected.",
-                )
+                sections = self.load_config_sections(file_path)
+                if not sections:
+                    return
+                entries = [i for section in sections for i in section.entries]
+                with instrumentation.span("import_config", self.serial):
+                    rows, unmatched = config.match_entries(
+                        entries, self.installed_model.names, self.installed_model.rows
+                    )
+                    self.installed_model.set_checked(list(rows))
+                message = f"Config imported successfully!\n{len(rows)} Packages selected."
+                if unmatched:
+                    unmatched_text = "\n".join(unmatched[:MAX_UNMATCHED_SHOWN])
+                    if len(unmatched) > MAX_UNMATCHED_SHOWN:
+                        unmatched_text += "\n..."
+                    message += f"\n\n{len(unmatched)} entries matched no installed package:\n{unmatched_text}"
+                QMessageBox.information(self, "Import Successful", message)
         else:
             QMessageBox.information(self, "Error", "No Connected Devices.")
 
+    def load_config_sections(self, file_path: str) -> list:
+        """Loads a config file and lets the user choose which of its sections to apply.
+
+        Args:
+            file_path (str): Path of the config file.
+
+        Returns:
+            list: The chosen ConfigSection objects, or an empty list if the file could not be loaded
+            or the user cancelled.
+        """
+        try:
+            with instrumentation.span("load_config"):
+                sections = config.load_config(file_path)
+        except (OSError, ValueError) as error:
+            QMessageBox.information(self, "Error", f"Could not load the config:\n{error}")
+            return []
+        if len(sections) < 2:
+            return sections
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Select Config Sections")
+        section_list = QListWidget(dialog)
+        for section in sections:
+            item = QListWidgetItem(f"{section.name} ({len(section.entries)})", section_list)
+            item.setCheckState(Qt.Checked)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, dialog)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(section_list)
+        layout.addWidget(buttons)
+        if dialog.exec_() != QDialog.Accepted:
+            return []
+        return [
+            section
+            for row, section in enumerate(sections)
+            if section_list.item(row).checkState() == Qt.Checked
+        ]
+
     def export(self) -> None:
         """Exports selected packages as a config file.
 
@@ -268,7 +1032,7 @@ class App(QMainWindow):
         Raises:
             None
         """
-        checked_packages = sorted(self.retrieve_checkbox_values(self.ui.table_1))
+        checked_packages = sorted(self.retrieve_checkbox_values(self.installed_model))
         if checked_packages:
             file_path, _ = QFileDialog.getSaveFileName(
                 self,
@@ -292,24 +1056,21 @@ class App(QMainWindow):
         """Prompts the user to reboot the device and performs the reboot if confirmed.
 
         This method displays a message box to the user asking if they want to reboot the device. If the user confirms,
-        the method executes the "adb shell reboot" command to reboot the device. If there are no connected devices or
+        a background job executes the "adb shell reboot" command to reboot the selected device. If there are no connected devices or
         an error occurs during the process, an error message box is shown.
 
-        Raises:
-            Exception: If an error occurs during the process.
-
         Returns:
             None
         """
-        try:
-            respose1 = QMessageBox.question(
-                self, "Rebooting Device", "Reboot the device now?"
+        respose1 = QMessageBox.question(
+            self, "Rebooting Device", "Reboot the device now?"
+        )
+        if respose1 == QMessageBox.Yes:
+            self.start_job(
+                lambda job, serial: adb.reboot(serial),
+                self.serial,
+                on_error=self.show_no_devices_error,
             )
-            if respose1 == QMessageBox.Yes:
-                output = subprocess.check_output("adb shell reboot")
-                QMessageBox.information(self, "Error", "No Connected Devices.")
-        except:
-            QMessageBox.information(self, "Error", "No Connected Devices.")
 
     def show_help(self) -> None:
         """
@@ -323,6 +1084,9 @@ class App(QMainWindow):
         Returns:
             None
         """
+        from PyQt5.QtCore import QUrl
+        from PyQt5.QtGui import QDesktopServices
+
         QDesktopServices.openUrl(QUrl("https://github.com/ixmjk/android_debloater"))
 
     def show_about_dialog(self) -> None:
@@ -350,7 +1114,7 @@ class App(QMainWindow):
 
         Retrieves the checked packages from the UI table and prompts the user with a confirmation dialog.
         If the user confirms, a warning message is displayed to ensure the user is aware of the risks.
-        If the user confirms again, the UI is disabled and each package is uninstalled using the `uninstall_package` method.
+        If the user confirms again, the packages are uninstalled in one batch by a background job using the `start_package_batch` method.
         After all selected packages are uninstalled, an information message is displayed and the UI is refreshed.
         If no packages are selected, an error message is displayed.
         If there are no connected devices, an error message is displayed.
@@ -361,81 +1125,199 @@ class App(QMainWindow):
         Returns:
             None
         """
-        try:
-            checked_packages = self.retrieve_checkbox_values(self.ui.table_1)
-            if checked_packages:
-                package_list_text = "\n".join(checked_packages)
-                respose1 = QMessageBox.question(
-                    self,
-                    "Uninstalling...",
-                    f"The following packages have been selected and will be uninstalled:\n\n{package_list_text}\n\nAre you sure you want to continue?",
+        checked_packages = self.retrieve_checkbox_values(self.installed_model)
+        if checked_packages:
+            package_list_text = "\n".join(checked_packages)
+            respose1 = QMessageBox.question(
+                self,
+                "Uninstalling...",
+                f"The following packages have been selected and will be uninstalled:\n\n{package_list_text}\n\nAre you sure you want to continue?",
+            )
+            if respose1 == QMessageBox.Yes:
+                warning_message = (
+                    "Warning:\n"
+                    "Uninstalling packages that you are unsure about or that are system packages "
+                    "might result in a bootloop.\n"
+                    "Are you still sure you want to continue?"
                 )
-                if respose1 == QMessageBox.Yes:
-                    warning_message = (
-                        "Warning:\n"
-                        "Uninstalling packages that you are unsure about or that are system packages "
-                        "might result in a bootloop.\n"
-                        "Are you still sure you want to continue?"
-                    )
-                    response2 = QMessageBox.question(
-                        self, "Important Note!", warning_message
-                    )
-                    if response2 == QMessageBox.Yes:
-                        self.ui.setEnabled(False)
-                        for package in checked_packages:
-                            self.uninstall_package(package)
-                        QMessageBox.information(
-                            self,
-                            "Uninstall Completed",
-                            "All selected packages uninsatlled successfully!",
-                        )
-                        self.refresh()
-            else:
-                QMessageBox.information(
-                    self, "Error", "No packages have been selected."
+                response2 = QMessageBox.question(
+                    self, "Important Note!", warning_message
                 )
-        except:
-            QMessageBox.information(self, "Error", "No Connected Devices.")
-        finally:
-            self.ui.setEnabled(True)
+                if response2 == QMessageBox.Yes:
+                    self.start_package_batch(
+                        plan.build_user_plan(
+                            self.package_states,
+                            self.selected_users,
+                            remove=set(checked_packages),
+                        ),
+                        "Uninstalled",
+                        "Uninstall Completed",
+                        "All selected packages uninsatlled successfully!",
+                    )
+        else:
+            QMessageBox.information(self, "Error", "No packages have been selected.")
 
-    def retrieve_checkbox_values(self, table: QTableWidget) -> list:
-        """Retrieves the values of checked checkboxes from a table.
+    def retrieve_checkbox_values(self, model: PackageTableModel) -> list:
+        """Retrieves the names of the checked packages from a package model.
 
         Args:
-            table (QTableWidget): The table widget containing checkboxes.
+            model (PackageTableModel): The package model containing the check states.
 
         Returns:
             list: A list of package names corresponding to the checked checkboxes.
         """
-        checked_packages = []
-        for row in range(table.rowCount()):
-            checkbox_item = table.item(row, 0)
-            if checkbox_item.checkState() == Qt.CheckState.Checked:
-                checked_packages.append(table.item(row, 1).text())
-        return checked_packages
+        return model.checked_packages()
+
+    def filter_packages(self, query: str) -> None:
+        """Shows only the packages matching the text of the filter box in both tables.
 
-    def uninstall_package(self, package_name: str):
-        """Uninstalls a package from the device using adb shell command.
+        Args:
+            query (str): A substring or glob pattern such as `facebook` or `com.samsung.*`.
+
+        Returns:
+            None
+        """
+        for table in (self.ui.table_1, self.ui.table_2):
+            table.model().set_filter(query)
+
+    def check_filtered_packages(self) -> None:
+        """Checks every package shown in the current table in one model update."""
+        table = self.ui.table_1 if self.ui.tabWidget.currentIndex() == 0 else self.ui.table_2
+        proxy_model = table.model()
+        proxy_model.sourceModel().set_checked(proxy_model.filtered_rows())
+
+    def start_package_batch(
+        self,
+        operations: list,
+        verb: str,
+        title: str,
+        message: str,
+        label: str = None,
+        resumes: journal.Batch = None,
+    ) -> None:
+        """Starts a background job that executes a plan on the selected device.
+
+        The status bar is updated as each package result arrives from the device.
+        When the batch is done, its outcome is shown and the UI is refreshed.
 
         Args:
-            package_name (str): Name of the package to uninstall.
+            operations (list): The plan.Operation objects to execute.
+            verb (str): Past tense of the operation, shown in the status bar.
+            title (str): The title of the message box shown at the end.
+            message (str): The message shown when every package succeeded.
+            label (str): Name of the batch in the journal and the statistics, its actions by default.
+            resumes (journal.Batch): The interrupted batch whose remaining operations these are.
 
         Returns:
-            None: This method doesn't return anything.
+            None
+        """
+        total = len(operations)
+        done = 0
+
+        def show_progress(result: adb.PackageResult) -> None:
+            nonlocal done
+            done += 1
+            self.update_statusbar(
+                f"Do not disconnect the device!   |   [+] {verb} {result.package} ({done}/{total})"
+            )
+
+        def show_result(results: list) -> None:
+            self.show_batch_result(title, message, results, total)
+            self.refresh()
+
+        self.update_statusbar(f"Do not disconnect the device!   |   [+] {verb} 0/{total}")
+        self.start_job(
+            self.run_package_batch,
+            operations,
+            self.serial,
+            label,
+            resumes,
+            on_result=show_result,
+            on_progress=show_progress,
+            on_error=self.show_batch_error,
+        )
+
+    def run_package_batch(
+        self,
+        job: Worker,
+        operations: list,
+        serial: str,
+        label: str = None,
+        resumes: journal.Batch = None,
+    ) -> list:
+        """Executes a plan over as few shell sessions as possible, recording it in the journal.
+
+        This method runs on a background thread. Every result is reported to the job as it arrives,
+        and the batch stops early when the job is cancelled. The batch is recorded as a span
+        named after its label, by default its actions such as "uninstall".
+
+        Args:
+            job (Worker): The worker running this method.
+            operations (list): The plan.Operation objects to execute.
+            serial (str): Serial of the target device.
+            label (str): Name of the batch in the journal and the statistics.
+            resumes (journal.Batch): The interrupted batch whose remaining operations these are.
+
+        Returns:
+            list: The results of the packages that were processed.
 
         Raises:
-            subprocess.CalledProcessError: If the adb shell command fails.
+            adb.AdbError: If the device is not available or the shell session fails.
+            OSError: If the journal cannot be written.
+        """
+        results = []
+        label = label or "+".join(sorted({i.action for i in operations}))
+        with instrumentation.span(label, serial), closing(
+            journal.run_journaled(
+                operations, serial, label, cancel_event=job.cancel_event, resumes=resumes
+            )
+        ) as batch:
+            for result in batch:
+                results.append(result)
+                job.report(result)
+                if job.is_cancelled():
+                    break
+        return results
+
+    def show_batch_result(
+        self, title: str, message: str, results: list, total: int
+    ) -> None:
+        """Shows the outcome of a package batch, listing any failed packages.
+
+        A cancelled batch says how many packages were skipped; it is shown as a warning
+        only if some of the packages that ran failed.
 
-        Note:
-            This method updates the status bar with the uninstallation progress and waits for 2 seconds after uninstallation.
+        Args:
+            title (str): The message box title.
+            message (str): The message shown when every package succeeded.
+            results (list): The results of the packages that were processed.
+            total (int): The number of packages in the batch.
 
+        Returns:
+            None
         """
-        self.update_statusbar(
-            f"Do not disconnect the device!   |   [+] Uninstalling {package_name}"
-        )
-        subprocess.check_output(f"adb shell pm uninstall -k --user 0 {package_name}")
-        QtTest.QTest.qWait(2000)
+        failures = [i for i in results if not i.success]
+        lines = [
+            f"{i.package}: {i.message}" if i.user == adb.DEFAULT_USER
+            else f"{i.package} (user {i.user}): {i.message}"
+            for i in failures
+        ]
+        cancelled_text = ""
+        if len(results) < total:
+            cancelled_text = (
+                f"Cancelled after {len(results)} of {total} packages, "
+                f"{total - len(results)} packages were skipped."
+            )
+            title, message = "Batch Cancelled", cancelled_text
+        if lines:
+            failure_text = "\n".join(lines)
+            if cancelled_text:
+                failure_text += f"\n\n{cancelled_text}"
+            QMessageBox.warning(
+                self, title, f"The following packages failed:\n\n{failure_text}"
+            )
+        else:
+            QMessageBox.information(self, title, message)
 
     def reinstall(self) -> None:
         """Reinstalls selected packages.
@@ -448,62 +1330,305 @@ class App(QMainWindow):
 
         Returns: None
         """
-        try:
-            checked_packages = self.retrieve_checkbox_values(self.ui.table_2)
-            if checked_packages:
-                package_list_text = "\n".join(checked_packages)
-                respose1 = QMessageBox.question(
-                    self,
-                    "Reinstalling...",
-                    f"The following packages have been selected and will be reinstalled:\n\n{package_list_text}\n\nAre you sure you want to continue?",
+        checked_packages = self.retrieve_checkbox_values(self.removed_model)
+        if checked_packages:
+            package_list_text = "\n".join(checked_packages)
+            respose1 = QMessageBox.question(
+                self,
+                "Reinstalling...",
+                f"The following packages have been selected and will be reinstalled:\n\n{package_list_text}\n\nAre you sure you want to continue?",
+            )
+            if respose1 == QMessageBox.Yes:
+                self.start_package_batch(
+                    plan.build_user_plan(
+                        self.package_states,
+                        self.selected_users,
+                        restore=set(checked_packages),
+                    ),
+                    "Reinstalled",
+                    "Reinstall Completed",
+                    "All selected packages have been reinstalled!",
                 )
-                if respose1 == QMessageBox.Yes:
-                    self.ui.setEnabled(False)
-                    for package in checked_packages:
-                        self.reinstall_package(package)
-                    QMessageBox.information(
-                        self,
-                        "Reinstall Completed",
-                        "All selected packages have been reinstalled!",
-                    )
-                    self.refresh()
-            else:
-                QMessageBox.information(
-                    self, "Error", "No packages have been selected."
+        else:
+            QMessageBox.information(self, "Error", "No packages have been selected.")
+
+    def rollback_last_batch(self) -> None:
+        """Undoes the packages changed by the last batch run on the selected device.
+
+        The batch is read from the journal of the device, together with the interrupted
+        batch it resumed, and every package it uninstalled is reinstalled (and every package
+        it reinstalled is uninstalled) in one batch, even if it ran in an earlier session.
+
+        Returns:
+            None
+        """
+        batches = journal.undo_batches(self.serial) if self.serial else []
+        operations = journal.rollback_plan(batches, self.package_states)
+        if not operations:
+            QMessageBox.information(
+                self, "Nothing to Undo", "The last batch changed no packages that can be restored."
+            )
+            return
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(batches[0].time))
+        package_list_text = "\n".join(
+            f"{i.action} {i.package}" if i.user == adb.DEFAULT_USER
+            else f"{i.action} {i.package} (user {i.user})"
+            for i in operations
+        )
+        response = QMessageBox.question(
+            self,
+            "Undo Last Batch",
+            f"The batch ({batches[0].label}) started on {started} will be undone:\n\n"
+            f"{package_list_text}\n\nAre you sure you want to continue?",
+        )
+        if response == QMessageBox.Yes:
+            self.start_package_batch(
+                operations,
+                "Undone",
+                "Undo Completed",
+                "The last batch has been undone!",
+                "rollback",
+            )
+
+    def apply_selection_to_all_devices(self) -> None:
+        """Uninstalls the packages selected in the 'Installed Packages' tab from every connected device.
+
+        Returns:
+            None
+        """
+        checked_packages = set(self.retrieve_checkbox_values(self.installed_model))
+        if checked_packages:
+            self.run_fleet_uninstall(
+                lambda installed, removed: plan.build_plan(
+                    installed, removed, remove=checked_packages
                 )
-        except:
-            QMessageBox.information(self, "Error", "No Connected Devices.")
-        finally:
-            self.ui.setEnabled(True)
+            )
+        else:
+            QMessageBox.information(self, "Error", "No packages have been selected.")
+
+    def apply_config_to_all_devices(self) -> None:
+        """Uninstalls the packages listed in a config file from every connected device.
+
+        The config entries are matched against the installed packages of each device separately,
+        so patterns expand to the packages that are actually present on that device.
+
+        Returns:
+            None
+        """
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Select a file config file:", "", "Config file (*.cfg)"
+        )
+        if file_path:
+            sections = self.load_config_sections(file_path)
+            if not sections:
+                return
+            entries = [i for section in sections for i in section.entries]
+            self.run_fleet_uninstall(
+                lambda installed, removed: plan.plan_config(entries, installed, removed)
+            )
+
+    def run_fleet_uninstall(self, make_plan) -> None:
+        """Uninstalls packages from all connected devices in parallel.
 
-    def reinstall_package(self, package_name: str):
-        """Reinstalls a package on the device using adb shell command.
+        A background job lists the connected devices and builds the plan of every online device
+        from its current package state. The plans are shown as a dry run, and after confirmation
+        only the devices with pending operations are changed by the `start_fleet_batch` method.
+        The users selected on the current device are planned on every device; devices
+        that miss one of them are skipped and reported in the dry run.
 
         Args:
-            package_name (str): The name of the package to be reinstalled.
+            make_plan (Callable[[list, list], list]): Builds a plan from the installed and removed packages of a user.
 
         Returns:
             None
+        """
+        users = sorted(self.selected_users)
+
+        def plan_fleet(job: Worker) -> dict:
+            with instrumentation.span("fleet_plan"):
+                serials = [i.serial for i in adb.list_devices() if i.state == "device"]
+                return plan.plan_devices(serials, make_plan, FLEET_WORKERS, users)
+
+        def confirm(device_plans: dict) -> None:
+            self.update_statusbar(f"Planned {len(device_plans)} devices.")
+            if not device_plans:
+                self.show_no_devices_error(None)
+                return
+            summary = []
+            for serial, operations in device_plans.items():
+                if isinstance(operations, Exception):
+                    summary.append(f"{serial}: skipped ({operations})")
+                else:
+                    summary.append(f"{serial}: {len(operations)} packages to uninstall")
+            plans = {
+                serial: operations
+                for serial, operations in device_plans.items()
+                if not isinstance(operations, Exception) and operations
+            }
+            summary_text = "\n".join(summary)
+            if not plans:
+                QMessageBox.information(
+                    self,
+                    "Nothing to Do",
+                    f"All devices are already up to date.\n\n{summary_text}",
+                )
+                return
+            response = QMessageBox.question(
+                self,
+                "Uninstalling on All Devices...",
+                f"{summary_text}\n\n"
+                "Uninstalling packages that you are unsure about or that are system packages "
+                "might result in a bootloop.\n"
+                "Are you sure you want to continue?",
+            )
+            if response == QMessageBox.Yes:
+                self.start_fleet_batch(plans)
 
-        Raises:
-            subprocess.CalledProcessError: If the adb shell command fails.
+        self.update_statusbar("Planning...")
+        self.start_job(
+            plan_fleet, on_result=confirm, on_error=self.show_no_devices_error
+        )
+
+    def start_fleet_batch(self, plans: dict) -> None:
+        """Starts a background job that executes plans on several devices at once.
+
+        Every device gets its own shell sessions on a bounded worker pool.
+        The status bar shows how many packages are done while the batch runs,
+        and a summary with the result of every device is displayed at the end.
+
+        Args:
+            plans (dict): Maps the serial of every target device to its plan.Operation objects.
 
-        Notes:
-            - This method updates the status bar with the current reinstallation process.
-            - It uses the adb shell command 'pm install-existing' to reinstall the package.
-            - After the reinstallation, it waits for 2 seconds before returning.
+        Returns:
+            None
         """
+        done = 0
+        total = sum(len(i) for i in plans.values())
+
+        def show_progress(value: tuple) -> None:
+            nonlocal done
+            done += 1
+            serial, result = value
+            self.update_statusbar(
+                f"Do not disconnect the devices!   |   [+] {serial}: {result.package}   |   {done}/{total} packages done on {len(plans)} devices"
+            )
+
+        def show_result(device_results: dict) -> None:
+            summary = []
+            for serial, results in device_results.items():
+                if isinstance(results, Exception):
+                    summary.append(f"{serial}: failed ({results})")
+                else:
+                    succeeded = sum(i.success for i in results)
+                    summary.append(
+                        f"{serial}: {succeeded}/{len(plans[serial])} uninstalled"
+                    )
+            summary_text = "\n".join(summary)
+            QMessageBox.information(self, "Uninstall Completed", summary_text)
+            self.refresh()
+
         self.update_statusbar(
-            f"Do not disconnect the device!  |  [+] Reinstalling {package_name}"
+            f"Do not disconnect the devices!   |   [+] 0/{total} packages done on {len(plans)} devices"
+        )
+
+        def run_fleet(job: Worker) -> dict:
+            limiter = scheduler.AdaptiveLimiter(FLEET_WORKERS)
+            with instrumentation.span("fleet_uninstall"):
+                return adb.run_fleet_batch(
+                    list(plans),
+                    lambda serial: journal.run_journaled(
+                        plans[serial], serial, plan.UNINSTALL, None, limiter, job.cancel_event
+                    ),
+                    FLEET_WORKERS,
+                    lambda serial, result: job.report((serial, result)),
+                    job.cancel_event,
+                )
+
+        self.start_job(
+            run_fleet,
+            on_result=show_result,
+            on_progress=show_progress,
+            on_error=self.show_batch_error,
+        )
+
+    def show_statistics(self) -> None:
+        """Shows the timing statistics of the adb calls and operations of this session.
+
+        The dialog lists every adb request and span with its count, failures, bytes read and
+        latency percentiles, slowest total first, and can export every recorded event
+        as a Chrome trace or as CSV.
+
+        Returns:
+            None
+        """
+        rows = instrumentation.summarize(instrumentation.recorder.snapshot())
+        columns = (
+            ("Category", "category", "{}"),
+            ("Name", "name", "{}"),
+            ("Count", "count", "{}"),
+            ("Failed", "failed", "{}"),
+            ("Bytes", "bytes_read", "{}"),
+            ("Total ms", "total_ms", "{:.1f}"),
+            ("Mean ms", "mean_ms", "{:.1f}"),
+            ("p50 ms", "p50_ms", "{:.1f}"),
+            ("p90 ms", "p90_ms", "{:.1f}"),
+            ("Max ms", "max_ms", "{:.1f}"),
+        )
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Performance Statistics")
+        dialog.resize(800, 400)
+        table = QTableWidget(len(rows), len(columns), dialog)
+        table.setHorizontalHeaderLabels([i[0] for i in columns])
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.verticalHeader().hide()
+        for row, values in enumerate(rows):
+            for column, (_, key, text) in enumerate(columns):
+                table.setItem(row, column, QTableWidgetItem(text.format(values[key])))
+        table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        buttons = QDialogButtonBox(QDialogButtonBox.Close, dialog)
+        export_button = QPushButton("Export...", dialog)
+        clear_button = QPushButton("Clear", dialog)
+        buttons.addButton(export_button, QDialogButtonBox.ActionRole)
+        buttons.addButton(clear_button, QDialogButtonBox.ResetRole)
+        buttons.rejected.connect(dialog.reject)
+        export_button.clicked.connect(self.export_statistics)
+        clear_button.clicked.connect(instrumentation.recorder.clear)
+        clear_button.clicked.connect(lambda: table.setRowCount(0))
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(table)
+        layout.addWidget(buttons)
+        dialog.exec_()
+
+    def export_statistics(self) -> None:
+        """Saves every recorded event as a Chrome trace (.json) or as CSV (.csv).
+
+        Returns:
+            None
+        """
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export Statistics",
+            "android_debloater_trace.json",
+            "Chrome trace (*.json);;CSV (*.csv)",
         )
-        subprocess.check_output(f"adb shell pm install-existing {package_name}")
-        QtTest.QTest.qWait(2000)
+        if not file_path:
+            return
+        try:
+            instrumentation.export(file_path)
+        except OSError as error:
+            QMessageBox.warning(self, "Error", f"Could not export the statistics:\n{error}")
 
 
 def main() -> None:
-    """Main function to run the application."""
+    """Main function to run the application.
+
+    With --measure-startup, the times to the first paint, to the first package rows and
+    to the first populated table are printed as JSON and the application quits.
+    """
     app = QApplication([])
     widget = App()
+    if "--measure-startup" in sys.argv[1:]:
+        StartupTimer(widget)
     widget.show()
     app.exec_()
 
@@ -0,0 +1,469 @@
+"""Headless command line front end of Android Debloater.
+
+Every command prints one JSON object per line (NDJSON), so the output can be piped
+into other tools. PyQt5 is not imported, so it runs on machines without a display.
+With --trace, the timing of every adb call is saved as a Chrome trace, or as CSV
+if the file name ends in .csv.
+
+    python android_debloater_cli.py devices [--watch]
+    python android_debloater_cli.py list [--serial SERIAL | --all] [--user USERS] [--details]
+    python android_debloater_cli.py apply CONFIG [--serial SERIAL | --all] [--user USERS] [--dry-run]
+    python android_debloater_cli.py restore CONFIG [--serial SERIAL | --all] [--user USERS] [--dry-run]
+    python android_debloater_cli.py diff CONFIG [--serial SERIAL | --all] [--user USERS]
+    python android_debloater_cli.py resume [--serial SERIAL | --all] [--dry-run]
+    python android_debloater_cli.py rollback [--serial SERIAL | --all] [--dry-run]
+    python android_debloater_cli.py snapshot [--serial SERIAL | --all]
+    python android_debloater_cli.py which PACKAGE [--removed]
+    python android_debloater_cli.py compare SERIAL [OTHER_SERIAL] [--at WHEN]
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Optional
+
+import adb
+import config
+import instrumentation
+import journal
+import metadata
+import plan
+import scheduler
+import snapshots
+
+
+def print_json(**fields) -> None:
+    """Prints an object as one line of JSON."""
+    print(json.dumps(fields), flush=True)
+
+
+def get_serials(args: argparse.Namespace) -> list:
+    """Returns the serials of the devices a command should run on.
+
+    Raises:
+        adb.AdbError: If no online device is connected.
+    """
+    if args.serial:
+        return [args.serial]
+    serials = [i.serial for i in adb.list_devices() if i.state == "device"]
+    if not serials:
+        raise adb.AdbError("No connected devices.")
+    return serials if args.all else serials[:1]
+
+
+def parse_users(text: str) -> Optional[list]:
+    """Parses the --user option: comma separated user ids, or `all` for every user of a device.
+
+    Returns:
+        Optional[list]: The user ids, or None for every user.
+
+    Raises:
+        ValueError: If the text is neither.
+    """
+    if text == "all":
+        return None
+    return [int(i) for i in text.split(",")]
+
+
+def load_entries(args: argparse.Namespace) -> list:
+    """Loads the entries of the config sections selected on the command line."""
+    sections = config.load_config(args.config)
+    if args.sections:
+        names = set(args.sections.split(","))
+        sections = [i for i in sections if i.name in names]
+    return [i for section in sections for i in section.entries]
+
+
+def list_devices(args: argparse.Namespace) -> int:
+    """Prints every device known to the adb server.
+
+    With --watch, a line is printed every time a device is attached, detached or
+    changes state, until interrupted.
+    """
+    if not args.watch:
+        for device in adb.list_devices():
+            print_json(serial=device.serial, state=device.state, model=device.model)
+        return 0
+    states = {}
+    try:
+        for devices in adb.track_devices():
+            current = {i.serial: i for i in devices}
+            for serial in states.keys() - current.keys():
+                print_json(serial=serial, state="detached")
+            for device in devices:
+                if states.get(device.serial) != device.state:
+                    print_json(serial=device.serial, state=device.state, model=device.model)
+            states = {i.serial: i.state for i in devices}
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def list_packages(args: argparse.Namespace) -> int:
+    """Prints the installed and removed packages of the users of the devices, with --details also their metadata.
+
+    The package state of the primary user of every device is also saved to the snapshot history.
+    """
+    for serial in get_serials(args):
+        states = plan.read_states(serial, parse_users(args.user))
+        if adb.DEFAULT_USER in states:
+            snapshots.try_save_snapshot(serial, "", *states[adb.DEFAULT_USER])
+        details = metadata.get_package_info(serial) if args.details else {}
+        for user, (installed, removed) in sorted(states.items()):
+            for state, packages in (("installed", installed), ("removed", removed)):
+                for package in packages:
+                    info = details.get(package)
+                    print_json(
+                        serial=serial,
+                        user=user,
+                        package=package,
+                        state=state,
+                        **(info._asdict() if info else {}),
+                    )
+    return 0
+
+
+def diff(args: argparse.Namespace) -> int:
+    """Prints how the devices differ from a config.
+
+    Packages of the config that are still installed are reported as "pending",
+    packages that are already removed as "removed", and entries that match no package at all as "unmatched".
+    """
+    entries = load_entries(args)
+    for serial in get_serials(args):
+        states = plan.read_states(serial, parse_users(args.user))
+        for user, (installed, removed) in sorted(states.items()):
+            pending, _ = config.resolve_entries(entries, installed)
+            done, _ = config.resolve_entries(entries, removed)
+            _, unmatched = config.resolve_entries(entries, sorted(installed + removed))
+            for package in pending:
+                print_json(serial=serial, user=user, package=package, state="pending")
+            for package in done:
+                print_json(serial=serial, user=user, package=package, state="removed")
+            for entry in unmatched:
+                print_json(serial=serial, user=user, entry=entry, state="unmatched")
+    return 0
+
+
+def take_snapshots(args: argparse.Namespace) -> int:
+    """Saves the package state of the devices to the snapshot history, in parallel."""
+
+    def save(serial: str) -> int:
+        installed, removed = scheduler.retry_call(adb.get_package_state, serial)
+        with closing(snapshots.connect()) as connection:
+            return snapshots.save_snapshot(
+                connection, serial, adb.get_device_model(serial), installed, removed
+            )
+
+    exit_code = 0
+    for serial, snapshot_id in adb.map_devices(get_serials(args), save, args.jobs).items():
+        if isinstance(snapshot_id, Exception):
+            print_json(serial=serial, error=str(snapshot_id))
+            exit_code = 1
+        else:
+            print_json(serial=serial, snapshot=snapshot_id)
+    return exit_code
+
+
+def parse_time(text: str) -> float:
+    """Parses a point in time: an ISO date such as `2024-05-01T12:00`, or an age such as `7d`, `12h` or `30m`.
+
+    Returns:
+        float: The time as a UNIX timestamp.
+
+    Raises:
+        ValueError: If the text is neither.
+    """
+    units = {"d": 86400, "h": 3600, "m": 60}
+    if text[-1:] in units:
+        try:
+            return time.time() - float(text[:-1]) * units[text[-1]]
+        except ValueError:
+            pass
+    return datetime.fromisoformat(text).timestamp()
+
+
+def format_time(timestamp: float) -> str:
+    """Formats a UNIX timestamp as a local ISO date and time."""
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+def which(args: argparse.Namespace) -> int:
+    """Prints the devices whose latest snapshot has a package installed, or removed with --removed."""
+    state = snapshots.REMOVED if args.removed else snapshots.INSTALLED
+    with closing(snapshots.connect()) as connection:
+        for match in snapshots.devices_with(connection, args.package, state):
+            print_json(
+                serial=match.serial, model=match.model, state=state, seen=format_time(match.seen)
+            )
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    """Prints the packages whose state differs between two snapshots.
+
+    With two serials, the latest snapshots of both devices are compared, or their
+    snapshots at --at. With one serial, its snapshot at --at is compared with its latest one.
+    Every line has the state of the package on the left and on the right side:
+    "installed", "removed" or null if the package was not on the device.
+    """
+    at = parse_time(args.at) if args.at else None
+    if args.other:
+        sides = ((args.serial, at), (args.other, at))
+    elif at is not None:
+        sides = ((args.serial, at), (args.serial, None))
+    else:
+        raise ValueError("Give a second serial or --at to compare with.")
+    with closing(snapshots.connect()) as connection:
+        states = []
+        for serial, side_at in sides:
+            state = snapshots.device_state(connection, serial, side_at)
+            if state is None:
+                raise ValueError(f"No snapshot of {serial} at that time.")
+            states.append(state)
+    for difference in snapshots.diff_states(*states):
+        print_json(**difference._asdict())
+    return 0
+
+
+def execute_plans(
+    args: argparse.Namespace, device_plans: dict, label: str, resumes: Optional[dict] = None
+) -> int:
+    """Executes the plans of several devices in parallel, recording them in the journal.
+
+    Transient errors are retried per device. At most --jobs devices are worked on at the
+    same time, and fewer run a chunk of their plan or read their package state again
+    while the devices respond slower than at their best.
+    With --dry-run the plans are printed and nothing is changed.
+
+    Args:
+        args (argparse.Namespace): The parsed command line.
+        device_plans (dict): Maps every serial to its list of Operation objects, or to
+            the exception raised while planning it.
+        label (str): Name of the batches in the journal.
+        resumes (Optional[dict]): Maps serials to the interrupted journal.Batch their plan finishes.
+
+    Returns:
+        int: 0 if every operation succeeded on every device, 1 otherwise.
+    """
+    exit_code = 0
+    plans = {}
+    for serial, operations in device_plans.items():
+        if isinstance(operations, Exception):
+            print_json(serial=serial, error=str(operations))
+            exit_code = 1
+        elif args.dry_run:
+            for operation in operations:
+                print_json(serial=serial, **operation._asdict())
+            print_json(serial=serial, planned=len(operations))
+        elif operations:
+            plans[serial] = operations
+        else:
+            print_json(serial=serial, total=0, succeeded=0)
+    if not plans:
+        return exit_code
+
+    limiter = scheduler.AdaptiveLimiter(args.jobs)
+    device_results = adb.run_fleet_batch(
+        list(plans),
+        lambda serial: journal.run_journaled(
+            plans[serial], serial, label, None, limiter, resumes=(resumes or {}).get(serial)
+        ),
+        args.jobs,
+        lambda serial, result: print_json(serial=serial, **result._asdict()),
+    )
+    for serial, results in device_results.items():
+        if isinstance(results, Exception):
+            print_json(serial=serial, error=str(results))
+            exit_code = 1
+        else:
+            succeeded = sum(i.success for i in results)
+            print_json(serial=serial, total=len(plans[serial]), succeeded=succeeded)
+            exit_code = exit_code or int(succeeded < len(plans[serial]))
+    return exit_code
+
+
+def run_plans(args: argparse.Namespace, restore: bool) -> int:
+    """Plans and executes a config on every selected device.
+
+    The package state of every device is read first and compared with the config, so only
+    the packages whose state actually differs get a command. Applying a config uninstalls the
+    matching installed packages, and restoring it reinstalls the matching removed packages.
+    The devices are processed in parallel, and the operations of all the users
+    selected with --user are run in the same shell sessions.
+
+    Returns:
+        int: 0 if every operation succeeded on every device, 1 otherwise.
+    """
+    entries = load_entries(args)
+    device_plans = plan.plan_devices(
+        get_serials(args),
+        lambda installed, removed: plan.plan_config(entries, installed, removed, restore),
+        args.jobs,
+        parse_users(args.user),
+    )
+    return execute_plans(args, device_plans, args.command)
+
+
+def apply(args: argparse.Namespace) -> int:
+    """Uninstalls the installed packages matching a config."""
+    return run_plans(args, restore=False)
+
+
+def restore(args: argparse.Namespace) -> int:
+    """Reinstalls the removed packages matching a config."""
+    return run_plans(args, restore=True)
+
+
+def resume(args: argparse.Namespace) -> int:
+    """Finishes the batches that were interrupted on the devices.
+
+    Only the operations whose result never reached the journal are planned again, against
+    the current package state. Devices whose last batch was not interrupted have nothing to do,
+    and an interrupted batch with nothing left is marked as completed.
+    """
+    interrupted = {}
+
+    def plan_device(serial: str) -> list:
+        batch = journal.interrupted_batch(serial)
+        if not batch:
+            return []
+        interrupted[serial] = batch
+        return journal.resume_plan(batch, plan.read_states(serial, journal.batch_users([batch])))
+
+    device_plans = adb.map_devices(get_serials(args), plan_device, args.jobs)
+    if not args.dry_run:
+        for serial, batch in interrupted.items():
+            if device_plans[serial] == []:
+                # the device already has the state the batch aimed for
+                journal.end_batch(serial, batch, journal.COMPLETED)
+    return execute_plans(args, device_plans, "resume", interrupted)
+
+
+def rollback(args: argparse.Namespace) -> int:
+    """Undoes the packages changed by the last batch of every device, with the batch it resumed."""
+
+    def plan_device(serial: str) -> list:
+        batches = journal.undo_batches(serial)
+        if not batches:
+            return []
+        return journal.rollback_plan(
+            batches, plan.read_states(serial, journal.batch_users(batches))
+        )
+
+    device_plans = adb.map_devices(get_serials(args), plan_device, args.jobs)
+    return execute_plans(args, device_plans, "rollback")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Builds the command line parser."""
+    parser = argparse.ArgumentParser(
+        description="Debloat Android devices without a GUI. Results are printed as NDJSON."
+    )
+    parser.add_argument(
+        "--trace",
+        help="save the timing of every adb call to this Chrome trace (.json) or CSV (.csv) file",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    devices = commands.add_parser("devices", help="list the connected devices")
+    devices.set_defaults(function=list_devices)
+    devices.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and print every device that is attached, detached or changes state",
+    )
+    for name, function, help_text, needs_config, can_plan in (
+        ("list", list_packages, "list installed and removed packages", False, False),
+        ("apply", apply, "uninstall the installed packages matching a config", True, True),
+        ("restore", restore, "reinstall the removed packages matching a config", True, True),
+        ("diff", diff, "show how the devices differ from a config", True, False),
+        ("resume", resume, "finish the batches interrupted on the devices", False, True),
+        ("rollback", rollback, "undo the last batch run on the devices", False, True),
+        ("snapshot", take_snapshots, "save the package state to the snapshot history", False, False),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.set_defaults(function=function)
+        if needs_config:
+            command.add_argument("config", help="path of the .cfg file")
+            command.add_argument(
+                "--sections", help="comma separated config sections to use (default: all)"
+            )
+        if name == "list":
+            command.add_argument(
+                "--details",
+                action="store_true",
+                help="also print the type, version, data size and APK path of every package",
+            )
+        if name in ("list", "apply", "restore", "diff"):
+            command.add_argument(
+                "-u",
+                "--user",
+                default=str(adb.DEFAULT_USER),
+                help="comma separated ids of the Android users or work profiles to use, "
+                "or 'all' (default: %(default)s)",
+            )
+        if can_plan:
+            command.add_argument(
+                "--dry-run",
+                action="store_true",
+                help="print the planned operations without changing the devices",
+            )
+        targets = command.add_mutually_exclusive_group()
+        targets.add_argument("-s", "--serial", help="serial of the target device")
+        targets.add_argument(
+            "--all", action="store_true", help="run on every connected device"
+        )
+        command.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=8,
+            help="maximum number of devices worked on at the same time, lowered while they "
+            "respond slowly (default: 8)",
+        )
+    which_command = commands.add_parser(
+        "which", help="list the devices that have a package installed in their latest snapshot"
+    )
+    which_command.set_defaults(function=which)
+    which_command.add_argument("package", help="the package name")
+    which_command.add_argument(
+        "--removed", action="store_true", help="list the devices where it is removed instead"
+    )
+    compare_command = commands.add_parser(
+        "compare", help="show how the packages of snapshots differ"
+    )
+    compare_command.set_defaults(function=compare)
+    compare_command.add_argument("serial", help="serial of the device on the left side")
+    compare_command.add_argument(
+        "other", nargs="?", help="serial of the device on the right side (default: the same device)"
+    )
+    compare_command.add_argument(
+        "--at",
+        help="use the snapshots taken at or before this time, an ISO date or an age such as 7d",
+    )
+    return parser
+
+
+def main(argv: list = None) -> int:
+    """Runs the command line front end and returns its exit code."""
+    args = build_parser().parse_args(argv)
+    try:
+        with instrumentation.span(args.command):
+            exit_code = args.function(args)
+    except (adb.AdbError, OSError, ValueError, sqlite3.Error) as error:
+        print_json(error=str(error))
+        exit_code = 1
+    if args.trace:
+        try:
+            instrumentation.export(args.trace)
+        except OSError as error:
+            print_json(error=f"Cannot save the trace: {error}")
+            exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
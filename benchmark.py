@@ -0,0 +1,274 @@
+"""Benchmarks the device operations of Android Debloater against the fake adb server.
+
+Each operation is timed on simulated devices of several sizes, and the latency
+percentiles and throughput are printed and optionally saved as JSON. Saved
+results can be compared with a later run to catch performance regressions:
+
+    python benchmark.py --packages 100 1000 10000 --output before.json
+    python benchmark.py --packages 100 1000 10000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+
+import adb
+import config
+import metadata
+import search
+from fake_adb_server import FakeAdbServer, FakeDevice
+
+RESULTS_VERSION = 1
+SERIAL = "BENCH001"
+# filter box queries: substrings of several lengths, a prefix pattern and a glob
+SEARCH_QUERIES = ("c", "app1", "vendor12", "com.vendor3.*", "*.app1?")
+
+
+def percentile(samples: list, percent: float) -> float:
+    """Returns the nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    return ordered[round(percent / 100 * (len(ordered) - 1))]
+
+
+def summarize(durations: list, items: int) -> dict:
+    """Returns the latency statistics and throughput of an operation.
+
+    Args:
+        durations (list): The duration of every run in seconds.
+        items (int): The number of packages or entries processed by one run.
+
+    Returns:
+        dict: Latency percentiles in milliseconds and the throughput in items per second.
+    """
+    total = sum(durations)
+    return {
+        "runs": len(durations),
+        "items": items,
+        "mean_ms": total / len(durations) * 1000,
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p90_ms": percentile(durations, 90) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+        "max_ms": max(durations) * 1000,
+        "items_per_second": items * len(durations) / total if total else 0.0,
+    }
+
+
+def time_runs(function, repeat: int) -> list:
+    """Calls a function `repeat` times and returns the duration of every call."""
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return durations
+
+
+def write_config(package_names: list) -> str:
+    """Writes a synthetic config with exact names, prefix patterns and globs, and returns its path."""
+    with tempfile.NamedTemporaryFile("w", suffix=".cfg", delete=False) as file:
+        file.write("# exact\n")
+        file.writelines(f"{i}\n" for i in package_names[::2])
+        file.write("# patterns\ncom.vendor1.*\n*.app1?\nnot.installed.*\n")
+    return file.name
+
+
+def fill_table_benchmark(package_names: list, repeat: int) -> list:
+    """Times filling the package table model, or returns None without PyQt5."""
+    try:
+        from package_model import PackageTableModel
+    except ImportError:
+        return None
+    model = PackageTableModel()
+    return time_runs(lambda: model.set_packages(package_names), repeat)
+
+
+def benchmark_device(package_count: int, args: argparse.Namespace) -> dict:
+    """Benchmarks every operation on a simulated device with `package_count` packages.
+
+    Returns:
+        dict: Maps every operation name to its statistics.
+    """
+    device = FakeDevice(SERIAL, package_count, args.latency, args.failure_rate)
+    server = FakeAdbServer([device]).start()
+    default_client, adb.client = adb.client, adb.AdbClient(port=server.port)
+    try:
+        installed, _ = adb.get_package_state(SERIAL)
+        batch = installed[: args.batch_size]
+        config_path = write_config(installed)
+        try:
+            sections = config.load_config(config_path)
+        finally:
+            os.remove(config_path)
+        entries = [i for section in sections for i in section.entries]
+        rows = {name: row for row, name in enumerate(installed)}
+
+        def run_batch(command) -> None:
+            with closing(adb.run_package_batch(batch, command, SERIAL)) as results:
+                for _ in results:
+                    pass
+
+        results = {
+            "refresh": summarize(
+                time_runs(lambda: adb.get_package_state(SERIAL), args.repeat),
+                package_count,
+            ),
+            "import_config": summarize(
+                time_runs(
+                    lambda: config.match_entries(entries, installed, rows), args.repeat
+                ),
+                len(entries),
+            ),
+        }
+        with tempfile.TemporaryDirectory() as cache_directory:
+            results["metadata_cold"] = summarize(
+                time_runs(
+                    lambda: metadata.get_package_info(
+                        SERIAL, tempfile.mkdtemp(dir=cache_directory)
+                    ),
+                    args.repeat,
+                ),
+                package_count,
+            )
+            metadata.get_package_info(SERIAL, cache_directory)
+            results["metadata_cached"] = summarize(
+                time_runs(
+                    lambda: metadata.get_package_info(SERIAL, cache_directory),
+                    args.repeat,
+                ),
+                package_count,
+            )
+        results["search_index"] = summarize(
+            time_runs(lambda: search.PackageIndex(installed), args.repeat), package_count
+        )
+        index = search.PackageIndex(installed)
+        results["search"] = summarize(
+            time_runs(
+                lambda: [index.search(i) for i in SEARCH_QUERIES], args.repeat
+            ),
+            len(SEARCH_QUERIES),
+        )
+        fill_table = fill_table_benchmark(installed, args.repeat)
+        if fill_table:
+            results["fill_table"] = summarize(fill_table, package_count)
+        uninstall, reinstall = [], []
+        for _ in range(args.repeat):
+            uninstall += time_runs(lambda: run_batch(adb.uninstall_command), 1)
+            reinstall += time_runs(lambda: run_batch(adb.reinstall_command), 1)
+        results["uninstall"] = summarize(uninstall, len(batch))
+        results["reinstall"] = summarize(reinstall, len(batch))
+        return results
+    finally:
+        adb.client = default_client
+        server.shutdown()
+        server.server_close()
+
+
+def print_results(results: dict) -> None:
+    """Prints the statistics of every device size and operation as a table."""
+    print(
+        f"{'packages':>8} {'operation':<16} {'p50 ms':>10} {'p90 ms':>10} "
+        f"{'p99 ms':>10} {'items/s':>12}"
+    )
+    for package_count, operations in results.items():
+        for name, stats in operations.items():
+            print(
+                f"{package_count:>8} {name:<16} {stats['p50_ms']:>10.3f} {stats['p90_ms']:>10.3f} "
+                f"{stats['p99_ms']:>10.3f} {stats['items_per_second']:>12.0f}"
+            )
+
+
+def compare_results(baseline: dict, results: dict, threshold: float) -> bool:
+    """Prints how the p50 latencies changed against a baseline.
+
+    Args:
+        baseline (dict): The results of an earlier run.
+        results (dict): The results of this run.
+        threshold (float): The relative slowdown above which an operation counts as a regression.
+
+    Returns:
+        bool: Whether any operation regressed.
+    """
+    regressed = False
+    for package_count, operations in results.items():
+        for name, stats in operations.items():
+            old_stats = baseline.get(package_count, {}).get(name)
+            if not old_stats or not old_stats["p50_ms"]:
+                continue
+            ratio = stats["p50_ms"] / old_stats["p50_ms"]
+            marker = ""
+            if ratio > 1 + threshold:
+                marker = "  REGRESSION"
+                regressed = True
+            print(
+                f"{package_count:>8} {name:<16} {old_stats['p50_ms']:>10.3f} -> "
+                f"{stats['p50_ms']:>10.3f} ms  ({ratio:.2f}x){marker}"
+            )
+    return regressed
+
+
+def main(argv: list = None) -> int:
+    """Runs the benchmarks and returns 1 if a regression was found, 0 otherwise."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--packages", type=int, nargs="+", default=[100, 1000, 10000],
+        help="package counts of the simulated devices (default: 100 1000 10000)",
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="runs per operation")
+    parser.add_argument(
+        "--batch-size", type=int, default=150,
+        help="packages per uninstall/reinstall batch (default: 150)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="simulated seconds per device command (default: 0)",
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0,
+        help="probability that an uninstall fails (default: 0)",
+    )
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2,
+        help="relative p50 slowdown reported as a regression (default: 0.2)",
+    )
+    args = parser.parse_args(argv)
+
+    results = {
+        str(package_count): benchmark_device(package_count, args)
+        for package_count in args.packages
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "version": RESULTS_VERSION,
+                    "created": datetime.now(timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "settings": {
+                        key: value
+                        for key, value in vars(args).items()
+                        if key not in ("output", "compare")
+                    },
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)["results"]
+        print()
+        return int(compare_results(baseline, results, args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
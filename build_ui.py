@@ -0,0 +1,48 @@
+"""Compiles android_debloater.ui into the Python module android_debloater_ui.py.
+
+Importing the compiled module at startup is much faster than parsing the .ui file
+with loadUi on every launch. The application falls back to the .ui file when the
+module is missing or older than the .ui file, so run this again after editing it:
+
+    python build_ui.py
+"""
+import os
+import sys
+
+from PyQt5 import uic
+
+UI_FILE = "android_debloater.ui"
+UI_MODULE = "android_debloater_ui.py"
+
+
+def build(directory: str = os.path.dirname(os.path.abspath(__file__))) -> str:
+    """Compiles the .ui file of a directory and returns the path of the generated module.
+
+    The module is written next to the .ui file, through a temporary file so that the
+    application never imports a half-written module.
+
+    Raises:
+        OSError: If the .ui file cannot be read or the module cannot be written.
+    """
+    module_path = os.path.join(directory, UI_MODULE)
+    temporary_path = f"{module_path}.tmp"
+    with open(os.path.join(directory, UI_FILE), "r") as source, open(
+        temporary_path, "w"
+    ) as target:
+        uic.compileUi(source, target)
+    os.replace(temporary_path, module_path)
+    return module_path
+
+
+def main() -> int:
+    """Builds the UI module and returns the exit code."""
+    try:
+        print(f"Wrote {build()}")
+    except OSError as error:
+        print(f"Cannot build the UI module: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
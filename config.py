@@ -0,0 +1,111 @@
+import bisect
+import fnmatch
+import os
+import re
+from typing import NamedTuple
+
+# name of the section holding the entries that appear before the first header
+DEFAULT_SECTION = "General"
+PATTERN_CHARACTERS = "*?["
+
+
+class ConfigSection(NamedTuple):
+    """A named group of package entries from a debloat config file."""
+
+    name: str
+    entries: list
+
+
+def load_config(file_path: str, _included: frozenset = frozenset()) -> list:
+    """Loads a debloat config file into its sections.
+
+    A config file lists one package name or glob pattern (such as `com.samsung.android.game.*`) per line.
+    A `# name` line starts a new section, and an `include other.cfg` line inserts the sections
+    of another config file, resolved relative to the including file.
+
+    Args:
+        file_path (str): Path of the config file.
+
+    Returns:
+        list: The non-empty ConfigSection objects of the file and its includes, in file order.
+
+    Raises:
+        OSError: If the file or one of its includes cannot be read.
+        ValueError: If the config files include each other in a loop.
+    """
+    file_path = os.path.abspath(file_path)
+    if file_path in _included:
+        raise ValueError(f"Config file includes itself: {file_path}")
+    sections = [ConfigSection(DEFAULT_SECTION, [])]
+    with open(file_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                sections.append(ConfigSection(line.lstrip("#").strip(), []))
+            elif line.startswith("include "):
+                include_path = os.path.join(
+                    os.path.dirname(file_path), line[len("include ") :].strip()
+                )
+                section_name = sections[-1].name
+                sections.extend(load_config(include_path, _included | {file_path}))
+                sections.append(ConfigSection(section_name, []))
+            else:
+                sections[-1].entries.append(line)
+    return [i for i in sections if i.entries]
+
+
+def is_pattern(entry: str) -> bool:
+    """Returns whether a config entry is a glob pattern rather than a package name."""
+    return any(i in entry for i in PATTERN_CHARACTERS)
+
+
+def match_entries(entries: list, names: list, rows: dict) -> tuple:
+    """Matches config entries against the packages of a table.
+
+    Package names are looked up in the name->row index, prefix patterns ending in `*`
+    are resolved with a binary search over the sorted names, and any other pattern
+    is matched with one compiled regular expression.
+
+    Args:
+        entries (list): The package names and patterns to match.
+        names (list): The sorted package names of the table.
+        rows (dict): Maps every package name to its row.
+
+    Returns:
+        tuple: The set of matched rows and the list of entries that matched nothing.
+    """
+    matched_rows = set()
+    unmatched = []
+    for entry in entries:
+        if not is_pattern(entry):
+            entry_rows = [rows[entry]] if entry in rows else []
+        elif entry.endswith("*") and not is_pattern(entry[:-1]):
+            prefix = entry[:-1]
+            start = bisect.bisect_left(names, prefix)
+            end = bisect.bisect_left(names, prefix + "\uffff", start)
+            entry_rows = [rows[i] for i in names[start:end]]
+        else:
+            regex = re.compile(fnmatch.translate(entry))
+            entry_rows = [rows[i] for i in names if regex.match(i)]
+        if entry_rows:
+            matched_rows.update(entry_rows)
+        else:
+            unmatched.append(entry)
+    return matched_rows, unmatched
+
+
+def resolve_entries(entries: list, package_names: list) -> tuple:
+    """Matches config entries against a plain list of package names.
+
+    Args:
+        entries (list): The package names and patterns to match.
+        package_names (list): The sorted package names to match against.
+
+    Returns:
+        tuple: The sorted matched package names and the list of entries that matched nothing.
+    """
+    rows = {name: row for row, name in enumerate(package_names)}
+    matched_rows, unmatched = match_entries(entries, package_names, rows)
+    return [package_names[i] for i in sorted(matched_rows)], unmatched
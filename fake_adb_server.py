@@ -0,0 +1,320 @@
+"""Stand-in adb server that simulates Android devices, for benchmarks and development.
+
+It speaks the subset of the adb server protocol used by the adb module, and
+interprets the shell commands Android Debloater sends to a device. Running it
+on the default port lets the GUI and the command line front end be used without a phone:
+
+    python fake_adb_server.py --devices 3 --packages 600 --latency 0.05
+"""
+import argparse
+import json
+import random
+import shlex
+import socketserver
+import threading
+import time
+
+
+class FakeDevice:
+    """A simulated device with a configurable number of packages.
+
+    Every shell command (except `echo`) sleeps for `latency` seconds, every
+    uninstall fails with probability `failure_rate`, and the shell session is cut
+    off after a command with probability `drop_rate`, like a flaky USB link. Every
+    fourth package is a system app; the others are user apps installed under /data/app.
+    Every user of the device, such as a work profile, has its own install state.
+    """
+
+    def __init__(
+        self,
+        serial: str,
+        package_count: int = 600,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+        drop_rate: float = 0.0,
+        users: tuple = (0,),
+    ) -> None:
+        """Initializes a device whose packages are all installed for all its users."""
+        self.serial = serial
+        self.model = f"Fake {serial}"
+        self.state = "device"
+        self.fingerprint = f"fake/{serial.lower()}/fake:14/FAKE.{seed}/1:user/release-keys"
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.installed = {
+            f"com.vendor{i % 50}.app{i}": True for i in range(package_count)
+        }
+        # user id -> package name -> installed; the primary user shares self.installed
+        self.user_installed = {
+            user: self.installed if user == 0 else dict(self.installed) for user in users
+        }
+        self.details = {
+            name: (
+                i % 4 == 0,
+                f"/system/app/{name}/{name}.apk" if i % 4 == 0 else f"/data/app/~~{seed}/{name}-1/base.apk",
+                f"{1 + i % 7}.{i % 10}.0",
+                (i % 97) * 40960,
+            )
+            for i, name in enumerate(self.installed)
+        }
+        self.lock = threading.Lock()
+
+    def execute(self, script: str):
+        """Runs a shell command line and yields its output as it is produced.
+
+        Args:
+            script (str): Commands separated by `;`, as sent in a `shell:` request.
+
+        Yields:
+            str: Output chunks, with Windows line endings for `pm list packages` like real devices.
+
+        Raises:
+            ConnectionError: If the session is dropped, which closes the client connection.
+        """
+        status = 0
+        for command in script.split(";"):
+            args = shlex.split(command.replace("2>&1", ""))
+            if not args:
+                continue
+            if args[0] == "echo":
+                yield " ".join(i.replace("$?", str(status)) for i in args[1:]) + "\n"
+                continue
+            time.sleep(self.latency)
+            status, output = self.run_command(args)
+            yield output
+            if self.random.random() < self.drop_rate:
+                raise ConnectionError("The USB link dropped.")
+
+    def run_command(self, args: list) -> tuple:
+        """Runs a single shell command and returns its exit status and output."""
+        with self.lock:
+            user = int(args[args.index("--user") + 1]) if "--user" in args else 0
+            installed_packages = self.user_installed.get(user)
+            if args[:3] == ["pm", "list", "users"]:
+                return 0, "Users:\n" + "".join(
+                    f"\tUserInfo{{{i}:{'Owner' if i == 0 else f'Work profile {i}'}:{13 if i == 0 else 1030}}} running\n"
+                    for i in self.user_installed
+                )
+            if installed_packages is None:
+                return 255, f"Error: user {user} not found\n"
+            if args[0] == "getprop":
+                if args[1:] == ["ro.build.fingerprint"]:
+                    return 0, f"{self.fingerprint}\n"
+                return 0, f"{self.model}\n"
+            if args[:3] == ["pm", "list", "packages"]:
+                return 0, "".join(
+                    f"package:{self.details[name][1] + '=' if '-f' in args else ''}{name}\r\n"
+                    for name, installed in sorted(installed_packages.items())
+                    if (installed or "-u" in args)
+                    and ("-s" not in args or self.details[name][0])
+                    and ("-3" not in args or not self.details[name][0])
+                )
+            if args[:2] == ["dumpsys", "diskstats"]:
+                return 0, self.diskstats()
+            if args[:2] == ["dumpsys", "package"]:
+                names = args[2:] if args[2:] != ["packages"] else sorted(self.installed)
+                return 0, self.dumpsys_package(names)
+            if args[:2] == ["pm", "uninstall"]:
+                name = args[-1]
+                if not installed_packages.get(name):
+                    return 1, f"Failure [not installed for {user}]\n"
+                if self.random.random() < self.failure_rate:
+                    return 1, "Failure [DELETE_FAILED_INTERNAL_ERROR]\n"
+                installed_packages[name] = False
+                return 0, "Success\n"
+            if args[:2] == ["pm", "install-existing"]:
+                name = args[-1]
+                if name not in installed_packages:
+                    return 1, f"Package {name} doesn't exist\n"
+                installed_packages[name] = True
+                return 0, f"Package {name} installed for user: {user}\n"
+        return 127, f"/system/bin/sh: {args[0]}: not found\n"
+
+    def diskstats(self) -> str:
+        """Returns the package size lists of `dumpsys diskstats`."""
+        names = list(self.details)
+        data_sizes = [self.details[i][3] for i in names]
+        return (
+            "Latency: 1ms [512B Data Write]\n"
+            f"Package Names: {json.dumps(names, separators=(',', ':'))}\n"
+            f"App Sizes: {json.dumps([4096] * len(names), separators=(',', ':'))}\n"
+            f"App Data Sizes: {json.dumps(data_sizes, separators=(',', ':'))}\n"
+            f"Cache Sizes: {json.dumps([0] * len(names), separators=(',', ':'))}\n"
+        )
+
+    def dumpsys_package(self, names: list) -> str:
+        """Returns the `Packages:` section of `dumpsys package` for some packages."""
+        blocks = ["Packages:\n"]
+        for name in names:
+            if name not in self.details:
+                continue
+            system, apk_path, version, _ = self.details[name]
+            blocks.append(
+                f"  Package [{name}] ({abs(hash(name)) % 0xFFFFFFF:07x}):\n"
+                f"    userId=10{len(blocks):03}\n"
+                f"    codePath={apk_path.rpartition('/')[0]}\n"
+                f"    versionCode={len(blocks)} minSdk=28 targetSdk=34\n"
+                f"    versionName={version}\n"
+                f"    pkgFlags=[ {'SYSTEM ' if system else ''}HAS_CODE ALLOW_CLEAR_USER_DATA ]\n"
+                "    User 0: ceDataInode=0 installed="
+                f"{str(self.installed[name]).lower()} hidden=false suspended=false\n"
+            )
+        blocks.append("\nQueries:\n  system apps queryable: false\n")
+        return "".join(blocks)
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection of the fake adb server."""
+
+    def read_exactly(self, size: int) -> bytes:
+        """Reads exactly `size` bytes from the client."""
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("The client closed the connection.")
+            data += chunk
+        return data
+
+    def fail(self, message: str) -> None:
+        """Sends a FAIL response with a message."""
+        data = message.encode()
+        self.request.sendall(b"FAIL" + b"%04x" % len(data) + data)
+
+    def handle(self) -> None:
+        """Answers requests until a service takes over or closes the connection."""
+        device = None
+        try:
+            while True:
+                request = self.read_exactly(int(self.read_exactly(4), 16)).decode()
+                if request == "host:devices-l":
+                    data = self.server.device_list().encode()
+                    self.request.sendall(b"OKAY" + b"%04x" % len(data) + data)
+                    return
+                if request == "host:track-devices-l":
+                    self.request.sendall(b"OKAY")
+                    generation = None
+                    while True:
+                        with self.server.changed:
+                            self.server.changed.wait_for(
+                                lambda: self.server.generation != generation
+                            )
+                            generation = self.server.generation
+                            data = self.server.device_list().encode()
+                        self.request.sendall(b"%04x" % len(data) + data)
+                if request.startswith("host:transport"):
+                    serial = request.partition("host:transport:")[2]
+                    if not serial:
+                        serial = next(iter(self.server.devices), None)
+                    device = self.server.devices.get(serial)
+                    if device is None:
+                        self.fail(f"device '{serial}' not found")
+                        return
+                    if device.state != "device":
+                        self.fail(f"device {device.state}")
+                        return
+                    self.request.sendall(b"OKAY")
+                elif request.startswith("shell:") and device:
+                    self.request.sendall(b"OKAY")
+                    for output in device.execute(request[len("shell:") :]):
+                        self.request.sendall(output.encode())
+                    return
+                elif request == "reboot:" and device:
+                    self.request.sendall(b"OKAY")
+                    return
+                else:
+                    self.fail(f"unknown request: {request}")
+                    return
+        except (ConnectionError, BrokenPipeError):
+            pass
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """Threaded TCP server simulating an adb server with several devices.
+
+    Devices can be attached, detached and change state while the server runs;
+    clients of `host:track-devices-l` are sent the new device list after every change.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, devices: list, port: int = 0) -> None:
+        """Starts listening on localhost; port 0 picks a free port."""
+        super().__init__(("127.0.0.1", port), FakeAdbHandler)
+        self.devices = {i.serial: i for i in devices}
+        self.changed = threading.Condition()
+        self.generation = 0
+
+    def device_list(self) -> str:
+        """Returns the device list in the format of `adb devices -l`."""
+        return "".join(
+            f"{i.serial}\t{i.state} usb:1-{n} product:fake model:{i.model.replace(' ', '_')} transport_id:{n}\n"
+            for n, i in enumerate(list(self.devices.values()), start=1)
+        )
+
+    def notify(self) -> None:
+        """Wakes up the device trackers after the device list changed."""
+        with self.changed:
+            self.generation += 1
+            self.changed.notify_all()
+
+    def attach(self, device: FakeDevice) -> None:
+        """Attaches a device, as if it was plugged in."""
+        self.devices[device.serial] = device
+        self.notify()
+
+    def detach(self, serial: str) -> None:
+        """Detaches a device, as if it was unplugged."""
+        self.devices.pop(serial, None)
+        self.notify()
+
+    def set_state(self, serial: str, state: str) -> None:
+        """Changes the state of a device, for example to `unauthorized` or `offline`."""
+        self.devices[serial].state = state
+        self.notify()
+
+    @property
+    def port(self) -> int:
+        """The port the server listens on."""
+        return self.server_address[1]
+
+    def start(self) -> "FakeAdbServer":
+        """Serves requests on a background thread and returns the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main() -> None:
+    """Runs a fake adb server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=5037)
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--packages", type=int, default=600)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--users", default="0", help="comma separated user ids of every device, such as 0,10"
+    )
+    args = parser.parse_args()
+    users = tuple(int(i) for i in args.users.split(","))
+    devices = [
+        FakeDevice(
+            f"FAKE{i:03}", args.packages, args.latency, args.failure_rate, i, args.drop_rate, users
+        )
+        for i in range(1, args.devices + 1)
+    ]
+    with FakeAdbServer(devices, args.port) as server:
+        print(f"Fake adb server listening on port {server.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
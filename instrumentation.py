@@ -0,0 +1,251 @@
+"""Timing of adb calls and application operations, with Chrome trace and CSV export.
+
+Every request sent to the adb server is recorded with its wall time, the number of
+bytes read, its status and the device serial, and the main operations of the
+application are recorded as spans around them:
+
+    with instrumentation.span("refresh", serial=serial):
+        ...
+
+The recorded events can be summarized per name or exported, and the Chrome trace
+can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+import csv
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple, Optional
+
+ADB = "adb"
+SPAN = "span"
+OK = "ok"
+# a generator of output lines closed before the end, for example by a cancelled job
+CANCELLED = "cancelled"
+# oldest events are dropped beyond this many, so a long session has bounded memory
+MAX_EVENTS = 100000
+# event names are cut to this length, since scripted shell batches can be 4000 characters long
+MAX_NAME_LENGTH = 200
+CSV_FIELDS = (
+    "name",
+    "category",
+    "start_ms",
+    "duration_ms",
+    "serial",
+    "bytes_read",
+    "status",
+    "thread",
+)
+
+
+class Event(NamedTuple):
+    """A timed adb call or span."""
+
+    name: str
+    category: str
+    start: float  # seconds since the recorder was created
+    duration: float  # seconds
+    serial: Optional[str]
+    bytes_read: int
+    status: str
+    thread: str
+
+
+class Recorder:
+    """Thread-safe store of the recorded events."""
+
+    def __init__(self, max_events: int = MAX_EVENTS) -> None:
+        """Initializes an empty recorder."""
+        self.origin = time.perf_counter()
+        self.events = deque(maxlen=max_events)
+        self.lock = threading.Lock()
+
+    def record(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        serial: Optional[str] = None,
+        bytes_read: int = 0,
+        status: str = OK,
+    ) -> None:
+        """Records an event that started at `start` (a time.perf_counter value) and ends now."""
+        end = time.perf_counter()
+        event = Event(
+            name[:MAX_NAME_LENGTH],
+            category,
+            start - self.origin,
+            end - start,
+            serial,
+            bytes_read,
+            status,
+            threading.current_thread().name,
+        )
+        with self.lock:
+            self.events.append(event)
+
+    def snapshot(self) -> list:
+        """Returns a copy of the recorded events, oldest first."""
+        with self.lock:
+            return list(self.events)
+
+    def clear(self) -> None:
+        """Forgets every recorded event."""
+        with self.lock:
+            self.events.clear()
+
+
+recorder = Recorder()
+
+
+def error_status(error: BaseException) -> str:
+    """Returns the status recorded for an operation that raised an exception."""
+    if isinstance(error, GeneratorExit):
+        return CANCELLED
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+
+def record_adb(
+    request: str, serial: Optional[str], start: float, bytes_read: int = 0, status: str = OK
+) -> None:
+    """Records an adb call that started at `start` (a time.perf_counter value) and ends now."""
+    recorder.record(request, ADB, start, serial, bytes_read, status)
+
+
+@contextmanager
+def span(name: str, serial: Optional[str] = None) -> Iterator[None]:
+    """Records the time spent in a block of code as a span.
+
+    The status of the span is OK, or the exception that left the block.
+    """
+    start = time.perf_counter()
+    status = OK
+    try:
+        yield
+    except BaseException as error:
+        status = error_status(error)
+        raise
+    finally:
+        recorder.record(name, SPAN, start, serial, status=status)
+
+
+def event_key(event: Event) -> str:
+    """Returns the name an event is summarized under.
+
+    Shell commands are grouped by the first two words of their first command, such as
+    `shell:pm uninstall`, so the scripted batches of different packages add up instead
+    of getting one row each.
+    """
+    if event.category == ADB and event.name.startswith("shell:"):
+        command = event.name[len("shell:") :].split(";", 1)[0]
+        return "shell:" + " ".join(command.split()[:2])
+    return event.name
+
+
+def summarize(events: list) -> list:
+    """Computes the statistics of the events, grouped by category and name.
+
+    Args:
+        events (list): The Event objects to summarize.
+
+    Returns:
+        list: One dict per group with its category, name, count, failed count (cancelled
+        events are not failures), total bytes and total, mean, p50, p90 and max duration
+        in milliseconds, the slowest total first.
+    """
+    groups = {}
+    for event in events:
+        groups.setdefault((event.category, event_key(event)), []).append(event)
+    rows = []
+    for (category, name), group in groups.items():
+        durations = sorted(i.duration * 1000 for i in group)
+        rows.append(
+            {
+                "category": category,
+                "name": name,
+                "count": len(group),
+                "failed": sum(i.status not in (OK, CANCELLED) for i in group),
+                "bytes_read": sum(i.bytes_read for i in group),
+                "total_ms": sum(durations),
+                "mean_ms": sum(durations) / len(durations),
+                "p50_ms": durations[round(0.5 * (len(durations) - 1))],
+                "p90_ms": durations[round(0.9 * (len(durations) - 1))],
+                "max_ms": durations[-1],
+            }
+        )
+    return sorted(rows, key=lambda i: i["total_ms"], reverse=True)
+
+
+def write_chrome_trace(file_path: str, events: list) -> None:
+    """Writes events in the Chrome trace event format.
+
+    Every thread gets its own track, so adb calls running in parallel on several
+    devices show up side by side under the spans that started them.
+
+    Raises:
+        OSError: If the file cannot be written.
+    """
+    threads = {}
+    trace_events = []
+    for event in events:
+        thread_id = threads.setdefault(event.thread, len(threads) + 1)
+        trace_events.append(
+            {
+                "name": event.name,
+                "cat": event.category,
+                "ph": "X",
+                "ts": event.start * 1e6,
+                "dur": event.duration * 1e6,
+                "pid": 1,
+                "tid": thread_id,
+                "args": {
+                    "serial": event.serial,
+                    "bytes_read": event.bytes_read,
+                    "status": event.status,
+                },
+            }
+        )
+    trace_events.extend(
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": thread_id, "args": {"name": name}}
+        for name, thread_id in threads.items()
+    )
+    with open(file_path, "w") as file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+
+def write_csv(file_path: str, events: list) -> None:
+    """Writes events as CSV, one row per event with the columns of CSV_FIELDS.
+
+    Raises:
+        OSError: If the file cannot be written.
+    """
+    with open(file_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_FIELDS)
+        for event in events:
+            writer.writerow(
+                (
+                    event.name,
+                    event.category,
+                    f"{event.start * 1000:.3f}",
+                    f"{event.duration * 1000:.3f}",
+                    event.serial or "",
+                    event.bytes_read,
+                    event.status,
+                    event.thread,
+                )
+            )
+
+
+def export(file_path: str, events: Optional[list] = None) -> None:
+    """Writes the recorded events as CSV if the path ends in .csv, as a Chrome trace otherwise.
+
+    Raises:
+        OSError: If the file cannot be written.
+    """
+    events = recorder.snapshot() if events is None else events
+    if file_path.lower().endswith(".csv"):
+        write_csv(file_path, events)
+    else:
+        write_chrome_trace(file_path, events)
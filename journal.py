@@ -0,0 +1,390 @@
+"""Append-only journal of the package batches run on every device.
+
+Before a batch changes anything, its planned operations are written to the journal of
+the device, and every result is appended as soon as the device reports it. If the
+application crashes, is closed or loses the USB link halfway, the journal tells
+exactly which packages were confirmed, so the batch can be resumed from there, and
+the packages a batch changed can be put back in one batched session.
+
+Each device has one file of JSON lines, one record per line:
+
+    {"type": "begin", "batch": ID, "time": ..., "label": "uninstall", "operations": [[action, package, user], ...]}
+    {"type": "done", "batch": ID, "package": ..., "success": true, "message": "Success", "user": 0}
+    {"type": "end", "batch": ID, "status": "completed"}
+
+A record torn by a crash in the middle of a write is ignored when the journal is read.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import closing
+from typing import Iterator, NamedTuple, Optional, TextIO
+
+import adb
+import paths
+import plan
+import scheduler
+
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+# the batch stopped on an error, such as a device unplugged halfway
+FAILED = "failed"
+# the user chose not to resume an interrupted batch
+ABANDONED = "abandoned"
+# the remaining operations of an interrupted batch were started as a new batch
+RESUMED = "resumed"
+# results are flushed one by one, which survives a crash of the application, and
+# synced to the disk every this many results, which also survives a power loss
+SYNC_INTERVAL = 50
+# above this size, the journal of a device is rewritten with its last KEEP_BATCHES batches
+MAX_JOURNAL_SIZE = 1 << 20
+KEEP_BATCHES = 20
+
+
+class Batch(NamedTuple):
+    """A batch read back from the journal of a device."""
+
+    batch_id: str
+    label: str
+    time: float
+    operations: list  # plan.Operation objects, in plan order
+    results: list  # adb.PackageResult objects of the confirmed packages, in order
+    status: Optional[str]  # None if the batch never ended, such as after a crash
+
+
+def journal_file(serial: Optional[str], directory: Optional[str] = None) -> str:
+    """Returns the path of the journal of a device.
+
+    The serial is kept readable in the file name, and a hash of it keeps the names of
+    serials that only differ in characters not allowed in file names apart.
+    """
+    serial = serial or ""
+    name = re.sub(r"[^\w.-]", "_", serial) or "default"
+    key = hashlib.sha1(serial.encode()).hexdigest()[:8]
+    return os.path.join(directory or paths.data_directory(), "journal", f"{name}-{key}.jsonl")
+
+
+def parse_records(lines: Iterator[str]) -> list:
+    """Rebuilds the batches of a journal from its lines.
+
+    Args:
+        lines (Iterator[str]): The lines of the journal file.
+
+    Returns:
+        list: The Batch objects, oldest first. Lines that are not valid records are skipped.
+    """
+    batches = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+            batch_id = record["batch"]
+            if record["type"] == "begin":
+                batches[batch_id] = {
+                    "batch_id": batch_id,
+                    "label": record["label"],
+                    "time": record["time"],
+                    "operations": [plan.Operation(*i) for i in record["operations"]],
+                    "results": [],
+                    "status": None,
+                }
+            elif record["type"] == "done":
+                batches[batch_id]["results"].append(
+                    adb.PackageResult(
+                        record["package"],
+                        record["success"],
+                        record["message"],
+                        record.get("user", adb.DEFAULT_USER),
+                    )
+                )
+            elif record["type"] == "end":
+                batches[batch_id]["status"] = record["status"]
+        except (ValueError, KeyError, TypeError):
+            continue  # a torn last line, or a record of a batch lost by compaction
+    return [Batch(**i) for i in batches.values()]
+
+
+def read_batches(serial: Optional[str], directory: Optional[str] = None) -> list:
+    """Reads the batches recorded for a device.
+
+    Returns:
+        list: The Batch objects, oldest first. Empty if the journal does not exist or cannot be read.
+    """
+    try:
+        with open(journal_file(serial, directory), "r", encoding="utf-8") as file:
+            return parse_records(file)
+    except OSError:
+        return []
+
+
+def batch_records(batch: Batch) -> Iterator[dict]:
+    """Yields the records that write a batch back to a journal."""
+    yield {
+        "type": "begin",
+        "batch": batch.batch_id,
+        "time": batch.time,
+        "label": batch.label,
+        "operations": [list(i) for i in batch.operations],
+    }
+    for result in batch.results:
+        yield {"type": "done", "batch": batch.batch_id, **result._asdict()}
+    if batch.status:
+        yield {"type": "end", "batch": batch.batch_id, "status": batch.status}
+
+
+def compact(file_path: str) -> None:
+    """Rewrites a journal with its last KEEP_BATCHES batches, atomically.
+
+    Raises:
+        OSError: If the journal cannot be read or written.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        batches = parse_records(file)[-KEEP_BATCHES:]
+    temporary_path = f"{file_path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        for batch in batches:
+            for record in batch_records(batch):
+                file.write(json.dumps(record) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, file_path)
+
+
+def open_journal(file_path: str) -> TextIO:
+    """Opens a journal for appending, creating its directory if needed.
+
+    A last line torn by a crash is terminated first, so the next record starts on a line of its own.
+
+    Raises:
+        OSError: If the journal cannot be opened.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "ab+") as file:
+        if file.seek(0, os.SEEK_END) > 0:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
+    return open(file_path, "a", encoding="utf-8")
+
+
+class JournalWriter:
+    """Records one batch in the journal of a device as it runs."""
+
+    def __init__(
+        self,
+        serial: Optional[str],
+        operations: list,
+        label: str,
+        directory: Optional[str] = None,
+    ) -> None:
+        """Opens the journal of a device and durably records the start of a batch.
+
+        Args:
+            serial (Optional[str]): Serial of the device.
+            operations (list): The plan.Operation objects of the batch.
+            label (str): What the batch does, such as "uninstall" or "rollback".
+            directory (Optional[str]): Directory of the journals, the user data directory by default.
+
+        Raises:
+            OSError: If the journal cannot be written.
+        """
+        self.batch_id = uuid.uuid4().hex
+        file_path = journal_file(serial, directory)
+        if os.path.exists(file_path) and os.path.getsize(file_path) > MAX_JOURNAL_SIZE:
+            compact(file_path)
+        self.file = open_journal(file_path)
+        self.unsynced = 0
+        self.write(
+            {
+                "type": "begin",
+                "batch": self.batch_id,
+                "time": time.time(),
+                "label": label,
+                "operations": [list(i) for i in operations],
+            },
+            sync=True,
+        )
+
+    def write(self, record: dict, sync: bool = False) -> None:
+        """Appends a record and flushes it, syncing it to the disk if asked or due."""
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if sync or self.unsynced >= SYNC_INTERVAL:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def record(self, result: adb.PackageResult) -> None:
+        """Records the result of a package confirmed by the device."""
+        self.write({"type": "done", "batch": self.batch_id, **result._asdict()})
+
+    def close(self, status: str) -> None:
+        """Durably records the end of the batch and closes the journal."""
+        try:
+            self.write({"type": "end", "batch": self.batch_id, "status": status}, sync=True)
+        finally:
+            self.file.close()
+
+
+def run_journaled(
+    operations: list,
+    serial: Optional[str],
+    label: str,
+    directory: Optional[str] = None,
+    limiter: Optional[scheduler.AdaptiveLimiter] = None,
+    cancel_event: Optional[threading.Event] = None,
+    resumes: Optional[Batch] = None,
+) -> Iterator[adb.PackageResult]:
+    """Executes a plan on a device with scheduler.run_operations, recording it in the journal.
+
+    The batch ends as COMPLETED when every result has been read, as CANCELLED when the
+    generator is closed early or cancelled between retries, and as FAILED when the device
+    keeps failing. If the process dies instead, the batch has no end and is found by
+    interrupted_batch. The interrupted batch it resumes, if any, is marked as RESUMED
+    once the new batch is recorded, so a rollback undoes both only if the resume started.
+
+    Args:
+        operations (list): The plan.Operation objects to execute.
+        serial (Optional[str]): Serial of the target device.
+        label (str): What the batch does, such as "uninstall" or "rollback".
+        directory (Optional[str]): Directory of the journals, the user data directory by default.
+        limiter (Optional[scheduler.AdaptiveLimiter]): Shared by the devices worked on at the same time.
+        cancel_event (Optional[threading.Event]): Stops the waits between retries when set.
+        resumes (Optional[Batch]): The interrupted batch whose remaining operations these are.
+
+    Yields:
+        adb.PackageResult: The result of every operation, in plan order.
+
+    Raises:
+        adb.AdbError: If the device is not available or the session fails.
+        OSError: If the journal cannot be written; nothing is run if it cannot be opened.
+    """
+    operations = list(dict.fromkeys(operations))  # an operation listed twice runs once
+    writer = JournalWriter(serial, operations, label, directory)
+    status = FAILED
+    done = 0
+    try:
+        if resumes:
+            writer.write(
+                {"type": "end", "batch": resumes.batch_id, "status": RESUMED}, sync=True
+            )
+        with closing(
+            scheduler.run_operations(operations, serial, limiter, cancel_event)
+        ) as results:
+            for result in results:
+                writer.record(result)
+                done += 1
+                yield result
+        status = COMPLETED if done == len(operations) else CANCELLED
+    except GeneratorExit:
+        status = CANCELLED
+        raise
+    finally:
+        writer.close(status)
+
+
+def end_batch(
+    serial: Optional[str], batch: Batch, status: str, directory: Optional[str] = None
+) -> None:
+    """Records a new end status for a batch, such as ABANDONED or COMPLETED.
+
+    Raises:
+        OSError: If the journal cannot be written.
+    """
+    with open_journal(journal_file(serial, directory)) as file:
+        file.write(json.dumps({"type": "end", "batch": batch.batch_id, "status": status}) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def last_batch(serial: Optional[str], directory: Optional[str] = None) -> Optional[Batch]:
+    """Returns the last batch recorded for a device, or None if there is none."""
+    batches = read_batches(serial, directory)
+    return batches[-1] if batches else None
+
+
+def interrupted_batch(serial: Optional[str], directory: Optional[str] = None) -> Optional[Batch]:
+    """Returns the last batch of a device if it stopped before all its packages were confirmed.
+
+    A batch is interrupted if it has no end, because the application died while it
+    ran, or if it failed. Cancelled batches were stopped on purpose and are not returned.
+    """
+    batch = last_batch(serial, directory)
+    if (
+        batch
+        and batch.status in (None, FAILED)
+        and len(batch.results) < len(batch.operations)
+    ):
+        return batch
+    return None
+
+
+def batch_users(batches: list) -> list:
+    """Returns the sorted ids of the users whose packages batches changed."""
+    return sorted({i.user for batch in batches for i in batch.operations})
+
+
+def resume_plan(batch: Batch, states: dict) -> list:
+    """Builds the plan that finishes an interrupted batch.
+
+    The operations without a confirmed result are planned again against the current
+    state of the device, so a package the device changed just before the interruption,
+    without the result reaching the journal, is not changed twice.
+
+    Args:
+        batch (Batch): The interrupted batch.
+        states (dict): Maps the users of the batch, see batch_users, to their
+            currently installed and removed packages.
+
+    Returns:
+        list: The plan.Operation objects left to execute.
+    """
+    confirmed = {(i.package, i.user) for i in batch.results}
+    return plan.replan(
+        [i for i in batch.operations if (i.package, i.user) not in confirmed], states
+    )
+
+
+def undo_batches(serial: Optional[str], directory: Optional[str] = None) -> list:
+    """Returns the batches undone by a rollback of a device.
+
+    This is the last batch, with the interrupted batches it resumed, since they make
+    up one batch started by the user.
+
+    Returns:
+        list: The Batch objects, oldest first. Empty if the device has no batch.
+    """
+    batches = read_batches(serial, directory)
+    start = len(batches) - 1
+    while start > 0 and batches[start - 1].status == RESUMED:
+        start -= 1
+    return batches[max(start, 0) :]
+
+
+def rollback_plan(batches: list, states: dict) -> list:
+    """Builds the plan that undoes the packages changed by batches.
+
+    Uninstalled packages are reinstalled with `pm install-existing` and reinstalled
+    packages are uninstalled again. The operations of an interrupted batch without a
+    confirmed result may have run anyway, so they are undone too if the current state
+    of the device shows they did. Undoing a rollback redoes the batch it undid.
+
+    Args:
+        batches (list): The Batch objects to undo, such as those of undo_batches.
+        states (dict): Maps the users of the batches, see batch_users, to their
+            currently installed and removed packages.
+
+    Returns:
+        list: The plan.Operation objects of the rollback.
+    """
+    inverse = []
+    for batch in batches:
+        failed = {(i.package, i.user) for i in batch.results if not i.success}
+        for operation in batch.operations:
+            if (operation.package, operation.user) not in failed:
+                action = plan.UNINSTALL if operation.action == plan.REINSTALL else plan.REINSTALL
+                inverse.append(operation._replace(action=action))
+    return plan.replan(inverse, states)
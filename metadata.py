@@ -0,0 +1,263 @@
+"""Package details of a device: system or user app, APK path, version and data size.
+
+The details are read from `pm list packages -f`, `dumpsys diskstats` and
+`dumpsys package`, parsed line by line as the output streams in. Versions are the
+expensive part, so they are cached on disk per device and build fingerprint, and
+later refreshes only query `dumpsys package` for packages whose APK path changed
+(an update installs the APK under a new path) or that were not seen before.
+"""
+import hashlib
+import json
+import os
+from contextlib import closing
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+import adb
+import paths
+
+CACHE_VERSION = 1
+# above this many stale packages, one full `dumpsys package packages` is cheaper than one dump per package
+FULL_DUMP_THRESHOLD = 100
+
+
+class PackageInfo(NamedTuple):
+    """Details of a package installed or removed on a device."""
+
+    system: bool
+    apk_path: str
+    version: str
+    data_size: Optional[int]
+
+
+def is_not_marker(line: str) -> bool:
+    """Returns whether a line is not the RESULT_MARKER separating command outputs."""
+    return line.strip() != adb.RESULT_MARKER
+
+
+class Sections:
+    """Splits the output lines of a script at the RESULT_MARKER lines, counting the markers read.
+
+    The output of a shell session cut off by a dropped connection ends without an error,
+    so the number of markers tells whether every command finished.
+    """
+
+    def __init__(self, lines: Iterable[str]) -> None:
+        """Initializes the sections of the output lines."""
+        self.lines = iter(lines)
+        self.markers = 0
+
+    def next_section(self) -> Iterator[str]:
+        """Yields the lines up to the next marker, or up to the end of the output."""
+        for line in self.lines:
+            if not is_not_marker(line):
+                self.markers += 1
+                return
+            yield line
+
+
+def parse_package_paths(lines: Iterable[str]) -> Iterator[tuple]:
+    """Parses the output of `pm list packages -f`.
+
+    Args:
+        lines (Iterable[str]): Lines of the form `package:/path/to/base.apk=com.example`.
+
+    Yields:
+        tuple: The package name and the path of its APK.
+    """
+    for line in lines:
+        line = line.strip()
+        if line.startswith("package:"):
+            apk_path, _, name = line[len("package:") :].rpartition("=")
+            yield name, apk_path
+
+
+def parse_diskstats(lines: Iterable[str]) -> dict:
+    """Parses the package data sizes out of the output of `dumpsys diskstats`.
+
+    Args:
+        lines (Iterable[str]): The output lines.
+
+    Returns:
+        dict: Maps package names to the size of their data in bytes. Empty if the
+        device has not computed the sizes yet.
+    """
+    names, sizes = [], []
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key == "Package Names":
+            names = json.loads(value)
+        elif key == "App Data Sizes":
+            sizes = json.loads(value)
+    return dict(zip(names, sizes))
+
+
+def parse_dumpsys_packages(lines: Iterable[str]) -> Iterator[tuple]:
+    """Parses the package versions out of the output of `dumpsys package`.
+
+    Only the `Packages:` section is read; the blocks of other sections, such as the
+    hidden system packages replaced by an update, are skipped.
+
+    Args:
+        lines (Iterable[str]): The output lines.
+
+    Yields:
+        tuple: The package name and its version name.
+    """
+    in_packages = False
+    package = None
+    for line in lines:
+        if line[:1].strip():
+            # a top-level section header
+            in_packages = line.rstrip() == "Packages:"
+            package = None
+            continue
+        if not in_packages:
+            continue
+        line = line.strip()
+        if line.startswith("Package ["):
+            package = line[len("Package [") : line.find("]")]
+        elif package and line.startswith("versionName="):
+            yield package, line[len("versionName=") :]
+            package = None
+
+
+def cache_file(serial: str, fingerprint: str, directory: Optional[str] = None) -> str:
+    """Returns the path of the cache file of a device running a given build."""
+    key = hashlib.sha1(f"{serial}\n{fingerprint}".encode()).hexdigest()
+    return os.path.join(directory or paths.cache_directory(), "metadata", f"{key}.json")
+
+
+def read_cache(file_path: str) -> dict:
+    """Reads a cache file.
+
+    Returns:
+        dict: Maps package names to their (APK path, version) pair. Empty if the file
+        does not exist, cannot be read or was written by another cache version.
+    """
+    try:
+        with open(file_path, "r") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+        return {}
+    return {name: tuple(entry) for name, entry in cache.get("packages", {}).items()}
+
+
+def write_cache(file_path: str, serial: str, fingerprint: str, versions: dict) -> None:
+    """Writes a cache file atomically, so an interrupted write never leaves a corrupt cache.
+
+    Args:
+        file_path (str): Path of the cache file.
+        serial (str): Serial of the device, stored for reference.
+        fingerprint (str): Build fingerprint of the device, stored for reference.
+        versions (dict): Maps package names to their (APK path, version) pair.
+
+    Raises:
+        OSError: If the file cannot be written.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = f"{file_path}.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(
+            {
+                "version": CACHE_VERSION,
+                "serial": serial,
+                "fingerprint": fingerprint,
+                "packages": versions,
+            },
+            file,
+        )
+    os.replace(temporary_path, file_path)
+
+
+def query_versions(serial: Optional[str], package_names: list) -> dict:
+    """Reads the version names of packages from `dumpsys package`.
+
+    Args:
+        serial (Optional[str]): Serial of the target device.
+        package_names (list): The packages to query.
+
+    Returns:
+        dict: Maps package names to their version names. Packages without one are missing.
+
+    Raises:
+        adb.AdbError: If the device is not available or the output is cut off.
+    """
+    if len(package_names) > FULL_DUMP_THRESHOLD:
+        commands = ["dumpsys package packages"]
+    else:
+        commands = [f"dumpsys package {i}" for i in package_names]
+    versions = {}
+    for script in adb.join_commands(commands):
+        # MAX_SERVICE_LENGTH leaves room for the marker below the limit of the device
+        with closing(adb.client.shell(serial, f"{script}; echo {adb.RESULT_MARKER}")) as lines:
+            sections = Sections(lines)
+            versions.update(parse_dumpsys_packages(sections.next_section()))
+        if not sections.markers:
+            raise adb.AdbError("The shell session ended early.")
+    return versions
+
+
+def get_package_info(serial: Optional[str], cache_directory: Optional[str] = None) -> dict:
+    """Returns the details of every package of a device, installed or removed.
+
+    The fingerprint, the APK paths and the data sizes are read in one shell round trip.
+    Versions come from the cache when the APK path of a package is unchanged, and
+    from `dumpsys package` otherwise; the cache is then updated, unless the output
+    was cut off, in which case the details that were read are returned as they are.
+
+    Args:
+        serial (Optional[str]): Serial of the target device.
+        cache_directory (Optional[str]): Directory of the cache, the user cache directory by default.
+
+    Returns:
+        dict: Maps package names to their PackageInfo.
+
+    Raises:
+        adb.AdbError: If the device is not available.
+    """
+    script = "; ".join(
+        (
+            "getprop ro.build.fingerprint",
+            f"echo {adb.RESULT_MARKER}",
+            "pm list packages -f -u -s",
+            f"echo {adb.RESULT_MARKER}",
+            "pm list packages -f -u -3",
+            f"echo {adb.RESULT_MARKER}",
+            "dumpsys diskstats",
+            f"echo {adb.RESULT_MARKER}",
+        )
+    )
+    with closing(adb.client.shell(serial, script)) as lines:
+        sections = Sections(lines)
+        fingerprint = "".join(sections.next_section()).strip()
+        system_paths = dict(parse_package_paths(sections.next_section()))
+        user_paths = dict(parse_package_paths(sections.next_section()))
+        data_sizes = parse_diskstats(sections.next_section())
+    complete = sections.markers == script.count(adb.RESULT_MARKER)
+    apk_paths = {**user_paths, **system_paths}
+
+    file_path = cache_file(serial or "", fingerprint, cache_directory)
+    cached = read_cache(file_path)
+    versions = {
+        name: cached[name]
+        for name, apk_path in apk_paths.items()
+        if cached.get(name, ("",))[0] == apk_path
+    }
+    stale = [i for i in apk_paths if i not in versions]
+    if stale:
+        found = query_versions(serial, stale)
+        versions.update((i, (apk_paths[i], found.get(i, ""))) for i in stale)
+    if complete and (stale or len(versions) != len(cached)):
+        try:
+            write_cache(file_path, serial or "", fingerprint, versions)
+        except OSError:
+            pass  # the details are still valid, only the next refresh is slower
+
+    return {
+        name: PackageInfo(
+            name in system_paths, apk_path, versions[name][1], data_sizes.get(name)
+        )
+        for name, apk_path in apk_paths.items()
+    }
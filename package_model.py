@@ -0,0 +1,376 @@
+import bisect
+import sys
+from itertools import compress, groupby
+from typing import Optional
+
+from PyQt5.QtCore import QAbstractProxyModel, QAbstractTableModel, QModelIndex, Qt
+
+from metadata import PackageInfo
+from search import PackageIndex
+
+# a batch of packages landing in more separate places than this is merged with one
+# model reset, which the views handle faster than that many row inserts
+MAX_INSERT_RUNS = 16
+
+
+def format_size(size: Optional[int]) -> str:
+    """Formats a size in bytes for display, or returns an empty string if it is unknown."""
+    if size is None:
+        return ""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class PackageTableModel(QAbstractTableModel):
+    """Table model of package names with a checkbox column and optional package details.
+
+    The package names are kept as interned strings in a list and the check state
+    as one byte per row in a bytearray, so repopulating the table creates no
+    per-row Qt objects and reading the selection never walks the view. The details
+    (PackageInfo objects) and the users a package is shown for are looked up by name
+    only when a cell is painted.
+    """
+
+    HEADERS = ("", "Package Name", "Type", "Version", "Data Size", "APK Path", "Users")
+    USERS_COLUMN = 6
+
+    def __init__(self, parent=None) -> None:
+        """Initializes an empty package table model."""
+        super().__init__(parent)
+        self.names = []
+        self.checked = bytearray()
+        self.rows = {}  # package name -> row
+        self.details = {}  # package name -> PackageInfo
+        self.users = {}  # package name -> ids of the users the package is in this table for
+        self.search_index = None  # built on the first search after the packages change
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """Returns the number of packages in the model."""
+        return 0 if parent.isValid() else len(self.names)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """Returns the number of columns: the checkbox, the package name and its details."""
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        """Returns the check state, the package name or a package detail of a cell."""
+        if not index.isValid():
+            return None
+        if index.column() == 0 and role == Qt.CheckStateRole:
+            return Qt.Checked if self.checked[index.row()] else Qt.Unchecked
+        if index.column() == 0 or role != Qt.DisplayRole:
+            return None
+        if index.column() == 1:
+            return self.names[index.row()]
+        if index.column() == self.USERS_COLUMN:
+            return ", ".join(map(str, self.users.get(self.names[index.row()], ())))
+        info = self.details.get(self.names[index.row()])
+        if info is None:
+            return None
+        return self.format_detail(info, index.column())
+
+    @staticmethod
+    def format_detail(info: PackageInfo, column: int) -> str:
+        """Returns the text shown for a package detail column."""
+        if column == 2:
+            return "System" if info.system else "User"
+        if column == 3:
+            return info.version
+        if column == 4:
+            return format_size(info.data_size)
+        return info.apk_path
+
+    def setData(self, index: QModelIndex, value, role: int = Qt.EditRole) -> bool:
+        """Checks or unchecks the package of a checkbox cell."""
+        if index.isValid() and index.column() == 0 and role == Qt.CheckStateRole:
+            self.checked[index.row()] = value == Qt.Checked
+            self.dataChanged.emit(index, index, [role])
+            return True
+        return False
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        """Makes the first column checkable and the package names selectable."""
+        if not index.isValid():
+            return Qt.NoItemFlags
+        if index.column() == 0:
+            return Qt.ItemIsUserCheckable | Qt.ItemIsEnabled
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        """Returns the column titles of the horizontal header."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section] if 0 <= section < len(self.HEADERS) else None
+        return super().headerData(section, orientation, role)
+
+    def set_packages(
+        self,
+        package_names: list,
+        details: Optional[dict] = None,
+        search_index: Optional[PackageIndex] = None,
+        users: Optional[dict] = None,
+    ) -> None:
+        """Replaces the packages of the model, unchecking all of them.
+
+        Args:
+            package_names (list): The sorted package names to show.
+            details (Optional[dict]): Maps package names to their PackageInfo; the
+                detail columns stay empty for packages without one.
+            search_index (Optional[PackageIndex]): The index of `package_names`, if it
+                was already built off the GUI thread.
+            users (Optional[dict]): Maps package names to the ids of the users they
+                are shown for; the users column stays empty for packages without one.
+
+        Returns:
+            None
+        """
+        self.beginResetModel()
+        self.names = [sys.intern(i) for i in package_names]
+        self.checked = bytearray(len(self.names))
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.details = details or {}
+        self.users = users or {}
+        self.search_index = search_index
+        self.endResetModel()
+
+    def update_packages(
+        self,
+        package_names: list,
+        details: Optional[dict] = None,
+        search_index: Optional[PackageIndex] = None,
+        users: Optional[dict] = None,
+    ) -> None:
+        """Replaces the packages of the model like set_packages, unless they did not change.
+
+        When the model already holds exactly these packages, for example because they were
+        streamed in with insert_packages, the rows and their check states are kept and
+        only the detail and users columns are updated, so the view does not reset.
+        """
+        if package_names != self.names:
+            self.set_packages(package_names, details, search_index, users)
+            return
+        self.details = details or {}
+        self.users = users or {}
+        self.search_index = search_index
+        if self.names:
+            self.dataChanged.emit(
+                self.index(0, 2), self.index(len(self.names) - 1, len(self.HEADERS) - 1)
+            )
+
+    def insert_packages(self, package_names: list, user: int) -> None:
+        """Merges packages into the sorted rows as they arrive, keeping the check states.
+
+        The new names are sorted and every run of them that falls between the same two
+        existing rows is inserted with one beginInsertRows call, so a batch usually costs
+        a few row inserts instead of a model reset. A batch scattered over more than
+        MAX_INSERT_RUNS places, as the unordered output of a device gets once the table is
+        partly filled, is merged in one reset instead. Packages already in the model get
+        the user added to their users column.
+
+        Args:
+            package_names (list): The package names, in any order.
+            user (int): The id of the user the packages are listed for.
+
+        Returns:
+            None
+        """
+        new_names = sorted({sys.intern(i) for i in package_names}.difference(self.rows))
+        changed = []  # rows of known packages whose users column changes
+        for name in package_names:
+            if name in self.rows and user not in self.users.get(name, ()):
+                self.users[name] = tuple(sorted(self.users.get(name, ()) + (user,)))
+                changed.append(self.rows[name])
+        if changed:
+            self.dataChanged.emit(
+                self.index(min(changed), self.USERS_COLUMN),
+                self.index(max(changed), self.USERS_COLUMN),
+            )
+        if not new_names:
+            return
+        positions = [bisect.bisect_left(self.names, i) for i in new_names]
+        runs = [
+            (position, [name for _, name in run])
+            for position, run in groupby(zip(positions, new_names), key=lambda i: i[0])
+        ]
+        reset = len(runs) > MAX_INSERT_RUNS
+        self.search_index = None
+        if reset:
+            self.beginResetModel()
+        inserted = 0
+        for position, run in runs:
+            row = position + inserted
+            if not reset:
+                self.beginInsertRows(QModelIndex(), row, row + len(run) - 1)
+            self.names[row:row] = run
+            self.checked[row:row] = bytes(len(run))
+            for name in run:
+                self.users[name] = (user,)
+            if not reset:
+                self.endInsertRows()
+            inserted += len(run)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        if reset:
+            self.endResetModel()
+
+    def search(self, query: str) -> Optional[list]:
+        """Returns the sorted rows matching a filter query, or None if the query is empty.
+
+        Args:
+            query (str): A substring or glob pattern, see search.PackageIndex.search.
+        """
+        if not query.strip():
+            return None
+        if self.search_index is None:
+            self.search_index = PackageIndex(self.names)
+        return sorted(self.search_index.search(query))
+
+    def checked_packages(self) -> list:
+        """Returns the names of the checked packages, in table order."""
+        return list(compress(self.names, self.checked))
+
+    def set_checked(self, rows: list, checked: bool = True) -> None:
+        """Checks or unchecks several rows at once.
+
+        Args:
+            rows (list): The rows to change.
+            checked (bool): Whether the rows should be checked.
+
+        Returns:
+            None
+        """
+        if not rows:
+            return
+        for row in rows:
+            self.checked[row] = checked
+        self.dataChanged.emit(
+            self.index(min(rows), 0), self.index(max(rows), 0), [Qt.CheckStateRole]
+        )
+
+    def row_of(self, package_name: str) -> Optional[int]:
+        """Returns the row of a package, or None if it is not in the model."""
+        return self.rows.get(package_name)
+
+
+class PackageFilterProxyModel(QAbstractProxyModel):
+    """Proxy model showing only the rows of a PackageTableModel that match a filter query.
+
+    The proxy keeps the sorted source rows of the matches, so changing the filter
+    costs one search and one reset instead of a filter call for every row, and
+    mapping an index in either direction is a list lookup or a binary search.
+    """
+
+    def __init__(self, parent=None) -> None:
+        """Initializes a proxy model without a filter."""
+        super().__init__(parent)
+        self.query = ""
+        self.source_rows = range(0)  # proxy row -> source row, ascending
+
+    def setSourceModel(self, model: PackageTableModel) -> None:
+        """Sets the package model to filter and follows its changes."""
+        super().setSourceModel(model)
+        model.modelAboutToBeReset.connect(self.beginResetModel)
+        model.modelReset.connect(self.reset_rows)
+        model.dataChanged.connect(self.forward_data_changed)
+        model.rowsInserted.connect(self.insert_rows)
+        self.beginResetModel()
+        self.reset_rows()
+
+    def reset_rows(self) -> None:
+        """Matches the filter query against the source model and ends the reset."""
+        model = self.sourceModel()
+        rows = model.search(self.query)
+        self.source_rows = range(model.rowCount()) if rows is None else rows
+        self.endResetModel()
+
+    def set_filter(self, query: str) -> None:
+        """Shows only the packages matching a query.
+
+        Args:
+            query (str): A substring or glob pattern, see search.PackageIndex.search.
+
+        Returns:
+            None
+        """
+        self.query = query
+        self.beginResetModel()
+        self.reset_rows()
+
+    def insert_rows(self, parent: QModelIndex, first: int, last: int) -> None:
+        """Shows the rows inserted into the source model that match the filter query.
+
+        Only the new names are matched, with an index of their own, and the source rows
+        after them are shifted, so streaming packages in never filters the whole table again.
+        """
+        count = last - first + 1
+        if isinstance(self.source_rows, range):  # no filter, every row is shown
+            self.beginInsertRows(QModelIndex(), first, last)
+            self.source_rows = range(len(self.source_rows) + count)
+            self.endInsertRows()
+            return
+        position = bisect.bisect_left(self.source_rows, first)
+        names = self.sourceModel().names[first : last + 1]
+        matches = [first + i for i in sorted(PackageIndex(names).search(self.query))]
+        head = self.source_rows[:position]
+        tail = [i + count for i in self.source_rows[position:]]
+        if not matches:
+            self.source_rows = head + tail
+            return
+        self.beginInsertRows(QModelIndex(), position, position + len(matches) - 1)
+        self.source_rows = head + matches + tail
+        self.endInsertRows()
+
+    def filtered_rows(self) -> list:
+        """Returns the source rows shown by the proxy, in ascending order."""
+        return list(self.source_rows)
+
+    def forward_data_changed(self, top_left: QModelIndex, bottom_right: QModelIndex, roles=()) -> None:
+        """Re-emits a change of the source model for the rows the proxy shows."""
+        first = bisect.bisect_left(self.source_rows, top_left.row())
+        last = bisect.bisect_right(self.source_rows, bottom_right.row()) - 1
+        if first <= last:
+            self.dataChanged.emit(
+                self.index(first, top_left.column()),
+                self.index(last, bottom_right.column()),
+                roles,
+            )
+
+    def mapToSource(self, index: QModelIndex) -> QModelIndex:
+        """Returns the source index of a proxy index."""
+        if not index.isValid():
+            return QModelIndex()
+        return self.sourceModel().index(self.source_rows[index.row()], index.column())
+
+    def mapFromSource(self, index: QModelIndex) -> QModelIndex:
+        """Returns the proxy index of a source index, or an invalid index if it is filtered out."""
+        if not index.isValid():
+            return QModelIndex()
+        row = bisect.bisect_left(self.source_rows, index.row())
+        if row == len(self.source_rows) or self.source_rows[row] != index.row():
+            return QModelIndex()
+        return self.index(row, index.column())
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        """Returns the index of a cell of the flat proxy table."""
+        if parent.isValid() or not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index: QModelIndex = QModelIndex()) -> QModelIndex:
+        """Returns an invalid index: the table has no hierarchy."""
+        return QModelIndex()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """Returns the number of packages matching the filter."""
+        return 0 if parent.isValid() else len(self.source_rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """Returns the number of columns of the source model."""
+        return 0 if parent.isValid() else self.sourceModel().columnCount()
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        """Returns the column titles of the source model, also while no row is shown."""
+        if orientation == Qt.Horizontal:
+            return self.sourceModel().headerData(section, orientation, role)
+        return super().headerData(section, orientation, role)
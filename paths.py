@@ -0,0 +1,37 @@
+"""Locations of the files Android Debloater keeps between runs."""
+import os
+import sys
+
+APP_DIRECTORY_NAME = "android_debloater"
+
+
+def cache_directory() -> str:
+    """Returns the per-user cache directory of the application, without creating it.
+
+    The platform's usual cache location is used: %LOCALAPPDATA% on Windows,
+    ~/Library/Caches on macOS and $XDG_CACHE_HOME (or ~/.cache) elsewhere.
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, APP_DIRECTORY_NAME)
+
+
+def data_directory() -> str:
+    """Returns the per-user data directory of the application, without creating it.
+
+    Unlike the cache, the files kept here cannot be rebuilt from the devices, such as
+    the journal of package changes. The platform's usual location is used: %APPDATA%
+    on Windows, ~/Library/Application Support on macOS and $XDG_DATA_HOME (or
+    ~/.local/share) elsewhere.
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(base, APP_DIRECTORY_NAME)
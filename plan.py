@@ -0,0 +1,203 @@
+from contextlib import closing
+from typing import Callable, Iterator, NamedTuple, Optional
+
+import adb
+import config
+
+UNINSTALL = "uninstall"
+REINSTALL = "reinstall"
+COMMANDS = {UNINSTALL: adb.uninstall_command, REINSTALL: adb.reinstall_command}
+
+
+class Operation(NamedTuple):
+    """A single package change planned for a user of a device."""
+
+    action: str
+    package: str
+    user: int = adb.DEFAULT_USER
+
+
+def build_plan(
+    installed: list,
+    removed: list,
+    remove: set = frozenset(),
+    restore: set = frozenset(),
+    user: int = adb.DEFAULT_USER,
+) -> list:
+    """Builds the minimal list of operations that brings a device to a desired state.
+
+    Only packages whose current state differs from the desired one get an operation:
+    packages to remove that are still installed are uninstalled, and packages to restore
+    that are removed are reinstalled. Reinstalls come first, so a plan never leaves a
+    device with fewer packages than intended if it is interrupted halfway.
+
+    Args:
+        installed (list): The packages currently installed on the device.
+        removed (list): The packages currently removed from the device.
+        remove (set): The packages that should be removed.
+        restore (set): The packages that should be installed.
+        user (int): The user whose packages these are.
+
+    Returns:
+        list: The Operation objects, reinstalls first and sorted by package name.
+    """
+    reinstalls = sorted(set(removed).intersection(restore))
+    uninstalls = sorted(set(installed).intersection(remove).difference(restore))
+    return [Operation(REINSTALL, i, user) for i in reinstalls] + [
+        Operation(UNINSTALL, i, user) for i in uninstalls
+    ]
+
+
+def build_user_plan(
+    states: dict, users: list, remove: set = frozenset(), restore: set = frozenset()
+) -> list:
+    """Builds the plan that brings several users of a device to the same desired state.
+
+    Args:
+        states (dict): Maps user ids to their installed and removed packages, see adb.get_package_states.
+        users (list): The ids of the users to change; users missing from `states` are skipped.
+        remove (set): The packages that should be removed.
+        restore (set): The packages that should be installed.
+
+    Returns:
+        list: The Operation objects of every user, by ascending user id, see build_plan.
+    """
+    operations = []
+    for user in sorted(set(users).intersection(states)):
+        operations += build_plan(*states[user], remove, restore, user)
+    return operations
+
+
+def replan(operations: list, states: dict) -> list:
+    """Plans operations again against the current state of a device.
+
+    Used after an interruption, when some operations may have run without their
+    result being read: those that are already done are dropped, and so are the
+    operations of users that no longer exist. Operations of packages that are in
+    neither list of their user are kept, since nothing shows that they ran.
+
+    Args:
+        operations (list): The Operation objects that may not have run yet.
+        states (dict): Maps user ids to their current installed and removed packages.
+
+    Returns:
+        list: The Operation objects that are still needed.
+    """
+    remaining = []
+    for user in sorted({i.user for i in operations}.intersection(states)):
+        installed, removed = states[user]
+        user_operations = [i for i in operations if i.user == user]
+        remaining += build_plan(
+            installed,
+            removed,
+            remove={i.package for i in user_operations if i.action == UNINSTALL},
+            restore={i.package for i in user_operations if i.action == REINSTALL},
+            user=user,
+        )
+        listed = set(installed).union(removed)
+        remaining += dict.fromkeys(i for i in user_operations if i.package not in listed)
+    return remaining
+
+
+def combine_states(states: dict, users: list) -> tuple:
+    """Combines the package states of several users of a device for display.
+
+    Args:
+        states (dict): Maps user ids to their installed and removed packages.
+        users (list): The ids of the users to combine.
+
+    Returns:
+        tuple: Two dicts, of the packages installed for any of the users and of those
+        removed for any of them, each mapping the sorted package names to the tuple of
+        those user ids.
+    """
+    installed, removed = {}, {}
+    for user in sorted(set(users).intersection(states)):
+        for combined, packages in zip((installed, removed), states[user]):
+            for package in packages:
+                combined[package] = combined.get(package, ()) + (user,)
+    return dict(sorted(installed.items())), dict(sorted(removed.items()))
+
+
+def plan_config(entries: list, installed: list, removed: list, restore: bool = False) -> list:
+    """Builds the plan that applies or restores the entries of a config on a device.
+
+    Args:
+        entries (list): The package names and patterns of the config.
+        installed (list): The sorted packages currently installed on the device.
+        removed (list): The sorted packages currently removed from the device.
+        restore (bool): Whether to reinstall the matching packages instead of uninstalling them.
+
+    Returns:
+        list: The Operation objects of the plan.
+    """
+    if restore:
+        return build_plan(installed, removed, restore=set(config.resolve_entries(entries, removed)[0]))
+    return build_plan(installed, removed, remove=set(config.resolve_entries(entries, installed)[0]))
+
+
+def run_plan(operations: list, serial: Optional[str] = None) -> Iterator[adb.PackageResult]:
+    """Executes a plan on a device over as few shell sessions as possible.
+
+    Args:
+        operations (list): The Operation objects to execute.
+        serial (Optional[str]): Serial of the target device.
+
+    Yields:
+        adb.PackageResult: The result of every operation, in plan order.
+
+    Raises:
+        adb.AdbError: If the device is not available or the session fails.
+    """
+    commands = [COMMANDS[i.action](i.package, i.user) for i in operations]
+    with closing(adb.run_commands(commands, serial)) as results:
+        for operation, (success, message) in zip(operations, results):
+            yield adb.PackageResult(operation.package, success, message, operation.user)
+
+
+def read_states(serial: Optional[str], users: Optional[list] = None) -> dict:
+    """Reads the package states of users of a device, retrying after transient errors.
+
+    Args:
+        serial (Optional[str]): Serial of the device.
+        users (Optional[list]): The user ids, or None for every user of the device.
+
+    Returns:
+        dict: Maps every user id to its installed and removed packages.
+    """
+    import scheduler  # scheduler imports this module
+
+    if users is None:
+        users = [i.user_id for i in scheduler.retry_call(adb.list_users, serial)]
+    return scheduler.retry_call(adb.get_package_states, serial, users)
+
+
+def plan_devices(
+    serials: list,
+    make_plan: Callable[[list, list], list],
+    max_workers: int = 8,
+    users: Optional[list] = (adb.DEFAULT_USER,),
+) -> dict:
+    """Reads the package state of several devices in parallel and builds a plan for each.
+
+    This is the dry run of a fleet operation: nothing is changed on the devices.
+    The states of all the users of a device are read in one shell round trip, and
+    reading them is retried after transient errors.
+
+    Args:
+        serials (list): Serials of the devices.
+        make_plan (Callable[[list, list], list]): Builds a plan from the installed and removed packages of a user.
+        max_workers (int): The maximum number of devices queried at the same time.
+        users (Optional[list]): The ids of the users to plan for, or None for every user of each device.
+
+    Returns:
+        dict: Maps every serial to its list of Operation objects, or to the exception raised while reading its state.
+    """
+
+    def plan_device(serial: str) -> list:
+        operations = []
+        for user, (installed, removed) in sorted(read_states(serial, users).items()):
+            operations += [i._replace(user=user) for i in make_plan(installed, removed)]
+        return operations
+
+    return adb.map_devices(serials, plan_device, max_workers)
@@ -0,0 +1,311 @@
+"""Retries and adaptive concurrency for the package commands sent to devices.
+
+USB links drop, devices go offline for a moment and hubs shared by many devices get
+slow. A plan is run in chunks of a few scripted shell sessions, and when a chunk is
+cut off by a transient error, such as `device offline` or a session that ended
+early, the scheduler waits with exponential backoff, reads the package state of the
+device again and continues with the operations that are still needed. Permanent
+failures, such as `Failure [DELETE_FAILED_INTERNAL_ERROR]`, are reported as results
+and never retried.
+
+When several devices are worked on at once, an AdaptiveLimiter shared by them
+bounds the number of chunks in flight: it grows while the devices answer as fast as
+they did at their best, and halves when they slow down or fail, so a busy hub is
+not overwhelmed and an idle one is kept busy.
+"""
+import random
+import socket
+import threading
+import time
+from contextlib import closing
+from typing import Callable, Generator, Iterator, NamedTuple, Optional
+
+import adb
+import instrumentation
+import plan
+
+# operations per chunk: a chunk cut off by an error is all that has to be checked again
+CHUNK_SIZE = 50
+# parts of adb errors that go away on their own, such as a device reconnecting
+TRANSIENT_ERRORS = (
+    "offline",
+    "device not found",
+    "' not found",  # device 'SERIAL' not found
+    "no devices",
+    "authorizing",
+    "connecting",
+    "ended early",
+    "closed the connection",
+    "listed no packages",  # a package manager that is still starting
+)
+# parts of command output that mean the command did not run because Android was busy,
+# for example while the package manager starts after a reboot
+TRANSIENT_MESSAGES = ("Can't find service", "Is the system running", "DeadObjectException")
+# result message of an operation found already done when the plan was read again after an error
+ALREADY_DONE = "Already done"
+# a chunk slower than this many times the best latency of its device counts as congestion
+LATENCY_TOLERANCE = 2.0
+
+
+class RetryPolicy(NamedTuple):
+    """How often and how long to retry after transient errors."""
+
+    attempts: int = 5  # retries in a row before giving up
+    base_delay: float = 0.5  # seconds before the first retry, doubled for every next one
+    max_delay: float = 8.0
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+def is_transient(error: BaseException) -> bool:
+    """Returns whether an error raised by an adb call may go away if the call is retried.
+
+    Connection errors and timeouts are transient, and so are the adb errors of a device
+    that is offline, reconnecting or still being authorized, or whose package manager
+    is not running yet. Other adb errors, such as an unauthorized device, need the user
+    and are permanent, and so are other OSError such as a journal that cannot be written.
+    """
+    if isinstance(error, adb.AdbError):
+        message = str(error).lower()
+        return any(i in message for i in TRANSIENT_ERRORS) or is_transient_message(str(error))
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+
+
+def is_transient_message(message: str) -> bool:
+    """Returns whether the output of a failed package command means it may succeed later."""
+    return any(i in message for i in TRANSIENT_MESSAGES)
+
+
+def backoff_delay(attempt: int, policy: RetryPolicy = DEFAULT_POLICY) -> float:
+    """Returns the seconds to wait before a retry, with jitter so devices do not retry in step.
+
+    Args:
+        attempt (int): The number of the retry, starting at 1.
+        policy (RetryPolicy): The retry policy.
+    """
+    delay = min(policy.max_delay, policy.base_delay * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def wait(delay: float, serial: Optional[str], cancel_event: Optional[threading.Event]) -> bool:
+    """Waits before a retry, recorded as a `retry_wait` span.
+
+    Returns:
+        bool: False if the wait was cut short by the cancel event, True otherwise.
+    """
+    with instrumentation.span("retry_wait", serial):
+        if cancel_event:
+            return not cancel_event.wait(delay)
+        time.sleep(delay)
+        return True
+
+
+class AdaptiveLimiter:
+    """Bounds the number of chunks run at the same time on a group of devices.
+
+    The limit follows an additive increase, multiplicative decrease rule on the latency
+    per operation of every chunk, compared with the best latency seen on the same
+    device, so slow devices are not mistaken for a congested link.
+    """
+
+    def __init__(self, maximum: int, initial: Optional[int] = None, minimum: int = 1) -> None:
+        """Initializes the limiter.
+
+        Args:
+            maximum (int): The highest limit.
+            initial (Optional[int]): The starting limit, half the maximum by default.
+            minimum (int): The lowest limit.
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial or self.maximum // 2))
+        self.in_flight = 0
+        self.best_latency = {}  # serial -> lowest seconds per operation seen
+        self.condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Waits until a chunk may start."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    def release(
+        self, serial: Optional[str], duration: float, operations: int, failed: bool = False
+    ) -> None:
+        """Ends a chunk and adapts the limit to how it went.
+
+        Args:
+            serial (Optional[str]): Serial of the device the chunk ran on.
+            duration (float): Seconds the chunk took.
+            operations (int): The number of operations of the chunk the device confirmed,
+                0 for a read of the package state, which only lowers the limit if it failed.
+            failed (bool): Whether the chunk was cut off by a transient error.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if failed:
+                self.limit = max(self.minimum, self.limit // 2)
+            elif operations:
+                latency = duration / operations
+                best = min(self.best_latency.get(serial, latency), latency)
+                self.best_latency[serial] = best
+                if latency > LATENCY_TOLERANCE * best:
+                    self.limit = max(self.minimum, self.limit // 2)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1)
+            self.condition.notify_all()
+
+
+def run_chunk(
+    operations: list,
+    serial: Optional[str],
+    limiter: Optional[AdaptiveLimiter],
+    retry_messages: bool,
+) -> Generator[adb.PackageResult, None, tuple]:
+    """Runs a chunk of a plan in scripted shell sessions.
+
+    Args:
+        operations (list): The plan.Operation objects of the chunk.
+        serial (Optional[str]): Serial of the target device.
+        limiter (Optional[AdaptiveLimiter]): Bounds the chunks in flight, if given.
+        retry_messages (bool): Whether operations whose output is transient are held back
+            for a retry instead of being yielded as failures.
+
+    Yields:
+        adb.PackageResult: The results of the operations that are done, in plan order.
+
+    Returns:
+        tuple: The operations to retry and the adb error that cut the chunk off, or None.
+    """
+    confirmed = 0  # results arrive in plan order, so they are matched to the operations by position
+    retry = []
+    error = None
+    if limiter:
+        limiter.acquire()
+    start = time.perf_counter()
+    try:
+        with closing(plan.run_plan(operations, serial)) as results:
+            for result in results:
+                operation = operations[confirmed]
+                confirmed += 1
+                if retry_messages and not result.success and is_transient_message(result.message):
+                    retry.append(operation)
+                else:
+                    yield result
+    except (adb.AdbError, OSError) as chunk_error:
+        error = chunk_error
+    finally:
+        if limiter:
+            limiter.release(serial, time.perf_counter() - start, confirmed, error is not None)
+    return retry + operations[confirmed:], error
+
+
+def run_operations(
+    operations: list,
+    serial: Optional[str],
+    limiter: Optional[AdaptiveLimiter] = None,
+    cancel_event: Optional[threading.Event] = None,
+    policy: RetryPolicy = DEFAULT_POLICY,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[adb.PackageResult]:
+    """Executes a plan on a device like plan.run_plan, retrying after transient errors.
+
+    After a chunk is cut off, the package state of the device is read again and the
+    remaining operations are planned against it, so an operation that ran just before
+    the connection dropped is reported as ALREADY_DONE instead of failing the second time.
+    The chunks of a device get smaller while its link keeps dropping and grow back to
+    `chunk_size` once it holds. Only retries in a row without any progress count
+    against `policy.attempts`. The reads of the package state take a slot of the
+    limiter like the chunks do.
+
+    Args:
+        operations (list): The plan.Operation objects to execute.
+        serial (Optional[str]): Serial of the target device.
+        limiter (Optional[AdaptiveLimiter]): Shared by the devices worked on at the same time.
+        cancel_event (Optional[threading.Event]): Stops the waits between retries when set.
+        policy (RetryPolicy): How often and how long to retry.
+        chunk_size (int): The number of operations per chunk.
+
+    Yields:
+        adb.PackageResult: The result of every operation; an operation listed twice runs once.
+
+    Raises:
+        adb.AdbError: If the device fails with a permanent error, or with a transient one
+            `policy.attempts` times in a row.
+        OSError: If the connection keeps failing.
+    """
+    pending = list(dict.fromkeys(operations))  # an operation listed twice runs once
+    attempt = 0
+    size = chunk_size
+    stale = False  # whether the package state must be read again before continuing
+    while pending:
+        if cancel_event and cancel_event.is_set():
+            return
+        if stale:
+            if limiter:
+                limiter.acquire()
+            start = time.perf_counter()
+            error = None
+            try:
+                states = adb.get_package_states(serial, sorted({i.user for i in pending}))
+            except (adb.AdbError, OSError) as state_error:
+                error = state_error
+            finally:
+                if limiter:
+                    limiter.release(serial, time.perf_counter() - start, 0, error is not None)
+            if not error:
+                remaining = plan.replan(pending, states)
+                done = set(pending).difference(remaining)
+                for operation in pending:
+                    if operation in done:
+                        yield adb.PackageResult(
+                            operation.package, True, ALREADY_DONE, operation.user
+                        )
+                pending, stale = remaining, False
+                continue
+        else:
+            chunk, pending = pending[:size], pending[size:]
+            retry, error = yield from run_chunk(
+                chunk, serial, limiter, attempt < policy.attempts
+            )
+            if len(retry) < len(chunk):
+                attempt = 0  # only retries in a row without progress are counted
+            if not retry:
+                size = min(chunk_size, size * 2)
+                continue
+            pending = retry + pending
+            stale = error is not None
+            if stale:
+                size = max(1, size // 2)  # lose less work on a link that keeps dropping
+        if error and (not is_transient(error) or attempt >= policy.attempts):
+            raise error
+        attempt += 1
+        if not wait(backoff_delay(attempt, policy), serial, cancel_event):
+            return
+
+
+def retry_call(
+    function: Callable,
+    serial: Optional[str],
+    *args,
+    cancel_event: Optional[threading.Event] = None,
+    policy: RetryPolicy = DEFAULT_POLICY,
+):
+    """Calls `function(serial, *args)`, retrying it after transient errors.
+
+    Raises:
+        adb.AdbError: If the call fails with a permanent error, or with a transient one
+            more than `policy.attempts` times.
+        OSError: If the connection keeps failing.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function(serial, *args)
+        except (adb.AdbError, OSError) as error:
+            if not is_transient(error) or attempt >= policy.attempts:
+                raise
+            attempt += 1
+            if not wait(backoff_delay(attempt, policy), serial, cancel_event):
+                raise
@@ -0,0 +1,90 @@
+"""Index of package names that answers filter queries without scanning every name."""
+import bisect
+import fnmatch
+import re
+from collections import defaultdict
+from typing import Optional
+
+import config
+
+# the longest substrings with a posting list; longer ones are narrowed with their rarest one
+GRAM_LENGTH = 3
+
+
+class PackageIndex:
+    """Prefix and substring index over the package names of a table.
+
+    Names are matched case-insensitively. Prefix queries are answered by a binary
+    search over the sorted lowercase names. Every substring of up to three characters
+    has a posting list, so short substring queries are a lookup, and longer ones only
+    verify the candidates of the rarest trigram of the query.
+    """
+
+    def __init__(self, names: list) -> None:
+        """Builds the index of a list of package names.
+
+        Args:
+            names (list): The package names; the row of a name is its position in the list.
+        """
+        self.lowered = [i.lower() for i in names]
+        self.sorted_names = sorted(zip(self.lowered, range(len(self.lowered))))
+        self.sorted_keys = [name for name, _ in self.sorted_names]
+        self.grams = defaultdict(list)  # substring of up to GRAM_LENGTH characters -> rows
+        for row, name in enumerate(self.lowered):
+            grams = {
+                name[i : i + length]
+                for length in range(1, GRAM_LENGTH + 1)
+                for i in range(len(name) - length + 1)
+            }
+            for gram in grams:
+                self.grams[gram].append(row)
+
+    def prefix_rows(self, prefix: str) -> list:
+        """Returns the rows of the names starting with a lowercase prefix."""
+        start = bisect.bisect_left(self.sorted_keys, prefix)
+        end = bisect.bisect_left(self.sorted_keys, prefix + "\uffff", start)
+        return [row for _, row in self.sorted_names[start:end]]
+
+    def substring_rows(self, text: str) -> list:
+        """Returns the rows of the names containing a lowercase substring."""
+        if len(text) <= GRAM_LENGTH:
+            return list(self.grams.get(text, ()))
+        candidates = min(
+            (
+                self.grams.get(text[i : i + GRAM_LENGTH], ())
+                for i in range(len(text) - GRAM_LENGTH + 1)
+            ),
+            key=len,
+        )
+        return [row for row in candidates if text in self.lowered[row]]
+
+    def search(self, query: str) -> Optional[list]:
+        """Returns the rows of the names matching a filter query.
+
+        A plain query matches the names that contain it. A glob pattern must match the
+        whole name like a config entry, so `com.samsung.*` selects a prefix and
+        `*facebook*` is the same as `facebook`.
+
+        Args:
+            query (str): The text typed in the filter box.
+
+        Returns:
+            Optional[list]: The matching rows, or None if the query is empty and every row matches.
+        """
+        query = query.strip().lower()
+        if not query:
+            return None
+        if not config.is_pattern(query):
+            return self.substring_rows(query)
+        inner = query.strip("*")
+        if not config.is_pattern(inner) and query.endswith("*"):
+            if not inner:
+                return list(range(len(self.lowered)))
+            if query.startswith("*"):
+                return self.substring_rows(inner)
+            return self.prefix_rows(inner)
+        # narrow the candidates with the longest literal part of the pattern
+        literal = max(re.split(r"[*?]|\[[^\]]*\]?", query), key=len)
+        candidates = self.substring_rows(literal) if literal else range(len(self.lowered))
+        regex = re.compile(fnmatch.translate(query))
+        return [row for row in candidates if regex.match(self.lowered[row])]
@@ -0,0 +1,296 @@
+"""History of the package state of every device, kept in an SQLite database.
+
+Every refresh saves a snapshot of the installed and removed packages of a device.
+Package names are interned in one table shared by all devices, and a snapshot only
+stores the packages whose state changed since the previous snapshot of the same
+device, so thousands of snapshots of a fleet take little space. The latest state of
+every device is kept in its own table, which answers questions such as "which
+devices still have this package installed" with one index lookup, and the state of
+a device at any past time is rebuilt from the changes up to that time:
+
+    with closing(snapshots.connect()) as connection:
+        snapshots.save_snapshot(connection, serial, model, installed, removed)
+        snapshots.devices_with(connection, "com.facebook.katana")
+        snapshots.diff_states(
+            snapshots.device_state(connection, serial),
+            snapshots.device_state(connection, serial, time.time() - 7 * 86400),
+        )
+"""
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Iterator, NamedTuple, Optional
+
+import paths
+
+SCHEMA_VERSION = 1
+INSTALLED = "installed"
+REMOVED = "removed"
+# stored states; a package that is no longer listed at all is stored as NULL
+STATE_CODES = {INSTALLED: 1, REMOVED: 0}
+STATE_NAMES = {1: INSTALLED, 0: REMOVED}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY, serial TEXT NOT NULL UNIQUE, model TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY, device_id INTEGER NOT NULL, time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_device ON snapshots (device_id, time);
+CREATE TABLE IF NOT EXISTS changes (
+    device_id INTEGER NOT NULL,
+    package_id INTEGER NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    state INTEGER,
+    PRIMARY KEY (device_id, package_id, snapshot_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS current (
+    device_id INTEGER NOT NULL,
+    package_id INTEGER NOT NULL,
+    state INTEGER NOT NULL,
+    PRIMARY KEY (device_id, package_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS current_by_package ON current (package_id, state);
+"""
+
+
+class DeviceMatch(NamedTuple):
+    """A device found by devices_with."""
+
+    serial: str
+    model: str
+    seen: float  # time of the latest snapshot of the device
+
+
+class Difference(NamedTuple):
+    """A package whose state differs between two device states."""
+
+    package: str
+    left: Optional[str]  # INSTALLED, REMOVED or None if the package is not on the device
+    right: Optional[str]
+
+
+def database_file(directory: Optional[str] = None) -> str:
+    """Returns the path of the snapshot database."""
+    return os.path.join(directory or paths.data_directory(), "snapshots.sqlite3")
+
+
+def connect(file_path: Optional[str] = None) -> sqlite3.Connection:
+    """Opens the snapshot database, creating it if needed.
+
+    The database is in WAL mode, so the GUI and the command line front end can read
+    it while the other one saves a snapshot. A connection must stay on the thread that opened it.
+
+    Args:
+        file_path (Optional[str]): Path of the database, database_file() by default.
+
+    Raises:
+        sqlite3.Error: If the database cannot be opened or was written by a newer version.
+        OSError: If its directory cannot be created.
+    """
+    file_path = file_path or database_file()
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    connection = sqlite3.connect(file_path, timeout=10)
+    try:
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise sqlite3.DatabaseError(f"Unsupported snapshot database version {version}.")
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+
+def intern_packages(connection: sqlite3.Connection, names: list) -> dict:
+    """Returns the ids of package names, adding the names that are not known yet.
+
+    Returns:
+        dict: Maps every name to its id.
+    """
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY)")
+    connection.execute("DELETE FROM temp.names")
+    connection.executemany(
+        "INSERT OR IGNORE INTO temp.names (name) VALUES (?)", ((i,) for i in names)
+    )
+    connection.execute(
+        "INSERT OR IGNORE INTO packages (name) SELECT name FROM temp.names"
+    )
+    return dict(
+        connection.execute(
+            "SELECT packages.name, packages.id FROM temp.names"
+            " JOIN packages ON packages.name = temp.names.name"
+        )
+    )
+
+
+def save_snapshot(
+    connection: sqlite3.Connection,
+    serial: str,
+    model: str,
+    installed: list,
+    removed: list,
+    snapshot_time: Optional[float] = None,
+) -> int:
+    """Saves the package state of a device as a new snapshot, in one transaction.
+
+    Only the packages whose state differs from the latest snapshot of the device are
+    written, including the packages that are no longer listed at all.
+
+    Args:
+        connection (sqlite3.Connection): The snapshot database.
+        serial (str): Serial of the device.
+        model (str): Model of the device, or an empty string to keep the known one.
+        installed (list): The packages installed on the device.
+        removed (list): The packages removed from the device.
+        snapshot_time (Optional[float]): Time of the snapshot as a UNIX timestamp, now by default.
+
+    Returns:
+        int: The id of the snapshot.
+
+    Raises:
+        sqlite3.Error: If the snapshot cannot be written.
+    """
+    states = dict.fromkeys(removed, STATE_CODES[REMOVED])
+    states.update(dict.fromkeys(installed, STATE_CODES[INSTALLED]))
+    with connection:
+        connection.execute(
+            "INSERT INTO devices (serial, model) VALUES (?, ?)"
+            " ON CONFLICT (serial) DO UPDATE SET model = COALESCE(NULLIF(excluded.model, ''), model)",
+            (serial, model or ""),
+        )
+        (device_id,) = connection.execute(
+            "SELECT id FROM devices WHERE serial = ?", (serial,)
+        ).fetchone()
+        snapshot_id = connection.execute(
+            "INSERT INTO snapshots (device_id, time) VALUES (?, ?)",
+            (device_id, time.time() if snapshot_time is None else snapshot_time),
+        ).lastrowid
+        ids = intern_packages(connection, list(states))
+        new = {ids[name]: state for name, state in states.items()}
+        old = dict(
+            connection.execute(
+                "SELECT package_id, state FROM current WHERE device_id = ?", (device_id,)
+            )
+        )
+        changed = [(i, state) for i, state in new.items() if old.get(i) != state]
+        gone = [i for i in old if i not in new]
+        connection.executemany(
+            "INSERT INTO changes (device_id, package_id, snapshot_id, state) VALUES (?, ?, ?, ?)",
+            [(device_id, i, snapshot_id, state) for i, state in changed]
+            + [(device_id, i, snapshot_id, None) for i in gone],
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO current (device_id, package_id, state) VALUES (?, ?, ?)",
+            [(device_id, i, state) for i, state in changed],
+        )
+        connection.executemany(
+            "DELETE FROM current WHERE device_id = ? AND package_id = ?",
+            [(device_id, i) for i in gone],
+        )
+    return snapshot_id
+
+
+def try_save_snapshot(
+    serial: str, model: str, installed: list, removed: list, file_path: Optional[str] = None
+) -> Optional[int]:
+    """Saves a snapshot like save_snapshot, in a connection of its own.
+
+    Returns:
+        Optional[int]: The id of the snapshot, or None if the database cannot be written;
+        the packages read from the device are still valid, only the history misses them.
+    """
+    try:
+        with closing(connect(file_path)) as connection:
+            return save_snapshot(connection, serial, model, installed, removed)
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def devices_with(
+    connection: sqlite3.Connection, package: str, state: str = INSTALLED
+) -> list:
+    """Returns the devices whose latest snapshot has a package in a given state.
+
+    Args:
+        connection (sqlite3.Connection): The snapshot database.
+        package (str): The package name.
+        state (str): INSTALLED or REMOVED.
+
+    Returns:
+        list: The DeviceMatch objects, sorted by serial.
+    """
+    return [
+        DeviceMatch(*row)
+        for row in connection.execute(
+            "SELECT devices.serial, devices.model,"
+            " (SELECT MAX(time) FROM snapshots WHERE device_id = devices.id)"
+            " FROM packages"
+            " JOIN current ON current.package_id = packages.id AND current.state = ?"
+            " JOIN devices ON devices.id = current.device_id"
+            " WHERE packages.name = ? ORDER BY devices.serial",
+            (STATE_CODES[state], package),
+        )
+    ]
+
+
+def device_state(
+    connection: sqlite3.Connection, serial: str, at: Optional[float] = None
+) -> Optional[dict]:
+    """Returns the package state of a device, now or at a past time.
+
+    Args:
+        connection (sqlite3.Connection): The snapshot database.
+        serial (str): Serial of the device.
+        at (Optional[float]): A UNIX timestamp; the latest snapshot taken at or before it is used.
+            The latest snapshot by default.
+
+    Returns:
+        Optional[dict]: Maps package names to INSTALLED or REMOVED, or None if the device
+        has no snapshot at that time.
+    """
+    row = connection.execute(
+        "SELECT devices.id, MAX(snapshots.id) FROM devices"
+        " JOIN snapshots ON snapshots.device_id = devices.id"
+        " WHERE devices.serial = ? AND snapshots.time <= ?",
+        (serial, float("inf") if at is None else at),
+    ).fetchone()
+    if row is None or row[1] is None:
+        return None
+    device_id, snapshot_id = row
+    if at is None:
+        rows = connection.execute(
+            "SELECT packages.name, current.state FROM current"
+            " JOIN packages ON packages.id = current.package_id WHERE current.device_id = ?",
+            (device_id,),
+        )
+    else:
+        # the latest change of every package up to the snapshot; SQLite takes the bare
+        # `state` column from the row of the MAX
+        rows = connection.execute(
+            "SELECT packages.name, latest.state FROM ("
+            "  SELECT package_id, state, MAX(snapshot_id) FROM changes"
+            "  WHERE device_id = ? AND snapshot_id <= ? GROUP BY package_id"
+            ") AS latest JOIN packages ON packages.id = latest.package_id"
+            " WHERE latest.state IS NOT NULL",
+            (device_id, snapshot_id),
+        )
+    return {name: STATE_NAMES[state] for name, state in rows}
+
+
+def diff_states(left: dict, right: dict) -> Iterator[Difference]:
+    """Yields the packages whose state differs between two device states, sorted by name.
+
+    Args:
+        left (dict): A state returned by device_state.
+        right (dict): Another state returned by device_state.
+    """
+    for package in sorted(left.keys() | right.keys()):
+        if left.get(package) != right.get(package):
+            yield Difference(package, left.get(package), right.get(package))
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the application are not a package, they are imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adb  # noqa: E402
+from fake_adb_server import FakeAdbServer, FakeDevice  # noqa: E402
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    """Returns a function that serves devices on a fake adb server and points the adb module at it."""
+    servers = []
+
+    def connect(*devices: FakeDevice) -> None:
+        server = FakeAdbServer(list(devices)).start()
+        servers.append(server)
+        monkeypatch.setattr(adb, "client", adb.AdbClient(port=server.port))
+
+    yield connect
+    for server in servers:
+        server.shutdown()
+        server.server_close()
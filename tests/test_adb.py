@@ -0,0 +1,100 @@
+"""Tests of the adb client against a fake adb server."""
+import socket
+import threading
+import time
+
+import pytest
+
+import adb
+import plan
+import scheduler
+from fake_adb_server import FakeAdbServer, FakeDevice
+
+
+class StallingDevice(FakeDevice):
+    """A device whose USB link hangs in the middle of an uninstall, sending nothing more."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.release = threading.Event()
+
+    def run_command(self, args: list) -> tuple:
+        if args[:2] == ["pm", "uninstall"]:
+            self.release.wait(10)
+        return super().run_command(args)
+
+
+def test_silent_device_times_out(connect, monkeypatch):
+    device = StallingDevice("FAKE001", 3)
+    connect(device)
+    monkeypatch.setattr(adb, "READ_TIMEOUT", 0.2)
+
+    with pytest.raises(TimeoutError):
+        list(adb.run_commands([adb.uninstall_command("com.vendor0.app0")], "FAKE001"))
+    device.release.set()
+
+
+def test_abort_releases_a_thread_waiting_for_a_device(connect):
+    device = StallingDevice("FAKE001", 3)
+    connect(device)
+    cancel_event = threading.Event()
+    operations = [plan.Operation(plan.UNINSTALL, i) for i in sorted(device.installed)]
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.extend(
+            scheduler.run_operations(operations, "FAKE001", cancel_event=cancel_event)
+        )
+    )
+    thread.start()
+    time.sleep(0.2)
+
+    cancel_event.set()
+    adb.client.abort()
+    thread.join(2)
+
+    assert not thread.is_alive()
+    assert results == []
+    device.release.set()
+
+
+def test_server_is_started_again_after_it_is_killed(monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    servers = []
+
+    def start_server(args: list, **kwargs) -> None:
+        servers.append(FakeAdbServer([FakeDevice("FAKE001", 3)], port).start())
+
+    monkeypatch.setattr(adb.subprocess, "run", start_server)
+    client = adb.AdbClient(port=port)
+    try:
+        assert "FAKE001" in client.host_request("host:devices-l")
+        servers[0].shutdown()
+        servers[0].server_close()  # adb kill-server
+
+        assert "FAKE001" in client.host_request("host:devices-l")
+        assert len(servers) == 2
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def test_every_shell_closes_its_connection(connect, monkeypatch):
+    connect(FakeDevice("FAKE001", 3))
+    connections = []
+    create_connection = socket.create_connection
+
+    def record(*args, **kwargs) -> socket.socket:
+        connections.append(create_connection(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(adb.socket, "create_connection", record)
+    for _ in range(10):
+        assert adb.get_device_model("FAKE001") == "Fake FAKE001"
+    with pytest.raises(adb.AdbError):
+        adb.client.device_request("MISSING", "shell:true")
+
+    assert len(connections) == 11
+    assert all(i.fileno() == -1 for i in connections)
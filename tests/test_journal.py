@@ -0,0 +1,46 @@
+"""Tests of resuming and undoing the batches recorded in the journal."""
+import journal
+import plan
+from fake_adb_server import FakeDevice
+
+
+def interrupt(operations: list, directory: str) -> journal.Batch:
+    """Records a batch that never ended, as if the application died while it ran."""
+    writer = journal.JournalWriter("FAKE001", operations, "uninstall", directory)
+    writer.file.close()
+    return journal.interrupted_batch("FAKE001", directory)
+
+
+def test_resume_marks_the_interrupted_batch_once_started(connect, tmp_path):
+    device = FakeDevice("FAKE001", 3)
+    connect(device)
+    app0, app1, _ = sorted(device.installed)
+    batch = interrupt([plan.Operation(plan.UNINSTALL, i) for i in (app0, app1)], tmp_path)
+    resume = journal.run_journaled(
+        [plan.Operation(plan.UNINSTALL, app1)], "FAKE001", "resume", tmp_path, resumes=batch
+    )
+
+    assert journal.interrupted_batch("FAKE001", tmp_path) == batch
+    assert [i.package for i in resume] == [app1]
+    assert [i.status for i in journal.read_batches("FAKE001", tmp_path)] == [
+        journal.RESUMED,
+        journal.COMPLETED,
+    ]
+    assert len(journal.undo_batches("FAKE001", tmp_path)) == 2
+
+
+def test_batch_after_a_completed_resume_is_undone_alone(connect, tmp_path):
+    device = FakeDevice("FAKE001", 3)
+    connect(device)
+    app0, app1, _ = sorted(device.installed)
+    batch = interrupt([plan.Operation(plan.UNINSTALL, app0)], tmp_path)
+    device.installed[app0] = False  # it ran, but its result never reached the journal
+    assert journal.resume_plan(batch, plan.read_states("FAKE001", [0])) == []
+    journal.end_batch("FAKE001", batch, journal.COMPLETED)
+    list(journal.run_journaled([plan.Operation(plan.UNINSTALL, app1)], "FAKE001", "apply", tmp_path))
+
+    batches = journal.undo_batches("FAKE001", tmp_path)
+
+    assert journal.rollback_plan(batches, plan.read_states("FAKE001", [0])) == [
+        plan.Operation(plan.REINSTALL, app1)
+    ]
@@ -0,0 +1,54 @@
+"""Tests of reading and caching the package details of a device."""
+import os
+
+import pytest
+
+import adb
+import metadata
+from fake_adb_server import FakeDevice
+
+
+class DroppingDevice(FakeDevice):
+    """A device whose USB link drops while it prints the output of a command."""
+
+    def __init__(self, *args, drop_at: str = "dumpsys diskstats", **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.drop_at = drop_at
+
+    def run_command(self, args: list) -> tuple:
+        # cut the first session running the command off after its output
+        self.drop_rate = float(" ".join(args).startswith(self.drop_at) and bool(self.drop_at))
+        if self.drop_rate:
+            self.drop_at = ""
+        return super().run_command(args)
+
+
+def cache_files(directory) -> list:
+    return os.listdir(directory / "metadata") if (directory / "metadata").exists() else []
+
+
+def test_complete_read_is_cached(connect, tmp_path):
+    connect(FakeDevice("FAKE001", 5))
+
+    details = metadata.get_package_info("FAKE001", tmp_path)
+
+    assert len(details) == 5
+    assert all(i.data_size is not None for i in details.values())
+    assert len(cache_files(tmp_path)) == 1
+
+
+def test_cut_off_read_is_not_cached(connect, tmp_path):
+    connect(DroppingDevice("FAKE001", 5, drop_at="pm list packages -f -u -3"))
+
+    details = metadata.get_package_info("FAKE001", tmp_path)
+
+    assert all(i.data_size is None for i in details.values())
+    assert cache_files(tmp_path) == []
+
+
+def test_cut_off_version_dump_raises(connect, tmp_path):
+    connect(DroppingDevice("FAKE001", 5, drop_at="dumpsys package"))
+
+    with pytest.raises(adb.AdbError, match="ended early"):
+        metadata.get_package_info("FAKE001", tmp_path)
+    assert cache_files(tmp_path) == []
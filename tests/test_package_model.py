@@ -0,0 +1,59 @@
+"""Checks the package models with the model tester of Qt."""
+import pytest
+
+QtCore = pytest.importorskip("PyQt5.QtCore")
+QtTest = pytest.importorskip("PyQt5.QtTest")
+
+from package_model import PackageFilterProxyModel, PackageTableModel  # noqa: E402
+
+
+@pytest.fixture
+def failures():
+    """Collects the failures reported by QAbstractItemModelTester while a test runs."""
+    application = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    messages = []
+
+    def handle(message_type, context, message: str) -> None:
+        if message_type != QtCore.QtDebugMsg:
+            messages.append(message)
+
+    QtCore.qInstallMessageHandler(handle)
+    yield messages
+    QtCore.qInstallMessageHandler(None)
+    del application
+
+
+def test_models_pass_the_model_tester(failures):
+    model = PackageTableModel()
+    proxy_model = PackageFilterProxyModel()
+    proxy_model.setSourceModel(model)
+    mode = QtTest.QAbstractItemModelTester.FailureReportingMode.Warning
+    testers = [QtTest.QAbstractItemModelTester(i, mode) for i in (model, proxy_model)]
+
+    model.set_packages(["com.vendor.b", "com.vendor.d"])
+    proxy_model.set_filter("vendor")
+    model.insert_packages(["com.vendor.a", "com.vendor.c", "com.vendor.e"], 10)
+    model.set_checked([0, 2])
+    model.update_packages(list(model.names), users={"com.vendor.a": (10,)})
+    proxy_model.set_filter("")
+
+    assert testers
+    assert failures == []
+    assert not model.flags(QtCore.QModelIndex())
+
+
+@pytest.mark.parametrize("packages, query", [([], ""), (["com.vendor.a"], "zzz")])
+def test_headers_of_a_proxy_without_rows(failures, packages, query):
+    model = PackageTableModel()
+    model.set_packages(packages)
+    proxy_model = PackageFilterProxyModel()
+    proxy_model.setSourceModel(model)
+    proxy_model.set_filter(query)
+
+    headers = [
+        proxy_model.headerData(i, QtCore.Qt.Horizontal) for i in range(proxy_model.columnCount())
+    ]
+
+    assert proxy_model.rowCount() == 0
+    assert headers == list(PackageTableModel.HEADERS)
+    assert model.headerData(-1, QtCore.Qt.Horizontal) is None
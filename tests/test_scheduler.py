@@ -0,0 +1,139 @@
+"""Tests of the retries of the scheduler against a fake adb server."""
+import shlex
+
+import pytest
+
+import adb
+import plan
+import scheduler
+from fake_adb_server import FakeDevice
+
+FAST_POLICY = scheduler.RetryPolicy(attempts=5, base_delay=0.001, max_delay=0.002)
+
+
+class RebootingDevice(FakeDevice):
+    """A device whose USB link drops after the first uninstall, and whose package
+    manager then answers some listings with an error or with no packages, as while
+    it reconnects."""
+
+    def __init__(self, *args, listing_output: str = "", listing_errors: int = 0, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.drops = 1
+        self.listing_output = listing_output
+        self.listing_errors = listing_errors
+
+    def execute(self, script: str):
+        if self.drops and "pm uninstall" in script:
+            self.drops -= 1
+            self.run_command(shlex.split(script.split(";")[0].replace("2>&1", "")))
+            raise ConnectionError("The USB link dropped.")
+        yield from super().execute(script)
+
+    def run_command(self, args: list) -> tuple:
+        if args[:3] == ["pm", "list", "packages"] and not self.drops and self.listing_errors:
+            self.listing_errors -= 1
+            return 1, self.listing_output
+        return super().run_command(args)
+
+
+@pytest.mark.parametrize(
+    "listing_output",
+    ["Error: Could not access the Package Manager. Is the system running?\n", ""],
+)
+def test_failed_listing_after_drop_is_retried(connect, listing_output):
+    device = RebootingDevice("FAKE001", 5, listing_output=listing_output, listing_errors=1)
+    connect(device)
+    packages = sorted(device.installed)
+    operations = [plan.Operation(plan.UNINSTALL, i) for i in packages]
+
+    results = list(scheduler.run_operations(operations, "FAKE001", policy=FAST_POLICY))
+
+    assert [i.package for i in results] == packages
+    assert all(i.success for i in results)
+    assert [i.message for i in results].count(scheduler.ALREADY_DONE) == 1
+    assert not any(device.installed.values())
+    assert device.listing_errors == 0
+
+
+def test_listing_that_keeps_failing_raises(connect):
+    device = RebootingDevice(
+        "FAKE001", 5, listing_output="Error: Is the system running?\n", listing_errors=100
+    )
+    connect(device)
+    operations = [plan.Operation(plan.UNINSTALL, i) for i in sorted(device.installed)]
+
+    with pytest.raises(adb.AdbError, match="Is the system running"):
+        list(scheduler.run_operations(operations, "FAKE001", policy=FAST_POLICY))
+
+    assert sum(not i for i in device.installed.values()) == 1
+
+
+def test_replan_keeps_packages_missing_from_both_lists():
+    operations = [
+        plan.Operation(plan.UNINSTALL, "com.removed"),
+        plan.Operation(plan.UNINSTALL, "com.installed"),
+        plan.Operation(plan.UNINSTALL, "com.unlisted"),
+        plan.Operation(plan.REINSTALL, "com.unlisted.too", 10),
+    ]
+    states = {0: (["com.installed"], ["com.removed"]), 10: ([], [])}
+
+    assert plan.replan(operations, states) == [
+        plan.Operation(plan.UNINSTALL, "com.installed"),
+        plan.Operation(plan.UNINSTALL, "com.unlisted"),
+        plan.Operation(plan.REINSTALL, "com.unlisted.too", 10),
+    ]
+
+
+def test_replan_drops_operations_of_missing_users():
+    operations = [plan.Operation(plan.UNINSTALL, "com.app", 10)]
+
+    assert plan.replan(operations, {0: (["com.app"], [])}) == []
+
+
+def test_transient_errors():
+    assert scheduler.is_transient(adb.AdbError("device 'FAKE001' not found"))
+    assert scheduler.is_transient(
+        adb.AdbError("Cannot list the packages of user 0: Error: Is the system running?")
+    )
+    assert scheduler.is_transient(adb.AdbError("The package manager listed no packages for user 0."))
+    assert not scheduler.is_transient(
+        adb.AdbError("Cannot list the packages of user 11: Error: user 11 not found")
+    )
+    assert not scheduler.is_transient(adb.AdbError("device unauthorized."))
+
+
+def test_state_reads_take_a_slot_of_the_limiter(connect, monkeypatch):
+    device = RebootingDevice("FAKE001", 5)
+    connect(device)
+    limiter = scheduler.AdaptiveLimiter(4)
+    slots = []
+    read_states = adb.get_package_states
+
+    def get_package_states(serial, users):
+        slots.append(limiter.in_flight)
+        return read_states(serial, users)
+
+    monkeypatch.setattr(adb, "get_package_states", get_package_states)
+    operations = [plan.Operation(plan.UNINSTALL, i) for i in sorted(device.installed)]
+
+    list(scheduler.run_operations(operations, "FAKE001", limiter, policy=FAST_POLICY))
+
+    assert slots == [1]
+    assert limiter.in_flight == 0
+
+
+def test_operations_of_the_same_package_in_one_chunk(connect):
+    device = FakeDevice("FAKE001", 3)
+    connect(device)
+    app0, app1, _ = sorted(device.installed)
+    operations = [
+        plan.Operation(plan.UNINSTALL, app0),
+        plan.Operation(plan.UNINSTALL, app0),
+        plan.Operation(plan.UNINSTALL, app1),
+        plan.Operation(plan.REINSTALL, app1),
+    ]
+
+    results = list(scheduler.run_operations(operations, "FAKE001", policy=FAST_POLICY))
+
+    assert [(i.package, i.success) for i in results] == [(app0, True), (app1, True), (app1, True)]
+    assert not device.installed[app0] and device.installed[app1]